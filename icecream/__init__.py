@@ -10,9 +10,28 @@
 # License: MIT
 #
 
+import importlib
+from typing import Any
+
 from .icecream import *  # noqa
 from .builtins import install, uninstall
 
+# The sinks, and asyncio, socket, and the rest they import, are only
+# imported when first used, so `import icecream` stays fast, and doesn't
+# import asyncio for currentTaskName() to find.
+SINKS = (
+    'Sink', 'RecordSink', 'AsyncioSink', 'RotatingFileSink',
+    'FlightRecorderSink', 'BinaryTraceSink', 'SocketSink', 'Collector',
+    'readFlightRecording', 'readBinaryTrace')
+
+
+def __getattr__(name: str) -> Any:
+    if name in SINKS:
+        # Absolute, as __version__'s globals, below, replace __name__.
+        return getattr(importlib.import_module('icecream.sinks'), name)
+    raise AttributeError("module 'icecream' has no attribute %r" % name)
+
+
 # Import all variables in __version__.py without explicit imports.
 from . import __version__
 globals().update(dict((k, v) for k, v in __version__.__dict__.items()))
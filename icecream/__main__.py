@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+#
+# IceCream - Never use print() to debug again
+#
+# Ansgar Grunseid
+# grunseid.com
+# grunseid@gmail.com
+#
+# License: MIT
+#
+
+import argparse
+import signal
+import sys
+from typing import Any, Dict, List, Optional, TextIO
+
+from .icecream import IceCreamDebugger, jsonDumps
+from .sinks import (
+    DEFAULT_COLLECT_WINDOW, Collector, readBinaryTrace, readFlightRecording)
+
+
+def dump(args: argparse.Namespace) -> int:
+    try:
+        records = readFlightRecording(args.path)
+    except (OSError, ValueError) as e:
+        print('icecream: %s' % e, file=sys.stderr)
+        return 1
+
+    for seq, output in records:
+        if args.seq:
+            output = '#%i %s' % (seq, output)
+        print(output)
+    return 0
+
+
+def decode(args: argparse.Namespace) -> int:
+    ic = IceCreamDebugger()
+    try:
+        for record in readBinaryTrace(args.path):
+            if args.format == 'json':
+                print(jsonDumps(record))
+            else:
+                print(ic.formatRecord(record))
+    except (OSError, ValueError) as e:
+        print('icecream: %s' % e, file=sys.stderr)
+        return 1
+    return 0
+
+
+def collect(args: argparse.Namespace) -> int:
+    ic = IceCreamDebugger()
+    out: TextIO = (
+        sys.stdout if args.output is None
+        else open(args.output, 'a', encoding='utf-8'))
+
+    def output(record: Dict[str, Any]) -> None:
+        if args.format == 'json':
+            out.write(jsonDumps(record) + '\n')
+        else:
+            out.write(ic.formatRecord(record, includePid=True) + '\n')
+        out.flush()
+
+    collector = Collector(args.path, output, window=args.window)
+    signal.signal(signal.SIGTERM, lambda *_: collector.stop())
+    print('icecream: collecting from %s' % args.path, file=sys.stderr)
+    try:
+        collector.serveForever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m icecream')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    dumpParser = commands.add_parser(
+        'dump', help="print a FlightRecorderSink's ring buffer, oldest first")
+    dumpParser.add_argument('path')
+    dumpParser.add_argument(
+        '--seq', action='store_true', help='prefix records with their sequence number')
+    dumpParser.set_defaults(run=dump)
+
+    decodeParser = commands.add_parser(
+        'decode', help="print a BinaryTraceSink's trace as text or JSON Lines")
+    decodeParser.add_argument('path')
+    decodeParser.add_argument(
+        '--format', choices=['text', 'json'], default='text')
+    decodeParser.set_defaults(run=decode)
+
+    collectParser = commands.add_parser(
+        'collect', help="merge the records SocketSinks send to a Unix socket")
+    collectParser.add_argument('path', help='the Unix socket to listen on')
+    collectParser.add_argument(
+        '-o', '--output', help='file to append to, instead of stdout')
+    collectParser.add_argument(
+        '--format', choices=['text', 'json'], default='text')
+    collectParser.add_argument(
+        '--window', type=float, default=DEFAULT_COLLECT_WINDOW,
+        help='seconds to hold records back to order them by timestamp')
+    collectParser.set_defaults(run=collect)
+
+    args = parser.parse_args(argv)
+    rc: int = args.run(args)
+    return rc
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,475 @@
+# -*- coding: utf-8 -*-
+
+#
+# IceCream - Never use print() to debug again
+#
+# Ansgar Grunseid
+# grunseid.com
+# grunseid@gmail.com
+#
+# License: MIT
+#
+
+"""
+Benchmarks for ic()'s hot paths. Run them with `python -m icecream.bench`.
+"""
+
+import argparse
+import gc
+import json
+import linecache
+import os
+import platform
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from .__version__ import __version__
+from .icecream import IceCreamDebugger, colorize, jsonDumps
+
+DEFAULT_CALLS = 20000  # Per thread.
+MIN_REPEAT_SECONDS = 0.1  # Unless a number of calls is given.
+DEFAULT_REPEAT = 5
+DEFAULT_COLD_CALLS = 200
+DEFAULT_ALLOCATION_CALLS = 1000
+
+
+def gilEnabled() -> bool:
+    isGilEnabled = getattr(sys, '_is_gil_enabled', None)
+    return True if isGilEnabled is None else bool(isGilEnabled())
+
+
+def defaultThreadCounts() -> List[int]:
+    counts, n = [], 1
+    while n < (os.cpu_count() or 1):
+        counts.append(n)
+        n *= 2
+    return counts + [os.cpu_count() or 1]
+
+
+def discard(s: str) -> None:
+    pass
+
+
+def discardColorized(s: str) -> None:
+    colorize(s)
+
+
+def threadScaling(
+    threadCounts: Sequence[int],
+    calls: int = DEFAULT_CALLS,
+    outputFunction: Callable[[str], None] = discard,
+) -> List[Dict[str, Any]]:
+    """
+    Measure the total throughput of ic() calls made from each number of
+    threads in <threadCounts>, each thread making <calls> calls. On a
+    free-threaded build, throughput should scale with the thread count
+    up to the number of cores; with the GIL, it can't.
+    """
+    results: List[Dict[str, Any]] = []
+    for threadCount in threadCounts:
+        ic = IceCreamDebugger(outputFunction=outputFunction)
+        barrier = threading.Barrier(threadCount + 1)
+
+        def work() -> None:
+            barrier.wait()
+            for i in range(calls):
+                ic(i)
+
+        threads = [threading.Thread(target=work) for _ in range(threadCount)]
+        for thread in threads:
+            thread.start()
+        barrier.wait()
+        start = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        callsPerSecond = threadCount * calls / elapsed
+        baseline = results[0]['calls_per_second'] if results else callsPerSecond
+        results.append({
+            'threads': threadCount,
+            'calls_per_second': callsPerSecond,
+            'speedup': callsPerSecond / baseline,
+        })
+    return results
+
+
+# The suite's benchmarks. Each takes an IceCreamDebugger, configures it,
+# and returns a function that makes one call.
+SUITE: Dict[str, Callable[[IceCreamDebugger], Callable[[], object]]] = {}
+
+
+def benchmark(name: str) -> Callable:
+    def register(setup: Callable) -> Callable:
+        SUITE[name] = setup
+        return setup
+    return register
+
+
+@benchmark('disabled')
+def benchDisabled(ic: IceCreamDebugger) -> Callable[[], object]:
+    ic.disable()
+    x = 1
+    return lambda: ic(x)
+
+
+@benchmark('bare')
+def benchBare(ic: IceCreamDebugger) -> Callable[[], object]:
+    return lambda: ic()
+
+
+@benchmark('int')
+def benchInt(ic: IceCreamDebugger) -> Callable[[], object]:
+    x = 1
+    return lambda: ic(x)
+
+
+@benchmark('two_args')
+def benchTwoArgs(ic: IceCreamDebugger) -> Callable[[], object]:
+    a, b = 1, 'two'
+    return lambda: ic(a, b)
+
+
+@benchmark('many_args')
+def benchManyArgs(ic: IceCreamDebugger) -> Callable[[], object]:
+    a, b, c, d, e, f, g, h = range(8)
+    return lambda: ic(a, b, c, d, e, f, g, h)
+
+
+@benchmark('nested_dict')
+def benchNestedDict(ic: IceCreamDebugger) -> Callable[[], object]:
+    d = {
+        'user%i' % i: {
+            'id': i, 'tags': ['a', 'b', 'c'], 'scores': list(range(10)),
+            'address': {'city': 'Springfield', 'zip': '%05i' % i}}
+        for i in range(50)}
+    return lambda: ic(d)
+
+
+@benchmark('flat_list')
+def benchFlatList(ic: IceCreamDebugger) -> Callable[[], object]:
+    # A flat, medium sized list; see safe_pformat().
+    lst = [1000 + i for i in range(30)]
+    return lambda: ic(lst)
+
+
+@benchmark('multiline_string')
+def benchMultilineString(ic: IceCreamDebugger) -> Callable[[], object]:
+    s = '\n'.join('line %i of a multiline string' % i for i in range(20))
+    return lambda: ic(s)
+
+
+@benchmark('include_context')
+def benchIncludeContext(ic: IceCreamDebugger) -> Callable[[], object]:
+    ic.configureOutput(includeContext=True)
+    x = 1
+    return lambda: ic(x)
+
+
+@benchmark('colored')
+def benchColored(ic: IceCreamDebugger) -> Callable[[], object]:
+    ic.configureOutput(outputFunction=discardColorized)
+    d = {'a': 1, 'b': [2, 3], 'c': 'four'}
+    return lambda: ic(d)
+
+
+@benchmark('no_color')
+def benchNoColor(ic: IceCreamDebugger) -> Callable[[], object]:
+    ic.configureOutput(noColor=True, outputFunction=discard)
+    d = {'a': 1, 'b': [2, 3], 'c': 'four'}
+    return lambda: ic(d)
+
+
+@benchmark('format')
+def benchFormat(ic: IceCreamDebugger) -> Callable[[], object]:
+    x = 1
+    return lambda: ic.format(x)
+
+
+def newCallSite(ic: IceCreamDebugger, n: int) -> Callable[[], object]:
+    """
+    Return a function with a call site ic() has never seen, so calling it
+    measures ic()'s first, cold, call: finding the call's ast node and
+    reading its source, uncached.
+    """
+    filename = '<icecream.bench cold %i>' % n
+    source = 'def cold(x):\n    return ic(x)\n'
+    linecache.cache[filename] = (
+        len(source), None, source.splitlines(True), filename)
+    namespace: Dict[str, Any] = {'ic': ic}
+    exec(compile(source, filename, 'exec'), namespace)
+    cold = namespace['cold']
+    return lambda: cold(1)
+
+
+def calibrate(call: Callable[[], object]) -> int:
+    """The number of calls, a power of 2, that take MIN_REPEAT_SECONDS."""
+    calls = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(calls):
+            call()
+        if time.perf_counter() - start >= MIN_REPEAT_SECONDS:
+            return calls
+        calls *= 2
+
+
+def timeCalls(
+        call: Callable[[], object], calls: Optional[int],
+        repeat: int) -> Dict[str, Any]:
+    """
+    Time <repeat> runs of <calls> calls, or, without <calls>, of as many
+    as take MIN_REPEAT_SECONDS. Returns the ns per call.
+    """
+    call()  # Warm up.
+    if calls is None:
+        calls = calibrate(call)
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        for _ in range(calls):
+            call()
+        runs.append((time.perf_counter_ns() - start) / calls)
+    return {
+        'ns_per_call': statistics.median(runs), 'min_ns_per_call': min(runs),
+        'calls': calls, 'repeat': repeat}
+
+
+def timeColdCalls(calls: int) -> Dict[str, Any]:
+    """Time <calls> first calls, each from a new call site."""
+    ic = IceCreamDebugger(outputFunction=discard)
+    latencies = []
+    for n in range(calls):
+        call = newCallSite(ic, n)
+        start = time.perf_counter_ns()
+        call()
+        latencies.append(time.perf_counter_ns() - start)
+        linecache.cache.pop('<icecream.bench cold %i>' % n, None)
+    return {
+        'ns_per_call': statistics.median(latencies),
+        'min_ns_per_call': min(latencies), 'calls': calls, 'repeat': 1}
+
+
+def suite(
+    names: Optional[Sequence[str]] = None,
+    calls: Optional[int] = None,
+    repeat: int = DEFAULT_REPEAT,
+    coldCalls: int = DEFAULT_COLD_CALLS,
+) -> Dict[str, Any]:
+    """
+    Run the suite's benchmarks, or only those in <names>, and return their
+    results, the median and min ns per call of each, with the environment
+    they ran in, ready to be saved as JSON and compared to another run's.
+    'cold' is the latency of ic()'s first call from a call site; every
+    other benchmark is warm.
+    """
+    results: Dict[str, Dict[str, Any]] = {}
+    for name, setup in SUITE.items():
+        if names is None or name in names:
+            call = setup(IceCreamDebugger(outputFunction=discard))
+            results[name] = timeCalls(call, calls, repeat)
+    if names is None or 'cold' in names:
+        results['cold'] = timeColdCalls(coldCalls)
+
+    return {
+        'icecream': __version__,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'gil_enabled': gilEnabled(),
+        'results': results,
+    }
+
+
+def runSuite(args: argparse.Namespace) -> int:
+    names = args.only.split(',') if args.only else None
+    unknown = set(names or ()) - set(SUITE) - {'cold'}
+    if unknown:
+        print('Unknown benchmarks: %s' % ', '.join(sorted(unknown)),
+              file=sys.stderr)
+        return 2
+    run = suite(names, args.calls, args.repeat, args.cold_calls)
+
+    if args.json:
+        print(jsonDumps(run))
+        return 0
+
+    baseline: Dict[str, Any] = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+
+    print('icecream %s, %s %s' % (
+        run['icecream'], run['implementation'], run['python']))
+    print('%-18s %12s %12s%s' % (
+        'benchmark', 'ns/call', 'min ns/call', ' %10s' % 'vs baseline'
+        if baseline else ''))
+    for name, result in run['results'].items():
+        line = '%-18s %12.0f %12.0f' % (
+            name, result['ns_per_call'], result['min_ns_per_call'])
+        if name in baseline:
+            line += ' %9.2fx' % (
+                result['ns_per_call'] / baseline[name]['ns_per_call'])
+        print(line)
+    return 0
+
+
+# The allocation benchmarks, like the suite's.
+ALLOCATION_BENCHMARKS = ('bare', 'int', 'two_args', 'include_context')
+
+
+def measureAllocations(
+        call: Callable[[], object], calls: int) -> Dict[str, Any]:
+    """
+    Measure, with tracemalloc, the memory <calls> warm calls allocate: the
+    median of each call's peak, how much more memory was allocated at
+    once, at the call's busiest, than before it, and the memory kept
+    after all of them, per call. Garbage is collected before the memory
+    kept is read, so it's only what the calls still reference.
+    """
+    call()  # Warm up.
+    wasTracing = tracemalloc.is_tracing()
+    if not wasTracing:
+        tracemalloc.start()
+    try:
+        gc.collect()
+        before = tracemalloc.get_traced_memory()[0]
+        for _ in range(calls):
+            call()
+        gc.collect()
+        kept = tracemalloc.get_traced_memory()[0] - before
+
+        # Apart, so the peaks, ints, aren't counted as kept.
+        peaks = []
+        for _ in range(calls):
+            tracemalloc.reset_peak()
+            current = tracemalloc.get_traced_memory()[0]
+            call()
+            peaks.append(tracemalloc.get_traced_memory()[1] - current)
+    finally:
+        if not wasTracing:
+            tracemalloc.stop()
+    return {
+        'peak_bytes_per_call': statistics.median(peaks),
+        'kept_bytes_per_call': kept / calls,
+        'calls': calls,
+    }
+
+
+def allocations(
+    names: Sequence[str] = ALLOCATION_BENCHMARKS,
+    calls: int = DEFAULT_ALLOCATION_CALLS,
+) -> Dict[str, Dict[str, Any]]:
+    """Measure the memory each of the suite's benchmarks in <names> allocates."""
+    return {
+        name: measureAllocations(
+            SUITE[name](IceCreamDebugger(outputFunction=discard)), calls)
+        for name in names}
+
+
+def runAllocations(args: argparse.Namespace) -> int:
+    names = args.only.split(',') if args.only else ALLOCATION_BENCHMARKS
+    unknown = set(names) - set(SUITE)
+    if unknown:
+        print('Unknown benchmarks: %s' % ', '.join(sorted(unknown)),
+              file=sys.stderr)
+        return 2
+    results = allocations(names, args.calls)
+
+    if args.json:
+        print(jsonDumps({'icecream': __version__, 'results': results}))
+        return 0
+
+    print('%-18s %14s %14s' % ('benchmark', 'peak B/call', 'kept B/call'))
+    for name, result in results.items():
+        print('%-18s %14.0f %14.1f' % (
+            name, result['peak_bytes_per_call'],
+            result['kept_bytes_per_call']))
+    return 0
+
+
+def threads(args: argparse.Namespace) -> int:
+    threadCounts = (
+        [int(n) for n in args.threads.split(',')] if args.threads
+        else defaultThreadCounts())
+    results = threadScaling(
+        threadCounts, args.calls,
+        discardColorized if args.colorize else discard)
+
+    if args.json:
+        print(jsonDumps({'gil_enabled': gilEnabled(), 'results': results}))
+        return 0
+
+    print('GIL %s, %i cores' % (
+        'enabled' if gilEnabled() else 'disabled', os.cpu_count() or 1))
+    print('%8s %14s %8s' % ('threads', 'calls/s', 'speedup'))
+    for result in results:
+        print('%8i %14.0f %7.2fx' % (
+            result['threads'], result['calls_per_second'], result['speedup']))
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m icecream.bench')
+    benchmarks = parser.add_subparsers(dest='benchmark', required=True)
+
+    suiteParser = benchmarks.add_parser(
+        'suite', help='ic() latency on its hot paths (the default)')
+    suiteParser.add_argument(
+        '--only', help='comma separated benchmarks, like bare,int,cold')
+    suiteParser.add_argument(
+        '--calls', type=int,
+        help='calls per repeat; by default, as many as take %gs' % (
+            MIN_REPEAT_SECONDS))
+    suiteParser.add_argument(
+        '--repeat', type=int, default=DEFAULT_REPEAT, help='repeats')
+    suiteParser.add_argument(
+        '--cold-calls', type=int, default=DEFAULT_COLD_CALLS,
+        help='first calls, from new call sites, to time')
+    suiteParser.add_argument(
+        '--json', action='store_true', help='output the results as JSON')
+    suiteParser.add_argument(
+        '--compare', metavar='FILE',
+        help="compare to a previous run's JSON results")
+    suiteParser.set_defaults(run=runSuite)
+
+    allocationsParser = benchmarks.add_parser(
+        'allocations', help='memory ic() allocates per call, with tracemalloc')
+    allocationsParser.add_argument(
+        '--only', help='comma separated benchmarks, like bare,two_args')
+    allocationsParser.add_argument(
+        '--calls', type=int, default=DEFAULT_ALLOCATION_CALLS,
+        help='calls to measure')
+    allocationsParser.add_argument(
+        '--json', action='store_true', help='output the results as JSON')
+    allocationsParser.set_defaults(run=runAllocations)
+
+    threadsParser = benchmarks.add_parser(
+        'threads', help='ic() throughput across threads')
+    threadsParser.add_argument(
+        '--threads', help='comma separated thread counts, like 1,2,4,8')
+    threadsParser.add_argument(
+        '--calls', type=int, default=DEFAULT_CALLS, help='calls per thread')
+    threadsParser.add_argument(
+        '--colorize', action='store_true', help='colorize every output too')
+    threadsParser.add_argument(
+        '--json', action='store_true', help='output the results as JSON')
+    threadsParser.set_defaults(run=threads)
+
+    if argv is None:
+        argv = sys.argv[1:]
+    if not argv or argv[0] not in benchmarks.choices and argv[0] not in (
+            '-h', '--help'):
+        argv = ['suite'] + argv
+
+    args = parser.parse_args(argv)
+    rc: int = args.run(args)
+    return rc
+
+
+if __name__ == '__main__':
+    sys.exit(main())
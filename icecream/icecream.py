@@ -11,20 +11,41 @@
 # License: MIT
 #
 
+import abc
 import ast
+import atexit
 import enum
 import inspect
+import json
+import logging
+import math
+import os
 import pprint
+import random
+import re
+import signal
+import string
 import sys
-from types import FrameType
+import threading
+import time
+import uuid
+import weakref
+from collections import deque
+from contextvars import ContextVar
+from fnmatch import fnmatchcase
+from types import CodeType, FrameType
 from typing import (
     Optional,
     cast,
     Any,
     Callable,
+    Deque,
+    Dict,
     Generator,
+    Iterable,
     List,
     Sequence,
+    TextIO,
     Tuple,
     Type,
     Union,
@@ -49,16 +70,25 @@ from pygments.lexers import Python3Lexer as Py3Lexer  # type: ignore
 
 from .coloring import SolarizedDark
 
+try:
+    import orjson  # type: ignore
+except ImportError:  # Optional; fall back to the json module.
+    orjson = None  # type: ignore[assignment]
+
 
 class Sentinel(enum.Enum):
     absent = object()
 
 
-def bindStaticVariable(name: str, value: Any) -> Callable:
-    def decorator(fn: Callable) -> Callable:
-        setattr(fn, name, value)
-        return fn
-    return decorator
+MAX_LITERAL_CACHE_SIZE = 4096  # Argument sources.
+
+# The line boundaries str.splitlines() splits at. MULTILINE matches only
+# those that aren't at the very end of a string, so it matches exactly the
+# strings splitlines() would split into two or more lines.
+LINE_BOUNDARY = re.compile('[\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]')
+MULTILINE = re.compile(
+    '(?:\r\n|\r(?!\n)|[\n\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029])(?=.)',
+    re.DOTALL)
 
 
 def has_non_ascii_chars(s: str) -> bool:
@@ -66,21 +96,26 @@ def has_non_ascii_chars(s: str) -> bool:
     return any(ord(char) > 127 for char in s)
 
 
-@bindStaticVariable('formatter', Terminal256Formatter(style=SolarizedDark))
-@bindStaticVariable('lexer', Py3Lexer(ensurenl=False))
-def colorize(s: str) -> str:
-    self = colorize
+class ColorizeState(threading.local):
+    # Every thread gets its own lexer and formatter. Pygments' aren't
+    # meant to be shared between threads, and on free-threaded builds a
+    # shared pair would be contended by every thread calling ic().
+    def __init__(self) -> None:
+        self.formatter = Terminal256Formatter(style=SolarizedDark)
+        self.lexer = Py3Lexer(ensurenl=False)
+
+
+colorizeState = ColorizeState()
+
 
+def colorize(s: str) -> str:
     # skip syntax highlighting for strings with non-ASCII characters to avoid
     # encoding issues with pygments (fixes issue #222)
     if has_non_ascii_chars(s):
         return s
 
-    return highlight(
-        s,
-        cast(Py3Lexer, self.lexer),  # type: ignore
-        cast(Terminal256Formatter, self.formatter)  # type: ignore
-    )  # pyright: ignore[reportFunctionMemberAccess]
+    state = colorizeState
+    return highlight(s, state.lexer, state.formatter)
 
 
 @contextmanager
@@ -96,15 +131,107 @@ def supportTerminalColorsInWindows() -> Generator:
         yield
 
 
+# Objects, like sinks, that hold locks, threads, or buffers that a forked
+# child can't use as they are. Around os.fork(), their beforeFork(),
+# afterForkInParent(), and afterForkInChild() methods, whichever they
+# have, are called.
+forkHandlers: 'weakref.WeakSet[Any]' = weakref.WeakSet()
+
+
+def registerForkHandlers(obj: object) -> None:
+    forkHandlers.add(obj)
+
+
+def runForkHandlers(method: str) -> None:
+    for obj in list(forkHandlers):
+        handler = getattr(obj, method, None)
+        if handler is not None:
+            handler()
+
+
+if hasattr(os, 'register_at_fork'):  # Not on Windows.
+    os.register_at_fork(
+        before=lambda: runForkHandlers('beforeFork'),
+        after_in_parent=lambda: runForkHandlers('afterForkInParent'),
+        after_in_child=lambda: runForkHandlers('afterForkInChild'))
+
+
+class OutputLock:
+    """
+    Serializes ic()'s writes to stdout and stderr, so concurrent calls'
+    multiline output never interleaves, and counts how often a thread had
+    to wait for it, and for how long.
+
+    Reentrant, as a signal handler that calls ic() runs on a thread that
+    may be holding the lock, mid-write.
+    """
+    def __init__(self) -> None:
+        self._lock = threading.RLock()
+        self.acquisitions = 0
+        self.contentions = 0
+        self.waitNs = 0
+        registerForkHandlers(self)
+
+    def __enter__(self) -> None:
+        if not self._lock.acquire(blocking=False):
+            startNs = time.perf_counter_ns()
+            self._lock.acquire()
+            self.contentions += 1
+            self.waitNs += time.perf_counter_ns() - startNs
+        self.acquisitions += 1
+
+    def __exit__(self, *exc: object) -> None:
+        self._lock.release()
+
+    # Held across fork() so the child never inherits it locked mid-write.
+    def beforeFork(self) -> None:
+        self._lock.acquire()
+
+    def afterForkInParent(self) -> None:
+        self._lock.release()
+
+    def afterForkInChild(self) -> None:
+        self._lock = threading.RLock()
+
+
+outputLock = OutputLock()
+
+
+def writeLine(stream: Optional[TextIO], s: str) -> None:
+    # One write() per record. print() writes the line and its newline
+    # separately, so other threads' output can land between them.
+    if stream is None:  # E.g. sys.stderr under pythonw. Like print().
+        return
+    with outputLock:
+        stream.write(s + '\n')
+
+
 def stderr_print(*args: object) -> None:
-    print(*args, file=sys.stderr)
+    writeLine(sys.stderr, ' '.join(map(str, args)))
 
 
 def stdout_print(*args: object) -> None:
-    print(*args)
+    writeLine(sys.stdout, ' '.join(map(str, args)))
+
+
+def jsonDumps(obj: object) -> str:
+    if orjson is not None:
+        return orjson.dumps(obj).decode('utf-8')
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+
 
+def typeName(obj: object) -> str:
+    cls = type(obj)
+    if cls.__module__ == 'builtins':
+        return cls.__qualname__
+    return '%s.%s' % (cls.__module__, cls.__qualname__)
 
+
+@functools.lru_cache(maxsize=MAX_LITERAL_CACHE_SIZE)
 def isLiteral(s: str) -> bool:
+    # Cached, as every call from a call site asks about the same arguments,
+    # and parsing them allocates an ast, and, if they aren't literals, an
+    # exception, every time.
     try:
         ast.literal_eval(s)
     except Exception:
@@ -121,7 +248,7 @@ def colorizedStderrPrint(s: str) -> None:
 def colorizedStdoutPrint(s: str) -> None:
     colored = colorize(s)
     with supportTerminalColorsInWindows():
-        print(colored)
+        stdout_print(colored)
 
 
 def safe_pformat(obj: object, *args: Any, **kwargs: Any) -> str:
@@ -181,7 +308,41 @@ DEFAULT_PREFIX = 'ic| '
 DEFAULT_LINE_WRAP_WIDTH = 70  # Characters.
 DEFAULT_CONTEXT_DELIMITER = '- '
 DEFAULT_OUTPUT_FUNCTION = colorizedStderrPrint
+DEFAULT_OUTPUT_FORMAT = 'text'
+DEFAULT_LOG_LEVEL = logging.DEBUG
+DEFAULT_THRESHOLD = logging.NOTSET
 DEFAULT_ARG_TO_STRING_FUNCTION = safe_pformat
+DEFAULT_MAX_RECORDED_CALLS = 1000
+
+OUTPUT_FORMATS = ('text', 'json')
+OVERHEAD_CLOCKS = ('wall', 'cpu')
+DEFAULT_OVERHEAD_CLOCK = 'wall'
+DEFAULT_GOVERNOR_WINDOW = 1.0  # Seconds.
+MAX_THROTTLE_INTERVAL = 1 << 20
+DEFAULT_TIMER_LABEL = 'elapsed'
+TIMER_PERCENTILES = (50, 90, 99)
+HISTOGRAM_SUB_BUCKET_BITS = 6
+HISTOGRAM_SUB_BUCKETS = 1 << HISTOGRAM_SUB_BUCKET_BITS
+# Checkpoint histograms, one per pair of call sites, are capped in number
+# and size, so they stay small however many call sites checkpoint each
+# other, and however spread out the times between them are.
+MAX_CHECKPOINT_PAIRS = 4096
+MAX_CHECKPOINT_BUCKETS = 16
+# ic()'s stages, in order. See IceCreamDebugger.stats().
+STAGES = (
+    'frame', 'executing', 'source', 'argToString', 'construct', 'colorize',
+    'output')
+# The fields prefix templates, like '{time:%H:%M:%S} {pid}| ', can have.
+PREFIX_FIELDS = ('time', 'elapsed', 'pid', 'thread', 'thread_id')
+TIMESTAMP_FORMATS = ('clock', 'iso', 'epoch', 'monotonic', 'relative')
+DEFAULT_TIMESTAMP_FORMAT = 'clock'
+
+# Structured output isn't syntax highlighted, so the built-in colorizing
+# output functions are swapped for their plain counterparts.
+PLAIN_OUTPUT_FUNCTIONS: Dict[Callable[..., None], Callable[..., None]] = {
+    colorizedStderrPrint: stderr_print,
+    colorizedStdoutPrint: stdout_print,
+}
 
 """
 This info message is printed instead of the arguments when icecream
@@ -204,11 +365,41 @@ NO_SOURCE_AVAILABLE_WARNING_MESSAGE = (
     'change during execution?')
 
 
+def currentTaskName() -> Optional[str]:
+    # Only look for a running task if asyncio has already been imported;
+    # if it hasn't, there's no event loop and nothing to import.
+    asyncio = sys.modules.get('asyncio')
+    if asyncio is None:
+        return None
+    # Rather than asyncio.current_task(), which raises, and so allocates an
+    # exception, whenever there's no running event loop.
+    loop = asyncio._get_running_loop()
+    if loop is None:
+        return None
+    task = asyncio.current_task(loop)
+    return task.get_name() if task is not None else None
+
+
 def call_or_value(obj: object) -> object:
     return obj() if callable(obj) else obj
 
 
 class Source(executing.Source):
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self._argStrs: Dict[ast.AST, Tuple[str, ...]] = {}
+
+    def get_arg_strs(self, callNode: ast.Call) -> Tuple[str, ...]:
+        """
+        The source of <callNode>'s arguments. Read once per call node, as
+        it's the same for every call from the call site.
+        """
+        argStrs = self._argStrs.get(callNode)
+        if argStrs is None:
+            argStrs = self._argStrs[callNode] = tuple(
+                self.get_text_with_indentation(arg) for arg in callNode.args)
+        return argStrs
+
     def get_text_with_indentation(self, node: ast.expr) -> str:
         result = self.asttokens().get_text(node)
         if '\n' in result:
@@ -260,22 +451,75 @@ class _SingleDispatchCallable:
     register: Callable[[Type], Callable]
 
 
+MAX_DISPATCH_CACHE_SIZE = 1024  # Classes, per thread.
+
+
 def singledispatch(func: Callable) -> _SingleDispatchCallable:
-    func = functools.singledispatch(func)
+    dispatcher = functools.singledispatch(func)
 
     # add unregister based on https://stackoverflow.com/a/25951784
-    assert func.register.__closure__ is not None
-    closure = dict(zip(func.register.__code__.co_freevars,
-                       func.register.__closure__))
+    assert dispatcher.register.__closure__ is not None
+    closure = dict(zip(dispatcher.register.__code__.co_freevars,
+                       dispatcher.register.__closure__))
     registry = closure['registry'].cell_contents
     dispatch_cache = closure['dispatch_cache'].cell_contents
 
+    # Every thread caches its own dispatch decisions, read without locks,
+    # instead of sharing functools' dispatch cache, which every thread
+    # calling ic() would contend on on free-threaded builds. A thread's
+    # cache is dropped once implementations are registered or unregistered,
+    # or ABCs' registrations change.
+    generation = 0
+    caches = threading.local()
+
+    def dispatch(cls: Type) -> Callable:
+        token = (generation, abc.get_cache_token())
+        cache = getattr(caches, 'cache', None)
+        if cache is None or caches.token != token or (
+                len(cache) >= MAX_DISPATCH_CACHE_SIZE):
+            cache = caches.cache = {}
+            caches.token = token
+        try:
+            return cast(Callable, cache[cls])
+        except KeyError:
+            impl = cache[cls] = dispatcher.dispatch(cls)
+            return impl
+
+    def register(cls: Any, func: Optional[Callable] = None) -> Callable:
+        nonlocal generation
+        registered = dispatcher.register(cls, func)
+        if func is None and registered is not cls:
+            # Used as a decorator, like @register(int) or @register(int |
+            # str), so nothing's registered until the decorator's applied.
+            return lambda func: register(cls, func)
+        generation += 1
+        return registered
+
+    def clearCache() -> None:
+        nonlocal generation
+        dispatch_cache.clear()
+        generation += 1
+
     def unregister(cls: Type) -> None:
         del registry[cls]
-        dispatch_cache.clear()
+        clearCache()
 
-    func.unregister = unregister  # type: ignore[attr-defined]
-    return cast(_SingleDispatchCallable, func)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        return dispatch(args[0].__class__)(*args, **kwargs)
+
+    def cacheSize() -> int:
+        """The number of classes in this thread's dispatch cache."""
+        return len(getattr(caches, 'cache', None) or ())
+
+    # All of functools' attributes, like registry, are kept, and those
+    # that dispatch or change what's dispatched replaced.
+    functools.update_wrapper(wrapper, dispatcher)
+    wrapper.register = register  # type: ignore[attr-defined]
+    wrapper.unregister = unregister  # type: ignore[attr-defined]
+    wrapper.dispatch = dispatch  # type: ignore[attr-defined]
+    wrapper._clear_cache = clearCache  # type: ignore[attr-defined]
+    wrapper.cacheSize = cacheSize  # type: ignore[attr-defined]
+    return cast(_SingleDispatchCallable, wrapper)
 
 
 @singledispatch
@@ -292,35 +536,1046 @@ def _(obj: str) -> str:
     return "'" + obj.replace('\\', '\\\\') + "'"
 
 
+def validateOutputFormat(outputFormat: str) -> None:
+    if outputFormat not in OUTPUT_FORMATS:
+        raise ValueError('outputFormat must be one of %s, not %r' % (
+            ', '.join(map(repr, OUTPUT_FORMATS)), outputFormat))
+
+
+def validateOverheadClock(overheadClock: str) -> None:
+    if overheadClock not in OVERHEAD_CLOCKS:
+        raise ValueError('overheadClock must be one of %s, not %r' % (
+            ', '.join(map(repr, OVERHEAD_CLOCKS)), overheadClock))
+
+
+def validateSampling(name: str, value: Optional[float]) -> None:
+    # None disables a rule.
+    if value is None:
+        return
+    if name == 'sampleEvery' and not (isinstance(value, int) and value >= 1):
+        raise ValueError('sampleEvery must be an int >= 1, not %r' % (value,))
+    if name == 'firstN' and not (isinstance(value, int) and value >= 0):
+        raise ValueError('firstN must be an int >= 0, not %r' % (value,))
+    if name == 'sampleRate' and not 0 <= value <= 1:
+        raise ValueError('sampleRate must be within [0, 1], not %r' % (value,))
+    if name == 'maxPerSecond' and not value > 0:
+        raise ValueError('maxPerSecond must be > 0, not %r' % (value,))
+    if name == 'overheadBudget' and not value > 0:
+        raise ValueError('overheadBudget must be > 0, not %r' % (value,))
+
+
+def validateTimestampFormat(timestampFormat: str) -> None:
+    if timestampFormat not in TIMESTAMP_FORMATS:
+        raise ValueError('timestampFormat must be one of %s, not %r' % (
+            ', '.join(map(repr, TIMESTAMP_FORMATS)), timestampFormat))
+
+
+class TimestampFormatter:
+    """
+    Formats time.time() timestamps as one of TIMESTAMP_FORMATS:
+
+      'clock'      12:31:07.418, the local time of day.
+      'iso'        2026-10-19T12:31:07.418+02:00, ISO 8601.
+      'epoch'      1760870467.418, seconds since the Unix epoch.
+      'monotonic'  5021.174, seconds on the time.monotonic() clock.
+      'relative'   +3.092, seconds since <start>.
+
+    The date and time of day change at most once a second, so they're
+    formatted once per second, and cached, and every timestamp formatted
+    within that second only formats its milliseconds.
+
+    Timestamps are taken with time.time(), so 'monotonic' timestamps are
+    mapped onto time.monotonic() as the two clocks stood when the formatter
+    was created.
+    """
+    def __init__(
+            self, format: str = DEFAULT_TIMESTAMP_FORMAT,
+            start: Optional[float] = None):
+        validateTimestampFormat(format)
+        self.format = format
+        self.start = time.time() if start is None else start
+        self._monotonicOffset = time.monotonic() - time.time()
+        # (second, what precedes the milliseconds, what follows them).
+        self._cache: Tuple[int, str, str] = (-1, '', '')
+
+    def __call__(self, timestamp: Optional[float] = None) -> str:
+        if timestamp is None:
+            timestamp = time.time()
+        if self.format == 'epoch':
+            return '%.3f' % timestamp
+        if self.format == 'monotonic':
+            return '%.3f' % (timestamp + self._monotonicOffset)
+        if self.format == 'relative':
+            return '%+.3f' % (timestamp - self.start)
+
+        second, milliseconds = divmod(round(timestamp * 1000), 1000)
+        cachedSecond, head, tail = self._cache
+        if second != cachedSecond:
+            now = datetime.fromtimestamp(second)
+            if self.format == 'iso':
+                # E.g. 2026-10-19T12:31:07+02:00. The milliseconds go
+                # between the seconds and the UTC offset.
+                iso = now.astimezone().isoformat()
+                head, tail = iso[:19], iso[19:]
+            else:
+                head, tail = now.strftime('%H:%M:%S'), ''
+            self._cache = (second, head, tail)
+        return '%s.%03i%s' % (head, milliseconds, tail)
+
+
+class StageStats:
+    """
+    The calls to, and the nanoseconds spent in, each of ic()'s STAGES. See
+    IceCreamDebugger.stats().
+    """
+    def __init__(self) -> None:
+        # Per stage, [calls, nanoseconds]. Counted without a lock, like
+        # SiteStats.
+        self.totals: Dict[str, List[int]] = {stage: [0, 0] for stage in STAGES}
+
+    def add(self, stage: str, startNs: int) -> int:
+        """Count <stage>, started at <startNs>, as done now. Returns now."""
+        nowNs = time.perf_counter_ns()
+        totals = self.totals[stage]
+        totals[0] += 1
+        totals[1] += nowNs - startNs
+        return nowNs
+
+
+# Renders a prefix template's literal or field from a call's timestamp,
+# thread name, thread ident, and pid.
+PrefixRenderer = Callable[
+    [float, Optional[str], Optional[int], Optional[int]], str]
+# A prefix template field's value, to be formatted with a format spec.
+PrefixFieldValue = Callable[
+    [float, Optional[str], Optional[int], Optional[int]], object]
+
+
+class PrefixTemplate:
+    """
+    A prefix with fields, like '{time:%H:%M:%S} {pid} {thread}| ', compiled
+    once into a renderer per literal and field:
+
+      {time}       The call's time, in the timestampFormat, or, with a
+                   spec, like {time:%H:%M:%S}, formatted with strftime().
+      {elapsed}    Seconds since ic was created, like +3.092.
+      {pid}        The process' pid.
+      {thread}     The calling thread's name.
+      {thread_id}  The calling thread's ident.
+
+    Other fields take format specs, applied to their values, like
+    {thread:>10}, {pid:05d}, or {elapsed:.1f}. What can't change is
+    cached: the pid until a fork, each thread's name, and strftime()'d
+    times to the second, so rendering only formats what changed.
+    """
+    def __init__(self, template: str, timestamps: TimestampFormatter):
+        self.template = template
+        self.timestamps = timestamps
+        self._pid = os.getpid()
+        self._threadNames = threading.local()
+        self._renderers: List[PrefixRenderer] = []
+        for literal, field, spec, conversion in string.Formatter().parse(template):
+            if literal:
+                self._renderers.append(self._literal(literal))
+            if field is None:
+                continue
+            if field not in PREFIX_FIELDS or conversion is not None:
+                raise ValueError('Unknown prefix template field: {%s%s}' % (
+                    field, '' if conversion is None else '!' + conversion))
+            self._renderers.append(self._compileField(field, spec or ''))
+        registerForkHandlers(self)
+
+    @staticmethod
+    def isTemplate(prefix: str) -> bool:
+        """Whether <prefix> has fields, all of them PREFIX_FIELDS."""
+        try:
+            fields = [
+                field for _, field, _, _ in string.Formatter().parse(prefix)
+                if field is not None]
+        except ValueError:  # Unbalanced braces; not a template.
+            return False
+        return bool(fields) and all(field in PREFIX_FIELDS for field in fields)
+
+    def afterForkInChild(self) -> None:
+        self._pid = os.getpid()
+
+    @staticmethod
+    def _literal(literal: str) -> PrefixRenderer:
+        return lambda *_: literal
+
+    def _compileField(self, field: str, spec: str) -> PrefixRenderer:
+        if field == 'time' and spec:
+            return self._strftimer(spec)
+
+        if not spec:
+            render: PrefixRenderer = {
+                'time': self._renderTime,
+                'elapsed': self._renderElapsed,
+                'pid': self._renderPid,
+                'thread': self._renderThread,
+                'thread_id': self._renderThreadId,
+            }[field]
+            return render
+
+        # Specs format the field's value, e.g. the pid as an int, so specs
+        # like {pid:05d} work, and are checked here, against a value of
+        # the same type, not on every ic() call.
+        values: Dict[str, Tuple[PrefixFieldValue, object]] = {
+            'elapsed': (self._elapsed, 0.0),
+            'pid': (self._pidOf, 0),
+            'thread': (self._renderThread, ''),
+            'thread_id': (self._threadIdOf, 0),
+        }
+        value, sample = values[field]
+        try:
+            format(sample, spec)
+        except ValueError as e:
+            raise ValueError(
+                'Invalid format spec for prefix template field {%s:%s}: %s'
+                % (field, spec, e))
+        return lambda *args: format(value(*args), spec)
+
+    def _strftimer(self, spec: str) -> PrefixRenderer:
+        if '%f' in spec:  # Changes more than once a second; can't cache.
+            return lambda timestamp, *_: datetime.fromtimestamp(
+                timestamp).strftime(spec)
+
+        cache: List[Tuple[int, str]] = [(-1, '')]
+
+        def render(
+                timestamp: float, threadName: Optional[str],
+                threadId: Optional[int], pid: Optional[int]) -> str:
+            second = int(timestamp)
+            cachedSecond, formatted = cache[0]
+            if second != cachedSecond:
+                formatted = datetime.fromtimestamp(second).strftime(spec)
+                cache[0] = (second, formatted)
+            return formatted
+        return render
+
+    def _elapsed(
+            self, timestamp: float, threadName: Optional[str],
+            threadId: Optional[int], pid: Optional[int]) -> float:
+        return timestamp - self.timestamps.start
+
+    def _pidOf(
+            self, timestamp: float, threadName: Optional[str],
+            threadId: Optional[int], pid: Optional[int]) -> int:
+        return self._pid if pid is None else pid
+
+    def _threadIdOf(
+            self, timestamp: float, threadName: Optional[str],
+            threadId: Optional[int], pid: Optional[int]) -> int:
+        return threading.get_ident() if threadId is None else threadId
+
+    def _renderTime(
+            self, timestamp: float, threadName: Optional[str],
+            threadId: Optional[int], pid: Optional[int]) -> str:
+        return self.timestamps(timestamp)
+
+    def _renderElapsed(
+            self, timestamp: float, threadName: Optional[str],
+            threadId: Optional[int], pid: Optional[int]) -> str:
+        return '%+.3f' % (timestamp - self.timestamps.start)
+
+    def _renderPid(
+            self, timestamp: float, threadName: Optional[str],
+            threadId: Optional[int], pid: Optional[int]) -> str:
+        return str(self._pid if pid is None else pid)
+
+    def _renderThread(
+            self, timestamp: float, threadName: Optional[str],
+            threadId: Optional[int], pid: Optional[int]) -> str:
+        if threadName is not None:
+            return threadName
+        name = getattr(self._threadNames, 'name', None)
+        if name is None:
+            name = self._threadNames.name = threading.current_thread().name
+        return cast(str, name)
+
+    def _renderThreadId(
+            self, timestamp: float, threadName: Optional[str],
+            threadId: Optional[int], pid: Optional[int]) -> str:
+        return str(threading.get_ident() if threadId is None else threadId)
+
+    def __call__(
+            self, timestamp: Optional[float] = None,
+            threadName: Optional[str] = None, threadId: Optional[int] = None,
+            pid: Optional[int] = None) -> str:
+        """
+        Render the prefix for a call made at <timestamp>, on <threadName>
+        and <threadId>, in <pid>, or, for what's missing, here and now.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        return ''.join([
+            render(timestamp, threadName, threadId, pid)
+            for render in self._renderers])
+
+    def __repr__(self) -> str:
+        return 'PrefixTemplate(%r)' % self.template
+
+
+class RecordedCall:
+    """
+    An ic() call's call site, time, thread, and arguments, captured from
+    its frame so the call can be formatted, now or, e.g. by a Recorder,
+    later.
+    """
+    __slots__ = (
+        'filename', 'lineNumber', 'parentFunction', 'callNode', 'source',
+        'timestamp', 'threadName', 'threadId', 'taskName', 'args',
+        'suppressed', 'level', 'channel', 'scope', 'argStrs', 'elapsed')
+
+    def __init__(
+        self,
+        callFrame: Optional[FrameType],
+        args: Tuple[object, ...],
+        snapshot: Optional[Callable[[object], object]],
+        argStrs: Optional[List[str]] = None,
+        site: Optional[Tuple[CodeType, int]] = None,
+        stages: Optional[StageStats] = None,
+    ):
+        # Calls that aren't ic() calls, like ic.timer()'s reports, provide
+        # their <argStrs> rather than have them read from the source, and
+        # may provide their <site>, a code object and line, not a frame.
+        if callFrame is not None:
+            code, self.lineNumber = callFrame.f_code, callFrame.f_lineno
+        else:
+            assert site is not None
+            code, self.lineNumber = site
+        self.filename = code.co_filename
+        self.parentFunction = code.co_name
+        self.timestamp = time.time()
+        self.threadName = threading.current_thread().name
+        self.threadId = threading.get_ident()
+        self.taskName = currentTaskName()
+        if snapshot is not None:
+            args = tuple(snapshot(arg) for arg in args)
+        self.args = args
+        self.suppressed = 0  # Calls at this call site sampled out since.
+        self.level: Optional[int] = None  # Set by ic.info(), etc.
+        self.channel: Optional[str] = None
+        self.scope: Optional[Scope] = None
+        self.argStrs = argStrs
+        # A checkpoint's nanoseconds since the previous, and the first,
+        # checkpoint. See IceCreamDebugger.checkpointMode.
+        self.elapsed: Optional[Tuple[int, int]] = None
+
+        self.callNode: Optional[ast.AST] = None
+        self.source: Optional[executing.Source] = None
+        if args and argStrs is None and callFrame is not None:
+            # Source.executing() caches its result per call site, so this
+            # is only expensive the first time a call site is recorded.
+            startNs = time.perf_counter_ns() if stages is not None else 0
+            executingCall = Source.executing(callFrame)
+            self.callNode = executingCall.node
+            self.source = executingCall.source
+            if stages is not None:
+                stages.add('executing', startNs)
+
+
+def formatDuration(ns: int) -> str:
+    for unit, scale in (('s', 10**9), ('ms', 10**6), ('us', 10**3)):
+        if ns >= scale:
+            return '%.3f%s' % (ns / scale, unit)
+    return '%ins' % ns
+
+
+class Duration(int):
+    """Nanoseconds, repr()'d readably, like 1.234ms."""
+    def __repr__(self) -> str:
+        return formatDuration(self)
+
+
+class StreamingHistogram:
+    """
+    Count, total, min, max, and percentiles of a stream of non-negative
+    integers, like durations in nanoseconds, in constant memory.
+
+    Values are counted in buckets, HISTOGRAM_SUB_BUCKETS to every power
+    of two, so percentiles are within 1 / HISTOGRAM_SUB_BUCKETS of the
+    true value, and a histogram of durations from a nanosecond to an
+    hour holds at most a few thousand buckets. With <maxBuckets>, buckets
+    are merged, halving the sub-buckets to every power of two, whenever
+    there are more, trading precision for memory.
+    """
+    __slots__ = (
+        'count', 'total', 'min', 'max', 'buckets', 'subBucketBits',
+        'maxBuckets')
+
+    def __init__(self, maxBuckets: Optional[int] = None) -> None:
+        self.count = 0
+        self.total = 0
+        self.min: Optional[int] = None
+        self.max: Optional[int] = None
+        self.buckets: Dict[int, int] = {}
+        self.subBucketBits = HISTOGRAM_SUB_BUCKET_BITS
+        self.maxBuckets = maxBuckets
+
+    def record(self, value: int) -> None:
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+        key = self._key(value)
+        buckets = self.buckets
+        buckets[key] = buckets.get(key, 0) + 1
+        if self.maxBuckets is not None and len(buckets) > self.maxBuckets:
+            self._coarsen()
+
+    def _key(self, value: int) -> int:
+        # Values under 2 * 2 ** subBucketBits get a bucket of their own.
+        # Larger ones share a bucket with the others that have the same
+        # magnitude and the same top subBucketBits + 1 bits.
+        bits = self.subBucketBits
+        shift = value.bit_length() - bits - 1
+        return value if shift <= 0 else ((shift << bits) + (value >> shift))
+
+    def _bounds(self, key: int) -> Tuple[int, int]:
+        """The lowest value in bucket <key>, and the bucket's width."""
+        bits = self.subBucketBits
+        if key < 2 << bits:
+            return key, 1
+        shift = (key >> bits) - 1
+        return (key - (shift << bits)) << shift, 1 << shift
+
+    def _coarsen(self) -> None:
+        # Each bucket is half of one with one fewer sub-bucket bit, so
+        # rebucketing the buckets' lowest values merges them exactly.
+        while (len(self.buckets) > cast(int, self.maxBuckets)
+               and self.subBucketBits > 0):
+            lowest = [
+                (self._bounds(key)[0], n) for key, n in self.buckets.items()]
+            self.subBucketBits -= 1
+            buckets: Dict[int, int] = {}
+            for value, n in lowest:
+                key = self._key(value)
+                buckets[key] = buckets.get(key, 0) + n
+            self.buckets = buckets
+
+    def percentile(self, q: float) -> Optional[int]:
+        """The value q percent of values are less than or equal to."""
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(self.count * q / 100))
+        seen = 0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if seen >= rank:
+                break
+
+        lowest, width = self._bounds(key)
+        value = lowest + width // 2  # The middle of the bucket.
+        return min(max(value, cast(int, self.min)), cast(int, self.max))
+
+    def summary(self) -> Dict[str, Optional[int]]:
+        summary: Dict[str, Optional[int]] = {
+            'count': self.count, 'total': self.total, 'min': self.min}
+        for q in TIMER_PERCENTILES:
+            summary['p%g' % q] = self.percentile(q)
+        summary['max'] = self.max
+        return summary
+
+
+class DurationSummary:
+    """A timer's aggregates, repr()'d readably for ic.timer()'s reports."""
+    def __init__(self, summary: Dict[str, Optional[int]]):
+        self.summary = summary
+
+    def __repr__(self) -> str:
+        parts = ['count=%i' % cast(int, self.summary['count'])]
+        for name, ns in self.summary.items():
+            if name != 'count' and ns is not None:
+                parts.append('%s=%s' % (name, formatDuration(ns)))
+        return ' '.join(parts)
+
+
+class TimerStats:
+    """A timer label's aggregates. See IceCreamDebugger.timer()."""
+    def __init__(self) -> None:
+        self.histogram = StreamingHistogram()
+        self.lock = threading.Lock()
+        self.reportedAt = time.monotonic()
+        self.reportedCount = 0
+        self.site: Optional[Tuple[CodeType, int]] = None  # The last one.
+
+
+class Timer:
+    """
+    Times a block, with `with ic.timer('label'):`, or every call to a
+    function, with `@ic.timer`, using time.perf_counter_ns(). See
+    IceCreamDebugger.timer().
+    """
+    def __init__(
+            self, debugger: 'IceCreamDebugger', label: Optional[str],
+            summaryInterval: Optional[float]):
+        self.debugger = debugger
+        self.label = label
+        self.summaryInterval = summaryInterval
+        self._starts = threading.local()  # The same Timer can be shared.
+
+    def __enter__(self) -> 'Timer':
+        stack = self._starts.__dict__.setdefault('stack', [])
+        stack.append(time.perf_counter_ns())
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        elapsedNs = time.perf_counter_ns() - self._starts.stack.pop()
+        currentFrame = inspect.currentframe()
+        assert currentFrame is not None and currentFrame.f_back is not None
+        callFrame = currentFrame.f_back
+        del currentFrame  # A cycle. See IceCreamDebugger._call().
+        self.debugger._timed(
+            self.label or DEFAULT_TIMER_LABEL, elapsedNs, callFrame,
+            self.summaryInterval)
+
+    def __call__(self, func: Callable) -> Callable:
+        label = self.label or func.__qualname__
+        debugger, summaryInterval = self.debugger, self.summaryInterval
+
+        # Reported from the timed function's call site.
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def timedCoroutine(*args: Any, **kwargs: Any) -> Any:
+                startNs = time.perf_counter_ns()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    elapsedNs = time.perf_counter_ns() - startNs
+                    callFrame = cast(FrameType, inspect.currentframe()).f_back
+                    debugger._timed(
+                        label, elapsedNs, callFrame, summaryInterval)
+            return timedCoroutine
+
+        @functools.wraps(func)
+        def timed(*args: Any, **kwargs: Any) -> Any:
+            startNs = time.perf_counter_ns()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsedNs = time.perf_counter_ns() - startNs
+                callFrame = cast(FrameType, inspect.currentframe()).f_back
+                debugger._timed(label, elapsedNs, callFrame, summaryInterval)
+        return timed
+
+
+class Scope:
+    """
+    A `with ic.scope()` block's configuration, in effect in its context:
+    its thread, or asyncio task, and the tasks it creates. Unset options
+    are inherited from the enclosing scope, if any.
+    """
+    __slots__ = ('id', 'enabled', 'prefix')
+
+    def __init__(
+            self, id: str, enabled: bool,
+            prefix: Union[None, str, Callable[[], str]]):
+        self.id = id  # Correlates the scope's ic() calls.
+        self.enabled = enabled
+        self.prefix = prefix  # None for the debugger's own.
+
+
+class SiteSampling:
+    """A call site's sampling state. See IceCreamDebugger.configureOutput()."""
+    __slots__ = (
+        'filename', 'lineNumber', 'parentFunction', 'calls', 'suppressed',
+        'tokens', 'refilledAt', 'interval', 'sinceOutput', 'costNs')
+
+    def __init__(self, callFrame: FrameType) -> None:
+        self.filename = callFrame.f_code.co_filename
+        self.lineNumber = callFrame.f_lineno
+        self.parentFunction = callFrame.f_code.co_name
+        self.calls = 0
+        self.suppressed = 0  # Since the last output.
+        self.tokens: Optional[float] = None
+        self.refilledAt = 0.0
+        self.interval = 1  # Set by OverheadGovernor.
+        self.sinceOutput = 0
+        self.costNs = 0  # In OverheadGovernor's current window.
+
+    def takeToken(self, perSecond: float) -> bool:
+        # Token bucket that holds up to a second's worth of tokens.
+        now = time.monotonic()
+        capacity = max(1.0, perSecond)
+        if self.tokens is None:
+            self.tokens = capacity
+        else:
+            self.tokens = min(
+                capacity, self.tokens + (now - self.refilledAt) * perSecond)
+        self.refilledAt = now
+
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def takeInterval(self) -> bool:
+        self.sinceOutput += 1
+        if self.sinceOutput < self.interval:
+            return False
+        self.sinceOutput = 0
+        return True
+
+
+class SiteStats:
+    """A call site's counters. See IceCreamDebugger.sites()."""
+    __slots__ = (
+        'filename', 'lineNumber', 'parentFunction', 'hits', 'suppressed',
+        'bytes', 'ns')
+
+    def __init__(self, callFrame: FrameType) -> None:
+        self.filename = callFrame.f_code.co_filename
+        self.lineNumber = callFrame.f_lineno
+        self.parentFunction = callFrame.f_code.co_name
+        self.hits = 0
+        self.suppressed = 0  # Filtered, or sampled, out.
+        self.bytes = 0  # Of text output, UTF-8 encoded.
+        self.ns = 0  # Spent in ic(), once past the enabled checks.
+
+
+class OverheadGovernor:
+    """
+    Keeps the time ic() spends under <budget>, a fraction of the wall
+    clock or process CPU time, by throttling call sites.
+
+    Call sites report how long each ic() call took, in wall clock time or,
+    against the process' CPU time, in the calling thread's CPU time, so
+    ic()'s share is measured in like units. At the end of every
+    <window> seconds, if ic() took more than its budget in the window,
+    every call site that was called in the window outputs only every
+    <interval>th call, its interval multiplied by how many times over
+    budget ic() was. Once ic() takes less than half its budget, throttled
+    intervals halve back toward 1, one window at a time.
+    """
+    def __init__(self, budget: float, clock: str = DEFAULT_OVERHEAD_CLOCK,
+                 window: float = DEFAULT_GOVERNOR_WINDOW):
+        self.budget = budget
+        self.clock = clock
+        self._cpu = clock == 'cpu'
+        self.windowNs = int(window * 1e9)
+        self.overhead = 0.0  # ic()'s share of the last window.
+        self.throttled: List[SiteSampling] = []
+        self._called: List[SiteSampling] = []
+        self._lock = threading.Lock()
+        self._startWindow(time.perf_counter_ns())
+        registerForkHandlers(self)
+
+    def afterForkInChild(self) -> None:
+        self._lock = threading.Lock()
+
+    def _clockNs(self, nowNs: int) -> int:
+        return time.process_time_ns() if self._cpu else nowNs
+
+    def startCall(self, startNs: int) -> int:
+        """
+        Return the start, by the cost clock, of an ic() call that started
+        at <startNs>, by time.perf_counter_ns(). Pass it to account().
+        """
+        return time.thread_time_ns() if self._cpu else startNs
+
+    def _startWindow(self, nowNs: int) -> None:
+        self._windowEndNs = nowNs + self.windowNs
+        self._windowStartNs = self._clockNs(nowNs)
+
+    def account(self, site: SiteSampling, costStartNs: int, endNs: int) -> None:
+        """
+        Account an ic() call at <site>, started at <costStartNs>, from
+        startCall(), and ended at <endNs>, by time.perf_counter_ns().
+        """
+        if not site.costNs:
+            self._called.append(site)
+        costEndNs = time.thread_time_ns() if self._cpu else endNs
+        site.costNs += max(1, costEndNs - costStartNs)
+        if endNs >= self._windowEndNs:
+            self._adjust(endNs)
+
+    def _adjust(self, nowNs: int) -> None:
+        with self._lock:
+            if nowNs < self._windowEndNs:  # Another thread got here first.
+                return
+
+            called, self._called = self._called, []
+            costNs = sum(site.costNs for site in called)
+            elapsedNs = self._clockNs(nowNs) - self._windowStartNs
+            self.overhead = costNs / elapsedNs if elapsedNs > 0 else 0.0
+
+            if self.overhead > self.budget:
+                factor = math.ceil(self.overhead / self.budget)
+                for site in called:
+                    if site.interval == 1:
+                        self.throttled.append(site)
+                    site.interval = min(
+                        MAX_THROTTLE_INTERVAL, site.interval * factor)
+            elif self.overhead < self.budget / 2:
+                for site in self.throttled:
+                    site.interval = max(1, site.interval // 2)
+                self.throttled = [
+                    site for site in self.throttled if site.interval > 1]
+
+            for site in called:
+                site.costNs = 0
+            self._startWindow(nowNs)
+
+
+class CallSiteRule:
+    """
+    Matches call sites by <path>, a glob matched against the file's real
+    path, or against its basename if the glob has no slash; <function>, a
+    glob matched against the function's name or qualified name; <lines>,
+    a line number or an inclusive (first, last) range of them; and
+    <expr>, a regex searched for in the source text of the call's
+    arguments. A call site must match every one that's provided.
+    """
+    __slots__ = ('path', 'function', 'lines', 'expr')
+
+    def __init__(
+            self, path: Optional[str] = None, function: Optional[str] = None,
+            lines: Union[None, int, Tuple[int, int]] = None,
+            expr: Union[None, str, 're.Pattern[str]'] = None):
+        if path is function is lines is expr is None:
+            raise TypeError('a call site rule needs at least one of '
+                            'path, function, lines, or expr')
+        self.path = path
+        self.function = function
+        self.lines = (lines, lines) if isinstance(lines, int) else lines
+        self.expr = re.compile(expr) if isinstance(expr, str) else expr
+
+    def matches(
+            self, callFrame: FrameType,
+            getArgStrs: Callable[[], Sequence[Union[str, Sentinel]]]) -> bool:
+        code = callFrame.f_code
+        if self.path is not None:
+            filename = realpath(code.co_filename)
+            if '/' not in self.path:
+                filename = basename(filename)
+            if not fnmatchcase(filename, self.path):
+                return False
+
+        if self.function is not None and not (
+                fnmatchcase(code.co_name, self.function) or fnmatchcase(
+                    getattr(code, 'co_qualname', code.co_name), self.function)):
+            return False
+
+        if self.lines is not None:
+            first, last = self.lines
+            if not first <= callFrame.f_lineno <= last:
+                return False
+
+        if self.expr is not None:
+            expr = self.expr
+            if not any(
+                    isinstance(argStr, str) and expr.search(argStr)
+                    for argStr in getArgStrs()):
+                return False
+
+        return True
+
+
+class Channel:
+    """
+    ic() for one subsystem, like ic.channel('db'). Its calls are output
+    only while the channel is enabled; see IceCreamDebugger.configureOutput().
+    """
+    __slots__ = ('debugger', 'name', 'bit')
+
+    def __init__(self, debugger: 'IceCreamDebugger', name: str, bit: int):
+        self.debugger = debugger
+        self.name = name
+        self.bit = bit
+
+    # Like IceCreamDebugger's, each of these calls _call() directly; it
+    # finds the ic() call's frame two frames up.
+    def __call__(self, *args: object) -> object:
+        return self.debugger._call(args, None, self)
+
+    def debug(self, *args: object) -> object:
+        return self.debugger._call(args, logging.DEBUG, self)
+
+    def info(self, *args: object) -> object:
+        return self.debugger._call(args, logging.INFO, self)
+
+    def warning(self, *args: object) -> object:
+        return self.debugger._call(args, logging.WARNING, self)
+
+    def error(self, *args: object) -> object:
+        return self.debugger._call(args, logging.ERROR, self)
+
+    def critical(self, *args: object) -> object:
+        return self.debugger._call(args, logging.CRITICAL, self)
+
+
+class LazyLogMessage:
+    """
+    A LogRecord's msg that formats its ic() call only when, and if, a
+    handler formats the LogRecord.
+    """
+    __slots__ = ('debugger', 'call')
+
+    def __init__(self, debugger: 'IceCreamDebugger', call: RecordedCall):
+        self.debugger = debugger
+        self.call = call
+
+    def __str__(self) -> str:
+        return self.debugger._formatCall(self.call)
+
+
+class Recorder:
+    """
+    Bounded, in-memory ring of recorded ic() calls. See
+    IceCreamDebugger.startRecording().
+    """
+    def __init__(
+        self,
+        debugger: 'IceCreamDebugger',
+        maxRecords: int,
+        snapshot: Optional[Callable[[object], object]],
+        dumpOnException: bool,
+        dumpAtExit: bool,
+    ):
+        self.debugger = debugger
+        self.snapshot = snapshot
+        self.calls: Deque[RecordedCall] = deque(maxlen=maxRecords)
+
+        self._installedHooks = False
+        self._prevExcepthook = sys.excepthook
+        self._prevThreadingExcepthook = threading.excepthook
+        if dumpOnException:
+            sys.excepthook = self._excepthook
+            threading.excepthook = self._threadingExcepthook
+            self._installedHooks = True
+
+        self._dumpAtExit = dumpAtExit
+        if dumpAtExit:
+            atexit.register(self.dump)
+        registerForkHandlers(self)
+
+    def afterForkInChild(self) -> None:
+        # The parent dumps the calls it recorded; the child only its own.
+        self.calls.clear()
+
+    def capture(
+        self,
+        callFrame: FrameType,
+        args: Tuple[object, ...],
+        suppressed: int = 0,
+        level: Optional[int] = None,
+        channel: Optional[Channel] = None,
+        scope: Optional[Scope] = None,
+        elapsed: Optional[Tuple[int, int]] = None,
+    ) -> None:
+        call = RecordedCall(callFrame, args, self.snapshot)
+        call.suppressed = suppressed
+        call.level = level
+        call.channel = channel.name if channel is not None else None
+        call.scope = scope
+        call.elapsed = elapsed
+        self.calls.append(call)
+
+    def dump(self) -> None:
+        while self.calls:
+            self.debugger._output(self.calls.popleft(), recorded=True)
+
+    def _excepthook(self, *args: Any) -> None:
+        self.dump()
+        self._prevExcepthook(*args)
+
+    def _threadingExcepthook(self, args: Any) -> None:
+        self.dump()
+        self._prevThreadingExcepthook(args)
+
+    def uninstall(self) -> None:
+        if self._installedHooks:
+            if sys.excepthook == self._excepthook:
+                sys.excepthook = self._prevExcepthook
+            if threading.excepthook == self._threadingExcepthook:
+                threading.excepthook = self._prevThreadingExcepthook
+        if self._dumpAtExit:
+            atexit.unregister(self.dump)
+
+
 class IceCreamDebugger:
     _pairDelimiter = ', '  # Used by the tests in tests/.
     lineWrapWidth = DEFAULT_LINE_WRAP_WIDTH
     contextDelimiter = DEFAULT_CONTEXT_DELIMITER
     outputFunction: Callable[..., None]
 
+    # Per call site sampling. See configureOutput().
+    sampleEvery: Optional[int] = None
+    sampleRate: Optional[float] = None
+    maxPerSecond: Optional[float] = None
+    firstN: Optional[int] = None
+    overheadBudget: Optional[float] = None
+    overheadClock = DEFAULT_OVERHEAD_CLOCK
+
+    # Include the thread's name and ident, and the pid, in the context.
+    contextThread = False
+    contextPid = False
+
+    # Calls below <threshold>, and calls to disabled channels, return
+    # before inspecting anything. See configureOutput().
+    threshold = DEFAULT_THRESHOLD
+    channels: Optional[Tuple[str, ...]] = None
+
+    timestampFormat = DEFAULT_TIMESTAMP_FORMAT
+
+    # Count every call site's hits and cost. See sites().
+    siteStats = False
+
+    # Time each of ic()'s stages. See stats().
+    stageStats = False
+
+    # Bare ic() calls are checkpoints, timed from the previous one. See
+    # configureOutput() and checkpoints().
+    checkpointMode = False
+
     def __init__(self, prefix: Union[str, Callable[[], str]] =DEFAULT_PREFIX,
                  outputFunction: Callable[..., None]=DEFAULT_OUTPUT_FUNCTION,
                  argToStringFunction: Union[_SingleDispatchCallable, Callable[[Any], str]]=argumentToString, includeContext: bool=False,
                  contextAbsPath: bool=False,
-                 noColor: bool=False):
+                 noColor: bool=False,
+                 outputFormat: str=DEFAULT_OUTPUT_FORMAT,
+                 logger: Optional[logging.Logger]=None,
+                 level: int=DEFAULT_LOG_LEVEL):
+        validateOutputFormat(outputFormat)
         self.enabled = True
-        self.prefix = prefix
+        self.outputFormat = outputFormat
+        self._timestamps = TimestampFormatter(self.timestampFormat)
+        self.prefix = self._compilePrefix(prefix)
         self.includeContext = includeContext
         self.argToStringFunction = argToStringFunction
         self.contextAbsPath = contextAbsPath
         self.noColor = noColor
+        self.logger = logger
+        self.level = level
 
         if self.noColor and outputFunction is DEFAULT_OUTPUT_FUNCTION:
             self.outputFunction = stderr_print
         else:
             self.outputFunction = outputFunction
 
+        self._recorder: Optional[Recorder] = None
+        self._warningRegistries: Dict[str, Dict[Any, Any]] = {}
+        self._sampling = False
+        self._siteSampling: Dict[Tuple[CodeType, int], SiteSampling] = {}
+        self._siteStats: Optional[Dict[Tuple[CodeType, int], SiteStats]] = None
+        self._reportSitesAtExit = False
+        self._stages: Optional[StageStats] = None
+        self._governor: Optional[OverheadGovernor] = None
+        self._includeRules: List[CallSiteRule] = []
+        self._excludeRules: List[CallSiteRule] = []
+        self._filtering = False
+        self._allowedSites: Dict[Tuple[CodeType, int], bool] = {}
+        self._channels: Dict[str, Channel] = {}
+        self._channelMask = -1  # All channels.
+        self._timers: Dict[str, TimerStats] = {}
+        self._reportTimersAtExit = False
+        self._scope: ContextVar[Optional[Scope]] = ContextVar(
+            'icecream.scope', default=None)
+        self._openScopes = 0  # In any thread or task.
+        self._openScopesLock = threading.Lock()
+        self._updateGate()
+        # This thread's, or task's, (epoch, first checkpoint's time,
+        # previous checkpoint's time, previous checkpoint's call site).
+        self._lastCheckpoint: ContextVar[
+            Optional[Tuple[int, int, int, Tuple[CodeType, int]]]] = ContextVar(
+                'icecream.checkpoint', default=None)
+        self._checkpointEpoch = 0  # Bumped by checkpoints(reset=True).
+        self._checkpointLock = threading.Lock()
+        self._checkpoints: Dict[
+            Tuple[Tuple[CodeType, int], Tuple[CodeType, int]],
+            StreamingHistogram] = {}
+
     def __call__(self, *args: object) -> object:
-        if self.enabled:
+        return self._call(args, None, None)
+
+    def debug(self, *args: object) -> object:
+        return self._call(args, logging.DEBUG, None)
+
+    def info(self, *args: object) -> object:
+        return self._call(args, logging.INFO, None)
+
+    def warning(self, *args: object) -> object:
+        return self._call(args, logging.WARNING, None)
+
+    def error(self, *args: object) -> object:
+        return self._call(args, logging.ERROR, None)
+
+    def critical(self, *args: object) -> object:
+        return self._call(args, logging.CRITICAL, None)
+
+    def channel(self, name: str) -> Channel:
+        channel = self._channels.get(name)
+        if channel is None:
+            channel = Channel(self, name, 1 << len(self._channels))
+            self._channels[name] = channel
+        return channel
+
+    def _call(
+            self, args: Tuple[object, ...], level: Optional[int],
+            channel: Optional[Channel]) -> object:
+        # Called directly by __call__(), debug(), etc, and Channel's, so
+        # the ic() call's frame is two frames up.
+        # Only if a scope, threshold, channel mask, or logger could stop
+        # the call does it take more than self.enabled to decide, so
+        # disabled calls stay cheap.
+        if self._gated:
+            scope = self._scope.get()
+            isOutput = self._isOutput(
+                scope, self.level if level is None else level, channel)
+        else:
+            scope = None
+            isOutput = self.enabled
+        if isOutput:
+            governor, siteStats = self._governor, self._siteStats
+            stages = self._stages
+            startNs = (
+                time.perf_counter_ns()
+                if governor is not None or siteStats is not None
+                or stages is not None else 0)
             currentFrame = inspect.currentframe()
             assert currentFrame is not None and currentFrame.f_back is not None
-            callFrame = currentFrame.f_back
-            self.outputFunction(self._format(callFrame, *args))
+            callFrame = currentFrame.f_back.f_back
+            # A frame referencing itself is a cycle, left for the garbage
+            # collector, and with it every local, unless broken.
+            del currentFrame
+            assert callFrame is not None
+            costStartNs = (
+                governor.startCall(startNs) if governor is not None else 0)
+            if stages is not None:
+                stages.add('frame', startNs)
+            allowed = self._allowedSites.get(
+                (callFrame.f_code, callFrame.f_lasti)) if self._filtering else True
+            if allowed is None:
+                allowed = self._filterSite(callFrame, args)
+            output: Optional[str] = None
+            if allowed:
+                elapsed = (
+                    self._checkpoint(callFrame)
+                    if self.checkpointMode and not args else None)
+                site = self._site(callFrame) if self._sampling else None
+                suppressed = self._sample(site) if site is not None else 0
+                if suppressed < 0:  # Sampled out.
+                    allowed = False
+                elif self._recorder is not None:
+                    self._recorder.capture(
+                        callFrame, args, suppressed, level, channel, scope,
+                        elapsed)
+                else:
+                    call = RecordedCall(callFrame, args, None, stages=stages)
+                    call.suppressed = suppressed
+                    call.level = level
+                    call.channel = channel.name if channel is not None else None
+                    call.scope = scope
+                    call.elapsed = elapsed
+                    output = self._output(call)
+                if governor is not None and site is not None:
+                    governor.account(site, costStartNs, time.perf_counter_ns())
+            if siteStats is not None:
+                self._countSite(siteStats, callFrame, allowed, output, startNs)
 
         if not args:  # E.g. ic().
             passthrough = None
@@ -331,60 +1586,360 @@ class IceCreamDebugger:
 
         return passthrough
 
+    def _filterSite(self, callFrame: FrameType, args: Tuple[object, ...]) -> bool:
+        # Evaluated once per call site; the decision is cached until the
+        # rules change.
+        argStrs: List[Sequence[Union[str, Sentinel]]] = []
+
+        def getArgStrs() -> Sequence[Union[str, Sentinel]]:
+            if not argStrs:
+                argStrs.append(
+                    self._getArgStrs(RecordedCall(callFrame, args, None)))
+            return argStrs[0]
+
+        allowed = (
+            (not self._includeRules or any(
+                rule.matches(callFrame, getArgStrs)
+                for rule in self._includeRules))
+            and not any(
+                rule.matches(callFrame, getArgStrs)
+                for rule in self._excludeRules))
+        self._allowedSites[(callFrame.f_code, callFrame.f_lasti)] = allowed
+        return allowed
+
+    def _checkpoint(self, callFrame: FrameType) -> Optional[Tuple[int, int]]:
+        """
+        Time a checkpoint, a bare ic() call. Returns the nanoseconds since
+        the previous, and the first, checkpoint in this thread or task, or
+        None if it's the first.
+        """
+        nowNs = time.perf_counter_ns()
+        site = (callFrame.f_code, callFrame.f_lineno)
+        epoch = self._checkpointEpoch
+        last = self._lastCheckpoint.get()
+        if last is None or last[0] != epoch:
+            self._lastCheckpoint.set((epoch, nowNs, nowNs, site))
+            return None
+
+        _, firstNs, previousNs, previousSite = last
+        self._lastCheckpoint.set((epoch, firstNs, nowNs, site))
+        sincePrevious = nowNs - previousNs
+        with self._checkpointLock:
+            histogram = self._checkpoints.get((previousSite, site))
+            if histogram is None:
+                if len(self._checkpoints) >= MAX_CHECKPOINT_PAIRS:
+                    return sincePrevious, nowNs - firstNs
+                histogram = self._checkpoints[(previousSite, site)] = (
+                    StreamingHistogram(MAX_CHECKPOINT_BUCKETS))
+            histogram.record(sincePrevious)
+        return sincePrevious, nowNs - firstNs
+
+    def _countSite(
+            self, siteStats: Dict[Tuple[CodeType, int], SiteStats],
+            callFrame: FrameType, allowed: bool, output: Optional[str],
+            startNs: int) -> None:
+        # Counted without a lock, so counts from many threads calling the
+        # same call site at once may come up a little short.
+        key = (callFrame.f_code, callFrame.f_lasti)
+        stats = siteStats.get(key)
+        if stats is None:
+            stats = siteStats.setdefault(key, SiteStats(callFrame))
+        stats.hits += 1
+        if not allowed:
+            stats.suppressed += 1
+        if output is not None:
+            stats.bytes += len(output.encode('utf-8', 'replace'))
+        stats.ns += time.perf_counter_ns() - startNs
+
+    def _site(self, callFrame: FrameType) -> SiteSampling:
+        key = (callFrame.f_code, callFrame.f_lasti)
+        site = self._siteSampling.get(key)
+        if site is None:
+            site = self._siteSampling[key] = SiteSampling(callFrame)
+        return site
+
+    def _sample(self, site: SiteSampling) -> int:
+        """
+        Decide, from the call site alone, whether to output a call. Returns
+        -1 if the call is sampled out and otherwise the number of calls
+        at the call site sampled out since its last output.
+        """
+        site.calls += 1
+
+        keep = (
+            (self.firstN is None or site.calls <= self.firstN)
+            and (self.sampleEvery is None
+                 or (site.calls - 1) % self.sampleEvery == 0)
+            and (self.sampleRate is None or random.random() < self.sampleRate)
+            and (self.maxPerSecond is None
+                 or site.takeToken(self.maxPerSecond))
+            and site.takeInterval())
+        if not keep:
+            site.suppressed += 1
+            return -1
+
+        suppressed, site.suppressed = site.suppressed, 0
+        return suppressed
+
+    def _output(
+            self, call: RecordedCall, recorded: bool = False) -> Optional[str]:
+        """Output <call>. Returns its text, if it was formatted as text."""
+        if self.logger is not None:
+            self._log(call)
+            return None
+
+        # A sinks.RecordSink, which takes structured records. The flag is
+        # looked up on the type, as any attribute of, e.g., a Mock exists.
+        outputFunction = self.outputFunction
+        if getattr(type(outputFunction), 'takesRecords', False) is True:
+            cast(Any, outputFunction).writeRecord(self._structuredRecord(call))
+            return None
+
+        s = self._formatCall(call, recorded)
+        self._outputString(s)
+        return s
+
+    def _updateGate(self) -> None:
+        # Whether anything but self.enabled can decide if a call is output.
+        # Kept up to date by configureOutput() and scope().
+        self._gated = bool(
+            self._openScopes or self.threshold > logging.NOTSET
+            or self._channelMask != -1 or self.logger is not None)
+
+    def _isOutput(
+            self, scope: Optional[Scope], level: int,
+            channel: Optional[Channel]) -> bool:
+        """Whether a call, at <level>, on <channel>, in <scope>, is output."""
+        return bool(
+            (self.enabled if scope is None else scope.enabled)
+            and level >= self.threshold
+            and (channel is None or channel.bit & self._channelMask)
+            and (self.logger is None or self.logger.isEnabledFor(level)))
+
+    def _log(self, call: RecordedCall) -> None:
+        logger = cast(logging.Logger, self.logger)
+        record = logger.makeRecord(
+            logger.name, self.level if call.level is None else call.level,
+            call.filename, call.lineNumber, LazyLogMessage(self, call), (),
+            None, func=call.parentFunction, extra=self._logExtra(call))
+        logger.handle(record)
+
+    def _logExtra(self, call: RecordedCall) -> Optional[Dict[str, str]]:
+        extra = {}
+        if call.channel is not None:
+            extra['channel'] = call.channel
+        if call.scope is not None:
+            extra['scope'] = call.scope.id
+        return extra or None
+
+    def _outputString(self, s: str) -> None:
+        outputFunction = self.outputFunction
+        if self.outputFormat == 'json':
+            outputFunction = PLAIN_OUTPUT_FUNCTIONS.get(
+                outputFunction, outputFunction)
+
+        stages = self._stages
+        if stages is None:
+            outputFunction(s)
+            return
+
+        # Split the built-in colorizing output functions in two to time
+        # colorize() apart from the write.
+        startNs = time.perf_counter_ns()
+        plainOutputFunction = PLAIN_OUTPUT_FUNCTIONS.get(outputFunction)
+        if plainOutputFunction is None:
+            outputFunction(s)
+        else:
+            s = colorize(s)
+            startNs = stages.add('colorize', startNs)
+            with supportTerminalColorsInWindows():
+                plainOutputFunction(s)
+        stages.add('output', startNs)
+
     def format(self, *args: object) -> str:
         currentFrame = inspect.currentframe()
         assert currentFrame is not None and currentFrame.f_back is not None
         callFrame = currentFrame.f_back
+        del currentFrame  # A cycle. See _call().
         out = self._format(callFrame, *args)
         return out
 
     def _format(self, callFrame: FrameType, *args: object) -> str:
-
-        prefix = cast(str, call_or_value(self.prefix))
-        context = self._formatContext(callFrame)
-
-        if not args:
-            time = self._formatTime()
-            out = prefix + context + time
+        call = RecordedCall(callFrame, args, None)
+        call.scope = self._scope.get()
+        return self._formatCall(call)
+
+    def _formatCall(self, call: RecordedCall, recorded: bool = False) -> str:
+        if self.outputFormat == 'json':
+            return self._formatJson(call)
+
+        scope = call.scope
+        prefix = self._formatPrefix(
+            None if call.level is None else logging.getLevelName(call.level),
+            call.channel, call.suppressed,
+            None if scope is None else scope.prefix,
+            call.timestamp, call.threadName, call.threadId)
+
+        if call.args and not self.includeContext:
+            context = ''
         else:
-            if not self.includeContext:
-                context = ''
-            out = self._formatArgs(
-                callFrame, prefix, context, args)
-
+            filepath = (
+                realpath if self.contextAbsPath else basename)(call.filename)
+            # Recorded calls are output long after, and not necessarily on
+            # the thread, they were made on, so note where they were made.
+            threadName = threadId = None
+            if self.contextThread:
+                threadName, threadId = call.threadName, call.threadId
+            elif recorded and call.threadName != 'MainThread':
+                threadName = call.threadName
+            context = self._formatContext(
+                filepath, call.lineNumber, call.parentFunction,
+                taskName=call.taskName, threadName=threadName,
+                threadId=threadId,
+                pid=os.getpid() if self.contextPid else None,
+                scopeId=None if scope is None else scope.id)
+
+        if not call.args:
+            at = self._formatTime(call.timestamp)
+            return prefix + context + at + self._formatElapsed(call.elapsed)
+
+        argStrs = self._getArgStrs(call)
+        stages = self._stages
+        startNs = time.perf_counter_ns() if stages is not None else 0
+        pairs = [
+            (arg, self.argToStringFunction(value))
+            for arg, value in zip(argStrs, call.args)]
+        if stages is None:
+            return self._constructArgumentOutput(prefix, context, pairs)
+
+        startNs = stages.add('argToString', startNs)
+        out = self._constructArgumentOutput(prefix, context, pairs)
+        stages.add('construct', startNs)
         return out
 
-    def _formatArgs(
-        self,
-        callFrame: FrameType,
-        prefix: str,
-        context: str,
-        args: Sequence[object]
-    ) -> str:
-
-        callNode = Source.executing(callFrame).node
-        if callNode is not None:
-            assert isinstance(callNode, ast.Call)
-            source = cast(Source, Source.for_frame(callFrame))
-            sanitizedArgStrs = [
-                source.get_text_with_indentation(arg)
-                for arg in callNode.args]
+    def _formatPrefix(
+            self, levelName: Optional[str], channelName: Optional[str],
+            suppressed: Optional[int],
+            scopePrefix: Union[None, str, Callable[[], str]] = None,
+            timestamp: Optional[float] = None,
+            threadName: Optional[str] = None,
+            threadId: Optional[int] = None,
+            pid: Optional[int] = None) -> str:
+        # Prefix templates render the call's time and thread, not the time
+        # and thread it's formatted at, which differ for recorded calls.
+        prefixOrTemplate = self.prefix if scopePrefix is None else scopePrefix
+        if isinstance(prefixOrTemplate, PrefixTemplate):
+            prefix = prefixOrTemplate(timestamp, threadName, threadId, pid)
         else:
-            warnings.warn(
-                NO_SOURCE_AVAILABLE_WARNING_MESSAGE,
-                category=RuntimeWarning, stacklevel=4)
-            sanitizedArgStrs = [Sentinel.absent] * len(args)
-
-        pairs = list(zip(sanitizedArgStrs, cast(List[str], args)))
-
-        out = self._constructArgumentOutput(prefix, context, pairs)
-        return out
+            prefix = cast(str, call_or_value(prefixOrTemplate))
+        if levelName is not None:
+            prefix += levelName + ' '
+        if channelName is not None:
+            prefix += '[%s] ' % channelName
+        if suppressed:
+            prefix += '(%i suppressed) ' % suppressed
+        return prefix
+
+    def _formatJson(self, call: RecordedCall) -> str:
+        return jsonDumps(self._structuredRecord(call))
+
+    def _structuredRecord(self, call: RecordedCall) -> Dict[str, Any]:
+        # Built straight from the call site and argToStringFunction(),
+        # skipping the text layout entirely.
+        argStrs = self._getArgStrs(call)
+        stages = self._stages
+        startNs = time.perf_counter_ns() if stages is not None else 0
+        record = {
+            'timestamp': call.timestamp,
+            'file': (realpath if self.contextAbsPath else basename)(call.filename),
+            'line': call.lineNumber,
+            'function': call.parentFunction,
+            'thread': call.threadName,
+            'thread_id': call.threadId,
+            'pid': os.getpid(),
+            'args': [
+                {
+                    'expr': None if arg is Sentinel.absent else arg,
+                    'value_repr': self.argToStringFunction(value),
+                    'type': typeName(value),
+                }
+                for arg, value in zip(argStrs, call.args)],
+        }
+        if stages is not None:
+            stages.add('argToString', startNs)
+        if call.taskName is not None:
+            record['task'] = call.taskName
+        if call.level is not None:
+            record['level'] = logging.getLevelName(call.level)
+        if call.channel is not None:
+            record['channel'] = call.channel
+        if call.scope is not None:
+            record['scope'] = call.scope.id
+        if call.suppressed:
+            record['suppressed'] = call.suppressed
+        if call.elapsed is not None:
+            record['since_previous_ns'], record['since_first_ns'] = call.elapsed
+        return record
+
+    def formatRecord(
+            self, record: Dict[str, Any], includePid: bool = False) -> str:
+        """
+        Format a structured record, like those output with
+        outputFormat='json', as text. Context is always included.
+        """
+        prefix = self._formatPrefix(
+            record.get('level'), record.get('channel'), record.get('suppressed'),
+            timestamp=record['timestamp'], threadName=record.get('thread'),
+            threadId=record.get('thread_id'), pid=record.get('pid'))
+        threadName = record.get('thread')
+        context = self._formatContext(
+            record['file'], record['line'], record['function'],
+            taskName=record.get('task'),
+            threadName=threadName if threadName != 'MainThread' else None,
+            pid=record.get('pid') if includePid else None,
+            scopeId=record.get('scope'))
+
+        if not record['args']:
+            elapsed = None
+            if 'since_previous_ns' in record:
+                elapsed = (record['since_previous_ns'], record['since_first_ns'])
+            return (
+                prefix + context + self._formatTime(record['timestamp'])
+                + self._formatElapsed(elapsed))
+
+        pairs = [
+            (Sentinel.absent if arg['expr'] is None else arg['expr'],
+             arg['value_repr'])
+            for arg in record['args']]
+        return self._constructArgumentOutput(prefix, context, pairs)
+
+    def _getArgStrs(
+            self, call: RecordedCall) -> Sequence[Union[str, Sentinel]]:
+        if not call.args:
+            return ()
+
+        if call.argStrs is not None:
+            return call.argStrs
+
+        if call.callNode is not None:
+            assert isinstance(call.callNode, ast.Call)
+            source = cast(Source, call.source)
+            stages = self._stages
+            startNs = time.perf_counter_ns() if stages is not None else 0
+            argStrs = source.get_arg_strs(call.callNode)
+            if stages is not None:
+                stages.add('source', startNs)
+            return argStrs
+
+        # Attribute the warning to the ic() call itself, wherever in
+        # icecream it's raised from, and only warn once per call site.
+        registry = self._warningRegistries.setdefault(call.filename, {})
+        warnings.warn_explicit(
+            NO_SOURCE_AVAILABLE_WARNING_MESSAGE, RuntimeWarning,
+            call.filename, call.lineNumber, registry=registry)
+        return [Sentinel.absent] * len(call.args)
 
     def _constructArgumentOutput(self, prefix: str, context: str, pairs: Sequence[Tuple[Union[str, Sentinel], str]]) -> str:
-        def argPrefix(arg: str) -> str:
-            return '%s: ' % arg
-
-        pairs = [(arg, self.argToStringFunction(val)) for arg, val in pairs]
         # For cleaner output, if <arg> is a literal, eg 3, "a string",
         # b'bytes', etc, only output the value, not the argument and the
         # value, because the argument and the value will be identical or
@@ -398,70 +1953,434 @@ class IceCreamDebugger:
         #
         # When the source for an arg is missing we also only print the value,
         # since we can't know anything about the argument itself.
-        pairStrs = [
+        allArgsOnOneLine = self._pairDelimiter.join([
             val if (arg is Sentinel.absent or isLiteral(arg))
-            else (argPrefix(arg) + val)
-            for arg, val in pairs]
-
-        allArgsOnOneLine = self._pairDelimiter.join(pairStrs)
-        multilineArgs = len(allArgsOnOneLine.splitlines()) > 1
-
-        contextDelimiter = self.contextDelimiter if context else ''
-        allPairs = prefix + context + contextDelimiter + allArgsOnOneLine
-        firstLineTooLong = len(allPairs.splitlines()[0]) > self.lineWrapWidth
-
-        if multilineArgs or firstLineTooLong:
-            # ic| foo.py:11 in foo()
-            #     multilineStr: 'line1
-            #                    line2'
-            #
-            # ic| foo.py:11 in foo()
-            #     a: 11111111111111111111
-            #     b: 22222222222222222222
-            if context:
-                lines = [prefix + context] + [
-                    formatPair(len(prefix) * ' ', arg, value)
-                    for arg, value in pairs
-                ]
-            # ic| multilineStr: 'line1
-            #                    line2'
-            #
-            # ic| a: 11111111111111111111
-            #     b: 22222222222222222222
-            else:
-                argLines = [
-                    formatPair('', arg, value)
-                    for arg, value in pairs
-                ]
-                lines = prefix_first_line_indent_remaining(prefix, '\n'.join(argLines))
+            else '%s: %s' % (arg, val)
+            for arg, val in pairs])
+        multilineArgs = MULTILINE.search(allArgsOnOneLine) is not None
+
         # ic| foo.py:11 in foo()- a: 1, b: 2
         # ic| a: 1, b: 2, c: 3
+        #
+        # Unless the first line is too long: longer than lineWrapWidth,
+        # without a line boundary in its first lineWrapWidth + 1 characters.
+        if not multilineArgs:
+            contextDelimiter = self.contextDelimiter if context else ''
+            allPairs = '%s%s%s%s' % (
+                prefix, context, contextDelimiter, allArgsOnOneLine)
+            if (len(allPairs) <= self.lineWrapWidth
+                    or LINE_BOUNDARY.search(
+                        allPairs, 0, self.lineWrapWidth + 1) is not None):
+                return allPairs
+
+        # ic| foo.py:11 in foo()
+        #     multilineStr: 'line1
+        #                    line2'
+        #
+        # ic| foo.py:11 in foo()
+        #     a: 11111111111111111111
+        #     b: 22222222222222222222
+        if context:
+            lines = [prefix + context] + [
+                formatPair(len(prefix) * ' ', arg, value)
+                for arg, value in pairs
+            ]
+        # ic| multilineStr: 'line1
+        #                    line2'
+        #
+        # ic| a: 11111111111111111111
+        #     b: 22222222222222222222
         else:
-            lines = [prefix + context + contextDelimiter + allArgsOnOneLine]
+            argLines = [
+                formatPair('', arg, value)
+                for arg, value in pairs
+            ]
+            lines = prefix_first_line_indent_remaining(prefix, '\n'.join(argLines))
 
         return '\n'.join(lines)
 
-    def _formatContext(self, callFrame: FrameType) -> str:
-        filename, lineNumber, parentFunction = self._getContext(callFrame)
-
+    def _formatContext(
+        self,
+        filename: str,
+        lineNumber: int,
+        parentFunction: str,
+        taskName: Optional[str] = None,
+        threadName: Optional[str] = None,
+        pid: Optional[int] = None,
+        scopeId: Optional[str] = None,
+        threadId: Optional[int] = None,
+    ) -> str:
         if parentFunction != '<module>':
             parentFunction = '%s()' % parentFunction
 
         context = '%s:%s in %s' % (filename, lineNumber, parentFunction)
-        return context
 
-    def _formatTime(self) -> str:
-        now = datetime.now()
-        formatted = now.strftime('%H:%M:%S.%f')[:-3]
-        return ' at %s' % formatted
+        extras = []
+        if pid is not None:
+            extras.append('pid=%i' % pid)
+        if threadName is not None:
+            extras.append('thread=%s' % threadName)
+        if threadId is not None:
+            extras.append('thread_id=%i' % threadId)
+        if taskName is not None:
+            extras.append('task=%s' % taskName)
+        if scopeId is not None:
+            extras.append('scope=%s' % scopeId)
+        if extras:
+            context += ' [%s]' % ' '.join(extras)
 
-    def _getContext(self, callFrame: FrameType) -> Tuple[str, int, str]:
-        frameInfo = inspect.getframeinfo(callFrame)
-        lineNumber = frameInfo.lineno
-        parentFunction = frameInfo.function
+        return context
 
-        filepath = (realpath if self.contextAbsPath else basename)(frameInfo.filename)  # type: ignore[operator]
-        return filepath, lineNumber, parentFunction
+    def _formatTime(self, timestamp: Optional[float] = None) -> str:
+        return ' at %s' % self._timestamps(timestamp)
+
+    def timestamp(self, timestamp: Optional[float] = None) -> str:
+        """
+        Format <timestamp>, a time.time(), or now, like bare ic() calls do,
+        in the <timestampFormat>. E.g. for a prefix:
+        `prefix=lambda: ic.timestamp() + ' |> '`.
+        """
+        return self._timestamps(timestamp)
+
+    def _formatElapsed(self, elapsed: Optional[Tuple[int, int]]) -> str:
+        if elapsed is None:
+            return ''
+        sincePrevious, sinceFirst = elapsed
+        return ' (+%s, %s since first)' % (
+            formatDuration(sincePrevious), formatDuration(sinceFirst))
+
+    def _compilePrefix(
+            self, prefix: Union[str, Callable[[], str]]
+    ) -> Union[str, Callable[[], str]]:
+        if isinstance(prefix, str) and PrefixTemplate.isTemplate(prefix):
+            return PrefixTemplate(prefix, self._timestamps)
+        return prefix
+
+    def flush(self) -> Any:
+        """
+        Flush the output function, if it supports flushing. With an
+        AsyncioSink this returns an awaitable, so use `await ic.flush()`.
+        """
+        flush = getattr(self.outputFunction, 'flush', None)
+        return flush() if flush is not None else None
+
+    def startRecording(
+        self,
+        maxRecords: int = DEFAULT_MAX_RECORDED_CALLS,
+        snapshot: Optional[Callable[[object], object]] = None,
+        dumpOnException: bool = True,
+        dumpAtExit: bool = False,
+    ) -> None:
+        """
+        Record ic() calls instead of outputting them. Only the call site,
+        time, thread, and arguments are captured, into a ring of the last
+        `maxRecords` calls; formatting is deferred until the ring is
+        dumped, on an uncaught exception, at exit, or with
+        dumpRecording().
+
+        Arguments are recorded by reference, so mutable arguments are
+        output as they are when dumped. Pass `snapshot`, e.g. copy.copy,
+        to record copies instead.
+        """
+        self.stopRecording()
+        self._recorder = Recorder(
+            self, maxRecords, snapshot, dumpOnException, dumpAtExit)
+
+    def stopRecording(self, dump: bool = False) -> None:
+        recorder, self._recorder = self._recorder, None
+        if recorder is not None:
+            recorder.uninstall()
+            if dump:
+                recorder.dump()
+
+    def timer(
+        self,
+        label: Union[None, str, Callable] = None,
+        summaryInterval: Optional[float] = None,
+    ) -> Any:
+        """
+        Time a block, `with ic.timer('label'):`, or every call to a function,
+        `@ic.timer` or `@ic.timer('label')`, and output the elapsed time.
+
+        Every label's timings are also aggregated; see timings(). With a
+        <summaryInterval>, in seconds, the aggregates are output instead,
+        at most every <summaryInterval> seconds and at exit, so a timer in
+        a hot loop doesn't output a line for every iteration.
+        """
+        if callable(label):  # Used as @ic.timer, without parentheses.
+            return Timer(self, None, summaryInterval)(label)
+        return Timer(self, label, summaryInterval)
+
+    def _timed(
+            self, label: str, elapsedNs: int, callFrame: Optional[FrameType],
+            summaryInterval: Optional[float]) -> None:
+        stats = self._timers.get(label)
+        if stats is None:
+            stats = self._timers.setdefault(label, TimerStats())
+        with stats.lock:
+            stats.histogram.record(elapsedNs)
+            if callFrame is not None:
+                stats.site = (callFrame.f_code, callFrame.f_lineno)
+            if summaryInterval is not None:
+                if not self._reportTimersAtExit:
+                    self._reportTimersAtExit = True
+                    atexit.register(self.reportTimers)
+                if time.monotonic() - stats.reportedAt < summaryInterval:
+                    return
+                value: object = self._markReported(stats)
+            else:
+                stats.reportedCount = stats.histogram.count
+                value = Duration(elapsedNs)
+        self._emitReport(label, value, callFrame, stats.site)
+
+    def _markReported(self, stats: TimerStats) -> DurationSummary:
+        stats.reportedAt = time.monotonic()
+        stats.reportedCount = stats.histogram.count
+        return DurationSummary(stats.histogram.summary())
+
+    def _emitReport(
+            self, label: str, value: object, callFrame: Optional[FrameType],
+            site: Optional[Tuple[CodeType, int]]) -> None:
+        scope = self._scope.get()
+        if not self._isOutput(scope, self.level, None):
+            return
+        call = RecordedCall(callFrame, (value,), None, [label], site)
+        call.scope = scope
+        if self._recorder is not None:
+            self._recorder.calls.append(call)
+        else:
+            self._output(call)
+
+    def reportTimers(self) -> None:
+        """
+        Output the aggregates of every timer label with timings since they
+        were last output.
+        """
+        for label, stats in list(self._timers.items()):
+            with stats.lock:
+                if stats.histogram.count == stats.reportedCount:
+                    continue
+                summary = self._markReported(stats)
+            self._emitReport(label, summary, None, stats.site)
+
+    def timings(self, reset: bool = False) -> Dict[str, Dict[str, Optional[int]]]:
+        """
+        Return every timer label's count, total, min, max, and p50, p90,
+        and p99 percentiles, all in nanoseconds. With <reset>, start over.
+        """
+        timings = {}
+        for label, stats in list(self._timers.items()):
+            with stats.lock:
+                timings[label] = stats.histogram.summary()
+        if reset:
+            self._timers.clear()
+        return timings
+
+    def checkpoints(
+            self, reset: bool = False) -> Dict[str, Dict[str, Optional[int]]]:
+        """
+        Return the time between every pair of consecutive checkpoints, like
+        'app.py:10 -> app.py:12', in nanoseconds: count, total, min, max,
+        mean, and p50, p90, and p99 percentiles, which, for widely spread
+        times, are coarser than timers'. Only the first MAX_CHECKPOINT_PAIRS
+        pairs are aggregated.
+        With <reset>, start over, in every thread and task. See
+        checkpointMode.
+        """
+        toFilename = realpath if self.contextAbsPath else basename
+
+        def siteName(site: Tuple[CodeType, int]) -> str:
+            return '%s:%i' % (toFilename(site[0].co_filename), site[1])
+
+        checkpoints = {}
+        with self._checkpointLock:
+            for (fromSite, toSite), histogram in self._checkpoints.items():
+                summary = histogram.summary()
+                summary['mean'] = histogram.total // histogram.count
+                checkpoints[
+                    '%s -> %s' % (siteName(fromSite), siteName(toSite))] = summary
+            if reset:
+                self._checkpoints.clear()
+                self._checkpointEpoch += 1
+        return checkpoints
+
+    def sites(self, reset: bool = False) -> List[Dict[str, Any]]:
+        """
+        Return every call site's counters, costliest first: its hits, the
+        hits filtered or sampled out, the bytes of text output, and the
+        nanoseconds spent in ic(). Only counted with siteStats=True. With
+        <reset>, start over.
+        """
+        siteStats = self._siteStats
+        if siteStats is None:
+            return []
+
+        toFilename = realpath if self.contextAbsPath else basename
+        sites = [
+            {
+                'file': toFilename(stats.filename),
+                'line': stats.lineNumber,
+                'function': stats.parentFunction,
+                'hits': stats.hits,
+                'suppressed': stats.suppressed,
+                'bytes': stats.bytes,
+                'ns': stats.ns,
+            }
+            for stats in list(siteStats.values())]
+        if reset:
+            siteStats.clear()
+        return sorted(sites, key=lambda site: site['ns'], reverse=True)
+
+    def stats(self, reset: bool = False) -> Dict[str, Dict[str, int]]:
+        """
+        Return, for each of ic()'s STAGES, in order, how many times it ran,
+        the nanoseconds spent in it in total, and the mean per run. Only
+        timed with stageStats=True. With <reset>, start over.
+
+        Each stage runs at most once per ic() call: 'frame' finds the call's
+        frame; 'executing' finds its ast node; 'source' reads its arguments'
+        source; 'argToString' formats their values; 'construct' lays out the
+        output; and 'colorize' and 'output' color and write it.
+        """
+        stages = self._stages
+        if stages is None:
+            return {}
+
+        stats = {}
+        for stage, (count, totalNs) in stages.totals.items():
+            stats[stage] = {
+                'count': count, 'total': totalNs,
+                'mean': totalNs // count if count else 0}
+        if reset:
+            self._stages = StageStats()
+        return stats
+
+    def reportSites(self, *_: object) -> None:
+        """
+        Output a table of sites(), costliest first, as plain text. Also a
+        signal handler; see reportSitesOn().
+        """
+        lines = ['ic() call sites, costliest first:', '%10s %10s %10s %10s  %s' % (
+            'time', 'hits', 'suppressed', 'bytes', 'site')]
+        for site in self.sites():
+            lines.append('%10s %10i %10i %10i  %s' % (
+                formatDuration(site['ns']), site['hits'], site['suppressed'],
+                site['bytes'], self._formatContext(
+                    site['file'], site['line'], site['function'])))
+        outputFunction = self.outputFunction
+        outputFunction = PLAIN_OUTPUT_FUNCTIONS.get(
+            outputFunction, outputFunction)
+        outputFunction('\n'.join(lines))
+
+    def reportSitesOn(
+            self, atExit: bool = True,
+            signalNumber: Optional[int] = None) -> None:
+        """
+        Count call sites, like siteStats=True, and output reportSites() at
+        exit and, with a <signalNumber>, like signal.SIGUSR1, whenever the
+        process receives that signal. Signal handlers can only be set from
+        the main thread.
+        """
+        self.configureOutput(siteStats=True)
+        if atExit and not self._reportSitesAtExit:
+            self._reportSitesAtExit = True
+            atexit.register(self.reportSites)
+        if signalNumber is not None:
+            # The outputLock is reentrant, so the report can be written
+            # even if the signal lands while ic() holds it, mid-write.
+            signal.signal(signalNumber, self.reportSites)
+
+    def dumpRecording(self) -> None:
+        """Output, and then forget, all recorded ic() calls."""
+        if self._recorder is not None:
+            self._recorder.dump()
+
+    def throttleState(self) -> Optional[Dict[str, Any]]:
+        """
+        Return the overhead governor's state: ic()'s share of the wall
+        clock or CPU time in the last window, and the call sites it's
+        throttling. None if there's no overheadBudget.
+        """
+        governor = self._governor
+        if governor is None:
+            return None
+
+        toFilename = realpath if self.contextAbsPath else basename
+        return {
+            'budget': governor.budget,
+            'clock': governor.clock,
+            'overhead': governor.overhead,
+            'sites': [
+                {
+                    'file': toFilename(site.filename),
+                    'line': site.lineNumber,
+                    'function': site.parentFunction,
+                    'interval': site.interval,
+                }
+                for site in list(governor.throttled)],
+        }
+
+    def include(
+            self, path: Optional[str] = None, function: Optional[str] = None,
+            lines: Union[None, int, Tuple[int, int]] = None,
+            expr: Union[None, str, 're.Pattern[str]'] = None) -> None:
+        """
+        Only output ic() calls from call sites that match this, or another,
+        include rule. See CallSiteRule.
+        """
+        self._includeRules.append(CallSiteRule(path, function, lines, expr))
+        self._rulesChanged()
+
+    def exclude(
+            self, path: Optional[str] = None, function: Optional[str] = None,
+            lines: Union[None, int, Tuple[int, int]] = None,
+            expr: Union[None, str, 're.Pattern[str]'] = None) -> None:
+        """
+        Don't output ic() calls from call sites that match this rule, even
+        if they match an include rule. See CallSiteRule.
+        """
+        self._excludeRules.append(CallSiteRule(path, function, lines, expr))
+        self._rulesChanged()
+
+    def clearFilters(self) -> None:
+        self._includeRules.clear()
+        self._excludeRules.clear()
+        self._rulesChanged()
+
+    def _rulesChanged(self) -> None:
+        self._allowedSites = {}
+        self._filtering = bool(self._includeRules or self._excludeRules)
+
+    @contextmanager
+    def scope(
+        self,
+        enabled: bool = True,
+        prefix: Union[str, Callable[[], str], Literal[Sentinel.absent]] = Sentinel.absent,
+        id: Optional[str] = None,
+    ) -> Generator[Scope, None, None]:
+        """
+        Enable, or disable, ic() within the block, including in the asyncio
+        tasks it creates, but not in other threads or tasks already
+        running. Overrides enable() and disable(). The scope's
+        <id>, random by default, is included in the context of its calls.
+        """
+        outer = self._scope.get()
+        scopePrefix = (
+            (None if outer is None else outer.prefix)
+            if prefix is Sentinel.absent else self._compilePrefix(prefix))
+        scope = Scope(
+            uuid.uuid4().hex[:8] if id is None else id, enabled, scopePrefix)
+        token = self._scope.set(scope)
+        with self._openScopesLock:
+            self._openScopes += 1
+            self._updateGate()
+        try:
+            yield scope
+        finally:
+            self._scope.reset(token)
+            with self._openScopesLock:
+                self._openScopes -= 1
+                self._updateGate()
 
     def enable(self) -> None:
         self.enabled = True
@@ -488,14 +2407,55 @@ class IceCreamDebugger:
         argToStringFunction: Union[Callable, Literal[Sentinel.absent]] = Sentinel.absent,
         includeContext: Union[bool, Literal[Sentinel.absent]] = Sentinel.absent,
         contextAbsPath: Union[bool, Literal[Sentinel.absent]] = Sentinel.absent,
+        contextThread: Union[bool, Literal[Sentinel.absent]] = Sentinel.absent,
+        contextPid: Union[bool, Literal[Sentinel.absent]] = Sentinel.absent,
         lineWrapWidth: Union[bool, Literal[Sentinel.absent]] = Sentinel.absent,
         noColor: Union[bool, Literal[Sentinel.absent]] = Sentinel.absent,
+        outputFormat: Union[str, Literal[Sentinel.absent]] = Sentinel.absent,
+        logger: Union[Optional[logging.Logger], Literal[Sentinel.absent]] = Sentinel.absent,
+        level: Union[int, Literal[Sentinel.absent]] = Sentinel.absent,
+        sampleEvery: Union[Optional[int], Literal[Sentinel.absent]] = Sentinel.absent,
+        sampleRate: Union[Optional[float], Literal[Sentinel.absent]] = Sentinel.absent,
+        maxPerSecond: Union[Optional[float], Literal[Sentinel.absent]] = Sentinel.absent,
+        firstN: Union[Optional[int], Literal[Sentinel.absent]] = Sentinel.absent,
+        overheadBudget: Union[Optional[float], Literal[Sentinel.absent]] = Sentinel.absent,
+        overheadClock: Union[str, Literal[Sentinel.absent]] = Sentinel.absent,
+        threshold: Union[int, Literal[Sentinel.absent]] = Sentinel.absent,
+        channels: Union[Optional[Iterable[str]], Literal[Sentinel.absent]] = Sentinel.absent,
+        checkpointMode: Union[bool, Literal[Sentinel.absent]] = Sentinel.absent,
+        timestampFormat: Union[str, Literal[Sentinel.absent]] = Sentinel.absent,
+        siteStats: Union[bool, Literal[Sentinel.absent]] = Sentinel.absent,
+        stageStats: Union[bool, Literal[Sentinel.absent]] = Sentinel.absent,
     ) -> None:
         noParameterProvided = all(
             v is Sentinel.absent for k, v in locals().items() if k != 'self')
         if noParameterProvided:
             raise TypeError('configureOutput() missing at least one argument')
 
+        # Every argument is validated before any is applied, so a call that
+        # raises leaves the configuration unchanged. Prefixes with
+        # PREFIX_FIELDS, like '{time:%H:%M:%S} {pid}| ', are compiled,
+        # once, into PrefixTemplates. Relative timestamps stay relative to
+        # when ic was created.
+        if prefix is not Sentinel.absent:
+            compiledPrefix = self._compilePrefix(prefix)
+        if outputFormat is not Sentinel.absent:
+            validateOutputFormat(outputFormat)
+        if timestampFormat is not Sentinel.absent:
+            timestamps = TimestampFormatter(
+                timestampFormat, self._timestamps.start)
+        if overheadClock is not Sentinel.absent:
+            validateOverheadClock(overheadClock)
+        sampling = {
+            'sampleEvery': sampleEvery, 'sampleRate': sampleRate,
+            'maxPerSecond': maxPerSecond, 'firstN': firstN,
+            'overheadBudget': overheadBudget, 'overheadClock': overheadClock}
+        for name, value in sampling.items():
+            if value is not Sentinel.absent and name != 'overheadClock':
+                validateSampling(name, cast(Optional[float], value))
+        if channels is not Sentinel.absent and channels is not None:
+            channels = tuple(channels)
+
         if noColor is not Sentinel.absent:
             self.noColor = noColor
             # Auto-swap built-in output functions when no explicit
@@ -513,7 +2473,7 @@ class IceCreamDebugger:
                         self.outputFunction = colorizedStdoutPrint
 
         if prefix is not Sentinel.absent:
-            self.prefix = prefix
+            self.prefix = compiledPrefix
 
         if outputFunction is not Sentinel.absent:
             self.outputFunction = outputFunction
@@ -527,8 +2487,91 @@ class IceCreamDebugger:
         if contextAbsPath is not Sentinel.absent:
             self.contextAbsPath = contextAbsPath
 
+        if contextThread is not Sentinel.absent:
+            self.contextThread = contextThread
+
+        if contextPid is not Sentinel.absent:
+            self.contextPid = contextPid
+
         if lineWrapWidth is not Sentinel.absent:
             self.lineWrapWidth = lineWrapWidth
 
+        if outputFormat is not Sentinel.absent:
+            self.outputFormat = outputFormat
+
+        if timestampFormat is not Sentinel.absent:
+            self._timestamps = timestamps
+            self.timestampFormat = timestampFormat
+            if isinstance(self.prefix, PrefixTemplate):
+                self.prefix.timestamps = self._timestamps
+
+        if logger is not Sentinel.absent:
+            self.logger = logger
+
+        if level is not Sentinel.absent:
+            self.level = level
+
+        # Calls below <threshold>, a logging level, aren't output. ic()
+        # calls are at <level>, ic.info() calls at INFO, and so on. Of
+        # the ic.channel()s, only <channels> are output; None enables all.
+        if threshold is not Sentinel.absent:
+            self.threshold = threshold
+
+        if channels is not Sentinel.absent:
+            if channels is None:
+                self.channels = None
+                self._channelMask = -1
+            else:
+                self.channels = tuple(channels)
+                self._channelMask = 0
+                for name in self.channels:
+                    self._channelMask |= self.channel(name).bit
+        self._updateGate()
+
+        # With <checkpointMode>, bare ic() calls also output the time since
+        # the previous, and the first, bare ic() call in the same thread
+        # or task. See checkpoints().
+        if checkpointMode is not Sentinel.absent:
+            self.checkpointMode = checkpointMode
+
+        # With <siteStats>, every call site's hits and cost are counted. See
+        # sites().
+        if siteStats is not Sentinel.absent:
+            self.siteStats = siteStats
+            if not siteStats:
+                self._siteStats = None
+            elif self._siteStats is None:
+                self._siteStats = {}
+
+        # With <stageStats>, the time spent in each of ic()'s stages is
+        # counted. See stats().
+        if stageStats is not Sentinel.absent:
+            self.stageStats = stageStats
+            if not stageStats:
+                self._stages = None
+            elif self._stages is None:
+                self._stages = StageStats()
+
+        # Per call site sampling. Each call site outputs only every
+        # <sampleEvery>th call, a random <sampleRate> fraction of calls,
+        # at most <maxPerSecond> calls per second, and only its first
+        # <firstN> calls. None disables a rule.
+        #
+        # With an <overheadBudget>, like 0.01, call sites are also
+        # throttled automatically whenever ic() takes more than that
+        # fraction of the <overheadClock>, 'wall' or 'cpu', time. See
+        # OverheadGovernor.
+        for name, value in sampling.items():
+            if value is not Sentinel.absent:
+                setattr(self, name, value)
+        if any(value is not Sentinel.absent for value in sampling.values()):
+            self._siteSampling.clear()
+            self._governor = (
+                None if self.overheadBudget is None
+                else OverheadGovernor(self.overheadBudget, self.overheadClock))
+            self._sampling = any(
+                getattr(self, name) is not None for name in sampling
+                if name != 'overheadClock')
+
 
 ic = IceCreamDebugger()
@@ -0,0 +1,1012 @@
+# -*- coding: utf-8 -*-
+
+#
+# IceCream - Never use print() to debug again
+#
+# Ansgar Grunseid
+# grunseid.com
+# grunseid@gmail.com
+#
+# License: MIT
+#
+
+import asyncio
+import gzip
+import heapq
+import json
+import lzma
+import mmap
+import os
+import queue
+import re
+import selectors
+import shutil
+import socket
+import struct
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from itertools import count
+from typing import (
+    Any, BinaryIO, Callable, Deque, Dict, Hashable, Iterator, List, Optional,
+    Set, TextIO, Tuple, cast)
+
+from .icecream import jsonDumps, registerForkHandlers
+
+
+DEFAULT_BATCH_SIZE = 256  # Records.
+DEFAULT_MAX_QUEUE_SIZE = 65536  # Records.
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_BACKUP_COUNT = 5
+DEFAULT_BUFFER_SIZE = 64 * 1024  # Bytes.
+DEFAULT_RING_SIZE = 1024 * 1024  # Bytes.
+DEFAULT_TRACE_BUFFER_SIZE = 1024 * 1024  # Bytes.
+DEFAULT_FLUSH_INTERVAL = 0.1  # Seconds.
+DEFAULT_RECONNECT_DELAY = 0.05  # Seconds; doubled per failure, up to 1s.
+DEFAULT_COLLECT_WINDOW = 0.5  # Seconds.
+DEFAULT_FLUSH_TIMEOUT = 5.0  # Seconds.
+
+COMPRESSORS: Dict[str, Tuple[str, Callable[..., Any]]] = {
+    'gzip': ('.gz', gzip.open),
+    'lzma': ('.xz', lzma.open),
+}
+
+# Flight recorder file layout: a fixed size header followed by the ring
+# itself. The header holds the ring's capacity, the write cursor (the
+# total number of bytes ever written to the ring, so the ring's write
+# position is cursor % capacity), and the sequence number of the next
+# record. Each record in the ring is a small header, the marker, the
+# payload's length, and the record's sequence number, followed by the
+# payload, UTF-8 encoded ic() output. Records wrap around the ring's end.
+RING_MAGIC = b'ICFR'
+RING_VERSION = 1
+# Magic, version, reserved, capacity, cursor, next sequence number.
+RING_HEADER = struct.Struct('<4sHHQQQ')
+RING_HEADER_SIZE = 64  # Bytes, padded.
+RING_CURSOR = struct.Struct('<QQ')  # Cursor, next sequence number.
+RING_CURSOR_OFFSET = 16
+RING_RECORD = struct.Struct('<HIQ')  # Marker, payload length, sequence.
+RING_RECORD_MARKER = 0x1CEC
+
+# Binary trace file layout: a header, then a stream of entries, each a
+# one byte tag followed by the entry. Strings (filenames, functions,
+# argument expressions, type and thread names) and call sites are
+# interned, written once as STRING and SITE entries the first time
+# they're seen and referenced by id afterwards, so a CALL entry is little
+# more than a site id, a timestamp, a thread, and the values' reprs.
+# Timestamps are the calls' own, recorded time.time()s, not when they're
+# written, as integer nanoseconds since the trace's start, the wall clock
+# time in its header.
+TRACE_MAGIC = b'ICBT'
+TRACE_VERSION = 2
+# Magic, version, reserved, wall clock start (ns), pid.
+TRACE_HEADER = struct.Struct('<4sHHqI')
+TRACE_STRING = 1
+TRACE_SITE = 2
+TRACE_CALL = 3
+TRACE_NONE = 0xFFFFFFFF  # String id of absent strings.
+TRACE_TAG = struct.Struct('<B')
+TRACE_STRING_HEADER = struct.Struct('<II')  # Id, length.
+TRACE_SITE_HEADER = struct.Struct('<IIIIH')  # Id, file, function, line, nargs.
+TRACE_ID = struct.Struct('<I')
+# Site, ns since the start, thread ident, thread name, task name, nvalues.
+TRACE_CALL_HEADER = struct.Struct('<IqQIIH')
+TRACE_VALUE_HEADER = struct.Struct('<II')  # Type name, length.
+
+# Socket sink frames: a record's length followed by the record as JSON.
+FRAME_HEADER = struct.Struct('<I')
+
+
+class Sink:
+    """
+    Base class for ic()'s built-in output sinks. A sink is an
+    outputFunction: it's called once for every ic() call with ic()'s
+    output, as a string. Sinks can also be flushed and closed.
+    """
+    takesRecords = False
+
+    def __call__(self, s: str) -> None:
+        raise NotImplementedError
+
+    def flush(self) -> Any:
+        return None
+
+    def close(self) -> None:
+        self.flush()
+
+
+class RecordSink(Sink):
+    """
+    Base class for sinks that take ic()'s structured records, the same
+    ones outputFormat='json' outputs, via writeRecord(), instead of text.
+    """
+    takesRecords = True
+
+    def __call__(self, s: str) -> None:
+        raise TypeError('%s only takes structured records, via writeRecord()'
+                        % type(self).__name__)
+
+    def writeRecord(self, record: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+
+class AsyncioSink(Sink):
+    """
+    Non-blocking sink for asyncio applications.
+
+    Outputs are enqueued and written in batches by a task on the event
+    loop, either to an asyncio.StreamWriter or, for regular blocking
+    streams like sys.stderr, through the loop's executor. A slow stream
+    never stalls the event loop; if the queue fills up, the oldest
+    outputs are dropped and counted in `dropped`.
+
+    Use `await ic.flush()` to wait until everything enqueued so far has
+    been written.
+    """
+    def __init__(
+        self,
+        writer: Optional[asyncio.StreamWriter] = None,
+        stream: Optional[TextIO] = None,
+        batchSize: int = DEFAULT_BATCH_SIZE,
+        maxQueueSize: int = DEFAULT_MAX_QUEUE_SIZE,
+    ):
+        self.writer = writer
+        self.stream = stream
+        self.batchSize = batchSize
+        self.dropped = 0
+
+        self._queue: Deque[str] = deque(maxlen=maxQueueSize)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._drainTask: Optional[asyncio.Future] = None
+        registerForkHandlers(self)
+
+    def afterForkInChild(self) -> None:
+        # The parent writes what it queued. The child starts over, on its
+        # own event loop, if it runs one.
+        self._queue.clear()
+        self._loop = None
+        self._drainTask = None
+
+    def __call__(self, s: str) -> None:
+        try:
+            loop: Optional[asyncio.AbstractEventLoop] = (
+                asyncio.get_running_loop())
+            onLoopThread = True
+        except RuntimeError:  # Not called from the event loop's thread.
+            loop = self._loop
+            onLoopThread = False
+
+        if loop is None or loop.is_closed():
+            # No event loop to hand the write off to, so there's nothing
+            # to stall. Write synchronously, after anything still queued.
+            self._writeBlocking(self._takeBatch(len(self._queue)) + s + '\n')
+            return
+
+        if len(self._queue) == self._queue.maxlen:
+            self.dropped += 1
+        self._queue.append(s)
+
+        self._loop = loop
+        if not onLoopThread:
+            loop.call_soon_threadsafe(self._scheduleDrain)
+        elif self._drainTask is None or self._drainTask.done():
+            self._drainTask = loop.create_task(self._drain())
+
+    def _scheduleDrain(self) -> None:
+        if self._drainTask is None or self._drainTask.done():
+            assert self._loop is not None
+            self._drainTask = self._loop.create_task(self._drain())
+
+    def _takeBatch(self, n: int) -> str:
+        lines = []
+        for _ in range(min(n, len(self._queue))):
+            lines.append(self._queue.popleft() + '\n')
+        return ''.join(lines)
+
+    async def _drain(self) -> None:
+        loop = asyncio.get_running_loop()
+        while self._queue:
+            batch = self._takeBatch(self.batchSize)
+            if self.writer is not None:
+                self.writer.write(batch.encode('utf-8'))
+                await self.writer.drain()
+            else:
+                await loop.run_in_executor(None, self._writeBlocking, batch)
+
+    def _writeBlocking(self, data: str) -> None:
+        if not data:
+            return
+        stream = self.stream if self.stream is not None else sys.stderr
+        stream.write(data)
+        stream.flush()
+
+    async def flush(self) -> None:  # type: ignore[override]
+        while self._queue or (
+                self._drainTask is not None and not self._drainTask.done()):
+            if self._drainTask is None or self._drainTask.done():
+                self._scheduleDrain()
+            assert self._drainTask is not None
+            await asyncio.shield(self._drainTask)
+
+    def close(self) -> None:
+        remaining = self._takeBatch(len(self._queue))
+        if self.writer is not None:
+            self.writer.write(remaining.encode('utf-8'))
+            self.writer.close()
+        else:
+            self._writeBlocking(remaining)
+
+
+class RotatingFileSink(Sink):
+    """
+    Buffered file sink that rotates its file once it reaches `maxBytes`
+    bytes or, if `interval` is given, every `interval` seconds.
+
+    Rotated segments are renamed to `<path>.<timestamp>`, compressed
+    with `compression` ('gzip', 'lzma', or None), and pruned down to the
+    `backupCount` most recent segments, all on a background thread so
+    callers never wait on compression.
+    """
+    def __init__(
+        self,
+        path: str,
+        maxBytes: Optional[int] = DEFAULT_MAX_BYTES,
+        interval: Optional[float] = None,  # Seconds.
+        compression: Optional[str] = 'gzip',
+        backupCount: Optional[int] = DEFAULT_BACKUP_COUNT,
+        bufferSize: int = DEFAULT_BUFFER_SIZE,
+    ):
+        if compression is not None and compression not in COMPRESSORS:
+            raise ValueError(
+                'compression must be one of %s or None, not %r' % (
+                    ', '.join(map(repr, COMPRESSORS)), compression))
+
+        self.path = os.path.abspath(path)
+        self.maxBytes = maxBytes
+        self.interval = interval
+        self.compression = compression
+        self.backupCount = backupCount
+        self.bufferSize = bufferSize
+
+        self._lock = threading.Lock()
+        self._pending: 'queue.Queue[Optional[str]]' = queue.Queue()
+        self._unprocessed: Set[str] = set()  # Rotated, but not compressed.
+        self._worker: Optional[threading.Thread] = None
+        self._open()
+        registerForkHandlers(self)
+
+    def beforeFork(self) -> None:
+        # Write out the buffer first, so the child doesn't inherit, and
+        # later write out, a copy of it.
+        self._lock.acquire()
+        if not self._file.closed:
+            self._file.flush()
+
+    def afterForkInParent(self) -> None:
+        self._lock.release()
+
+    def afterForkInChild(self) -> None:
+        # Rotating renames, compresses, and prunes the file by path, so
+        # two writers would rotate each other's segments away. The child
+        # writes, and rotates, a file of its own, <path>.<pid>, instead;
+        # the parent compresses the segments it rotated. The child's copy
+        # of the parent's buffer is empty, and its worker is started anew.
+        self._lock = threading.Lock()
+        self._pending = queue.Queue()
+        self._unprocessed = set()
+        self._worker = None
+        if not self._file.closed:
+            self._file.close()
+            self.path = '%s.%i' % (self.path, os.getpid())
+            self._open()
+
+    def _open(self) -> None:
+        self._file = open(self.path, 'ab', buffering=self.bufferSize)
+        self._size = self._file.tell()
+        self._rolloverAt = (
+            None if self.interval is None
+            else time.monotonic() + self.interval)
+
+    def __call__(self, s: str) -> None:
+        data = (s + '\n').encode('utf-8')
+        with self._lock:
+            if self._shouldRotate(len(data)):
+                self._rotate()
+            self._file.write(data)
+            self._size += len(data)
+
+    def _shouldRotate(self, nbytes: int) -> bool:
+        if self._size == 0:
+            return False
+        if self.maxBytes is not None and self._size + nbytes > self.maxBytes:
+            return True
+        return (
+            self._rolloverAt is not None
+            and time.monotonic() >= self._rolloverAt)
+
+    def _rotate(self) -> None:
+        self._file.close()
+
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+        rotated = '%s.%s' % (self.path, stamp)
+        i = 1
+        while os.path.exists(rotated):
+            rotated = '%s.%s.%i' % (self.path, stamp, i)
+            i += 1
+        os.rename(self.path, rotated)
+        self._unprocessed.add(rotated)
+
+        self._open()
+
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(
+                target=self._processRotated, name='icecream-rotate',
+                daemon=True)
+            self._worker.start()
+        self._pending.put(rotated)
+
+    def _processRotated(self) -> None:
+        while True:
+            rotated = self._pending.get()
+            try:
+                if rotated is None:
+                    return
+                if self.compression is not None:
+                    self._compress(rotated)
+                with self._lock:
+                    self._unprocessed.discard(rotated)
+                self._prune()
+            finally:
+                self._pending.task_done()
+
+    def _compress(self, path: str) -> None:
+        suffix, openCompressed = COMPRESSORS[cast(str, self.compression)]
+        with open(path, 'rb') as src:
+            with openCompressed(path + suffix + '.tmp', 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+        os.rename(path + suffix + '.tmp', path + suffix)
+        os.remove(path)
+
+    def rotatedSegments(self) -> List[str]:
+        """Rotated segments, oldest first."""
+        dirname, basename = os.path.split(self.path)
+        segment = re.compile(
+            re.escape(basename) + r'\.\d{8}-\d{6}-\d{6}(\.\d+)?(\.gz|\.xz)?$')
+        names = sorted(
+            (name for name in os.listdir(dirname) if segment.match(name)),
+            key=lambda name: re.sub(r'\.(gz|xz)$', '', name))
+        return [os.path.join(dirname, name) for name in names]
+
+    def _prune(self) -> None:
+        if self.backupCount is None:
+            return
+        # Segments still waiting to be compressed are neither pruned nor
+        # counted. _rotate() renames a segment and adds it to _unprocessed
+        # under the lock, so any segment listed here before taking the
+        # lock is in _unprocessed by the time it's taken.
+        segments = self.rotatedSegments()
+        with self._lock:
+            segments = [
+                path for path in segments if path not in self._unprocessed]
+        for path in segments[:max(0, len(segments) - self.backupCount)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def flush(self) -> None:
+        with self._lock:
+            self._file.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+        if self._worker is not None and self._worker.is_alive():
+            self._pending.put(None)
+            self._worker.join()
+
+
+class FlightRecorderSink(Sink):
+    """
+    Crash-surviving sink that writes ic()'s outputs into a fixed size,
+    memory-mapped ring buffer file.
+
+    Writing a record is a memory copy into the shared mapping, not a
+    system call, and the kernel keeps the mapping's pages even if the
+    process segfaults or is killed. The newest `size` bytes of output
+    can then be read back with readFlightRecording() or from the shell
+    with `python -m icecream dump <path>`.
+
+    If `path` already holds a ring of the same size, e.g. from a worker
+    that crashed, new records are appended to it.
+    """
+    def __init__(self, path: str, size: int = DEFAULT_RING_SIZE):
+        if size <= RING_RECORD.size:
+            raise ValueError('size must be greater than %i' % RING_RECORD.size)
+
+        self.path = path
+        self.capacity = size
+        self._lock = threading.Lock()
+        self._open()
+        registerForkHandlers(self)
+
+    def _open(self) -> None:
+        path, size = self.path, self.capacity
+        fileSize = RING_HEADER_SIZE + size
+        with open(path, 'a+b') as f:
+            f.seek(0)
+            header = f.read(RING_HEADER.size)
+            reuse = (
+                os.fstat(f.fileno()).st_size == fileSize
+                and len(header) == RING_HEADER.size
+                and RING_HEADER.unpack(header)[:4] == (
+                    RING_MAGIC, RING_VERSION, 0, size))
+            if not reuse:
+                f.truncate(0)
+                f.truncate(fileSize)
+            self._mmap = mmap.mmap(f.fileno(), fileSize)
+
+        if reuse:
+            self._cursor, self._seq = RING_CURSOR.unpack_from(
+                self._mmap, RING_CURSOR_OFFSET)
+        else:
+            self._cursor = self._seq = 0
+            RING_HEADER.pack_into(
+                self._mmap, 0, RING_MAGIC, RING_VERSION, 0, size, 0, 0)
+
+    def beforeFork(self) -> None:
+        self._lock.acquire()
+
+    def afterForkInParent(self) -> None:
+        self._lock.release()
+
+    def afterForkInChild(self) -> None:
+        # The mapping is shared with the parent, and two writers would
+        # tear each other's records, so the child records to its own ring,
+        # <path>.<pid>.
+        self._lock = threading.Lock()
+        if not self._mmap.closed:
+            self._mmap.close()
+            self.path = '%s.%i' % (self.path, os.getpid())
+            self._open()
+
+    def __call__(self, s: str) -> None:
+        payload = s.encode('utf-8')[:self.capacity - RING_RECORD.size]
+        with self._lock:
+            record = RING_RECORD.pack(
+                RING_RECORD_MARKER, len(payload), self._seq) + payload
+            self._copyIn(record)
+            self._cursor += len(record)
+            self._seq += 1
+            # Publish the record only once it's been copied in completely,
+            # so a crash mid-copy never leaves the header pointing at a
+            # torn record.
+            RING_CURSOR.pack_into(
+                self._mmap, RING_CURSOR_OFFSET, self._cursor, self._seq)
+
+    def _copyIn(self, data: bytes) -> None:
+        pos = self._cursor % self.capacity
+        start = RING_HEADER_SIZE + pos
+        head = min(len(data), self.capacity - pos)
+        self._mmap[start:start + head] = data[:head]
+        if head < len(data):  # Wrap around to the start of the ring.
+            tail = len(data) - head
+            self._mmap[RING_HEADER_SIZE:RING_HEADER_SIZE + tail] = data[head:]
+
+    def flush(self) -> None:
+        # Not needed to survive a process crash, only for durability
+        # across machine crashes.
+        with self._lock:
+            self._mmap.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            if not self._mmap.closed:
+                self._mmap.flush()
+                self._mmap.close()
+
+
+def readFlightRecording(path: str) -> List[Tuple[int, str]]:
+    """
+    Read the records in a FlightRecorderSink's ring buffer file as
+    (sequence number, output) tuples, oldest first.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    if len(data) < RING_HEADER_SIZE:
+        raise ValueError('%s is not an icecream flight recording' % path)
+    magic, version, _, capacity, cursor, nextSeq = RING_HEADER.unpack_from(data)
+    if magic != RING_MAGIC or len(data) != RING_HEADER_SIZE + capacity:
+        raise ValueError('%s is not an icecream flight recording' % path)
+    if version != RING_VERSION:
+        raise ValueError(
+            'Unsupported flight recording version %i in %s' % (version, path))
+
+    ring = data[RING_HEADER_SIZE:]
+
+    def read(pos: int, n: int) -> bytes:
+        start = pos % capacity
+        chunk = ring[start:start + n]
+        if len(chunk) < n:  # Wrapped around.
+            chunk += ring[:n - len(chunk)]
+        return chunk
+
+    def parse(pos: int) -> Iterator[Tuple[int, str]]:
+        # Yield the records starting at <pos>. Raises ValueError if <pos>
+        # isn't a record boundary.
+        expectedSeq = None
+        while pos < cursor:
+            if cursor - pos < RING_RECORD.size:
+                raise ValueError
+            marker, length, seq = RING_RECORD.unpack(read(pos, RING_RECORD.size))
+            if (marker != RING_RECORD_MARKER
+                    or pos + RING_RECORD.size + length > cursor
+                    or (expectedSeq is not None and seq != expectedSeq)):
+                raise ValueError
+            payload = read(pos + RING_RECORD.size, length)
+            yield seq, payload.decode('utf-8', errors='replace')
+            pos += RING_RECORD.size + length
+            expectedSeq = seq + 1
+        if expectedSeq is not None and expectedSeq != nextSeq:
+            raise ValueError
+
+    # Once the ring has wrapped, the oldest bytes are likely the tail of
+    # an overwritten record. Skip ahead to the first record boundary from
+    # which a consistent chain of records leads up to the write cursor.
+    oldest = max(0, cursor - capacity)
+    for start in range(oldest, cursor):
+        try:
+            return list(parse(start))
+        except (ValueError, struct.error):
+            continue
+    return []
+
+
+class BinaryTraceSink(RecordSink):
+    """
+    Compact binary trace sink for high volume tracing.
+
+    Instead of formatted text, this sink takes ic()'s structured records
+    and writes them as interned call sites plus small binary call
+    entries, buffered. Decode a trace with readBinaryTrace() or from the
+    shell with `python -m icecream decode <path>`.
+    """
+    def __init__(self, path: str, bufferSize: int = DEFAULT_TRACE_BUFFER_SIZE):
+        self.path = path
+        self.bufferSize = bufferSize
+        self._lock = threading.Lock()
+        self._open()
+        registerForkHandlers(self)
+
+    def _open(self) -> None:
+        self._file: BinaryIO = open(self.path, 'wb', buffering=self.bufferSize)
+        self._wallNs = time.time_ns()
+        self._start = self._wallNs / 1e9
+        self._file.write(TRACE_HEADER.pack(
+            TRACE_MAGIC, TRACE_VERSION, 0, self._wallNs, os.getpid()))
+        self._strings: Dict[Optional[str], int] = {None: TRACE_NONE}
+        self._sites: Dict[Hashable, int] = {}
+
+    def beforeFork(self) -> None:
+        self._lock.acquire()
+        if not self._file.closed:
+            self._file.flush()
+
+    def afterForkInParent(self) -> None:
+        self._lock.release()
+
+    def afterForkInChild(self) -> None:
+        # A trace has a single writer, its interned strings and sites
+        # numbered in the order they're written, so the child traces to a
+        # new file, <path>.<pid>. Its copy of the parent's buffer is empty.
+        self._lock = threading.Lock()
+        if not self._file.closed:
+            self._file.close()
+            self.path = '%s.%i' % (self.path, os.getpid())
+            self._open()
+
+    def _stringId(self, s: Optional[str]) -> int:
+        try:
+            return self._strings[s]
+        except KeyError:
+            pass
+        stringId = self._strings[s] = len(self._strings) - 1
+        data = cast(str, s).encode('utf-8')
+        self._file.write(
+            TRACE_TAG.pack(TRACE_STRING)
+            + TRACE_STRING_HEADER.pack(stringId, len(data)) + data)
+        return stringId
+
+    def _siteId(self, record: Dict[str, Any]) -> int:
+        exprs = tuple(arg['expr'] for arg in record['args'])
+        key = (record['file'], record['line'], record['function'], exprs)
+        try:
+            return self._sites[key]
+        except KeyError:
+            pass
+        siteId = self._sites[key] = len(self._sites)
+        fileId = self._stringId(record['file'])
+        functionId = self._stringId(record['function'])
+        exprIds = [self._stringId(expr) for expr in exprs]
+        self._file.write(
+            TRACE_TAG.pack(TRACE_SITE)
+            + TRACE_SITE_HEADER.pack(
+                siteId, fileId, functionId, record['line'], len(exprs))
+            + b''.join(TRACE_ID.pack(exprId) for exprId in exprIds))
+        return siteId
+
+    def writeRecord(self, record: Dict[str, Any]) -> None:
+        # The call's time, which, e.g. for recorded calls dumped later,
+        # isn't now. Subtracting the start first keeps every bit of it;
+        # scaling a time.time() to ns would round it to 256ns.
+        elapsedNs = round((record['timestamp'] - self._start) * 1e9)
+        with self._lock:
+            siteId = self._siteId(record)
+            parts = [
+                TRACE_TAG.pack(TRACE_CALL),
+                TRACE_CALL_HEADER.pack(
+                    siteId, elapsedNs, record['thread_id'],
+                    self._stringId(record['thread']),
+                    self._stringId(record.get('task')), len(record['args'])),
+            ]
+            for arg in record['args']:
+                value = arg['value_repr'].encode('utf-8')
+                parts.append(TRACE_VALUE_HEADER.pack(
+                    self._stringId(arg['type']), len(value)))
+                parts.append(value)
+            self._file.write(b''.join(parts))
+
+    def flush(self) -> None:
+        with self._lock:
+            self._file.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+def readBinaryTrace(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Decode a BinaryTraceSink's trace file into structured records, like
+    those output with outputFormat='json', in the order they were
+    written.
+
+    Calls' times are stored as integer nanoseconds since the trace's
+    start, the wall clock time in its header, and decoded back into the
+    calls' time.time() timestamps exactly.
+    """
+    with open(path, 'rb') as f:
+        header = f.read(TRACE_HEADER.size)
+        if len(header) < TRACE_HEADER.size:
+            raise ValueError('%s is not an icecream binary trace' % path)
+        magic, version, _, wallNs, pid = TRACE_HEADER.unpack(header)
+        if magic != TRACE_MAGIC:
+            raise ValueError('%s is not an icecream binary trace' % path)
+        if version != TRACE_VERSION:
+            raise ValueError(
+                'Unsupported binary trace version %i in %s' % (version, path))
+
+        start = wallNs / 1e9
+
+        def read(n: int) -> bytes:
+            data = f.read(n)
+            if len(data) < n:
+                raise EOFError
+            return data
+
+        strings: Dict[int, Optional[str]] = {TRACE_NONE: None}
+        sites: Dict[int, Tuple[Optional[str], int, Optional[str], List[Optional[str]]]] = {}
+        while True:
+            tag = f.read(1)
+            if not tag:
+                return
+            try:
+                if tag[0] == TRACE_STRING:
+                    stringId, length = TRACE_STRING_HEADER.unpack(
+                        read(TRACE_STRING_HEADER.size))
+                    strings[stringId] = read(length).decode('utf-8')
+                elif tag[0] == TRACE_SITE:
+                    siteId, fileId, functionId, line, nargs = (
+                        TRACE_SITE_HEADER.unpack(read(TRACE_SITE_HEADER.size)))
+                    exprIds = struct.unpack('<%iI' % nargs, read(4 * nargs))
+                    sites[siteId] = (
+                        strings[fileId], line, strings[functionId],
+                        [strings[exprId] for exprId in exprIds])
+                elif tag[0] == TRACE_CALL:
+                    siteId, elapsedNs, threadId, threadNameId, taskNameId, nvalues = (
+                        TRACE_CALL_HEADER.unpack(read(TRACE_CALL_HEADER.size)))
+                    filename, line, function, exprs = sites[siteId]
+                    args = []
+                    for expr in exprs[:nvalues]:
+                        typeId, length = TRACE_VALUE_HEADER.unpack(
+                            read(TRACE_VALUE_HEADER.size))
+                        args.append({
+                            'expr': expr,
+                            'value_repr': read(length).decode('utf-8'),
+                            'type': strings[typeId],
+                        })
+                    record = {
+                        'timestamp': start + elapsedNs / 1e9,
+                        'file': filename,
+                        'line': line,
+                        'function': function,
+                        'thread': strings[threadNameId],
+                        'thread_id': threadId,
+                        'pid': pid,
+                        'args': args,
+                    }
+                    if strings[taskNameId] is not None:
+                        record['task'] = strings[taskNameId]
+                    yield record
+                else:
+                    raise ValueError(
+                        'Corrupt binary trace %s: unknown entry type %i' % (
+                            path, tag[0]))
+            except EOFError:  # Truncated, e.g. the writer crashed.
+                return
+
+
+class SocketSink(RecordSink):
+    """
+    Sends ic()'s structured records to a collector, like `python -m
+    icecream collect`, over a Unix domain socket.
+
+    Records are queued and sent in batches by a background thread over a
+    persistent connection that's reestablished if it drops. Callers never
+    wait on the socket; if the collector's unreachable for long enough
+    that the queue fills up, the oldest records are dropped and counted in
+    `dropped`. flush() and close() wait for queued records to be sent for
+    at most `timeout` seconds, so neither hangs while it's unreachable.
+    """
+    def __init__(
+        self,
+        path: str,
+        batchSize: int = DEFAULT_BATCH_SIZE,
+        flushInterval: float = DEFAULT_FLUSH_INTERVAL,
+        maxQueueSize: int = DEFAULT_MAX_QUEUE_SIZE,
+    ):
+        self.path = path
+        self.batchSize = batchSize
+        self.flushInterval = flushInterval
+        self.dropped = 0
+
+        self._queue: Deque[bytes] = deque(maxlen=maxQueueSize)
+        self._cond = threading.Condition()
+        self._inFlight = 0
+        self._closing = False
+        self._sock: Optional[socket.socket] = None
+        self._sender: Optional[threading.Thread] = None
+        registerForkHandlers(self)
+
+    def beforeFork(self) -> None:
+        self._cond.acquire()
+
+    def afterForkInParent(self) -> None:
+        self._cond.release()
+
+    def afterForkInChild(self) -> None:
+        # The parent sends what it queued, over its connection. The child
+        # connects, and starts its sender, anew on its first record.
+        self._cond = threading.Condition()
+        self._queue.clear()
+        self._inFlight = 0
+        if self._sock is not None:
+            self._sock.close()  # Only the child's copy.
+            self._sock = None
+        self._sender = None
+
+    def writeRecord(self, record: Dict[str, Any]) -> None:
+        data = jsonDumps(record).encode('utf-8')
+        frame = FRAME_HEADER.pack(len(data)) + data
+        with self._cond:
+            if self._closing:
+                raise ValueError('write to closed SocketSink')
+            if len(self._queue) == self._queue.maxlen:
+                self.dropped += 1
+            self._queue.append(frame)
+            if len(self._queue) >= self.batchSize:
+                self._cond.notify()
+        if self._sender is None:
+            self._startSender()
+
+    def _startSender(self) -> None:
+        with self._cond:
+            if self._sender is None:
+                self._sender = threading.Thread(
+                    target=self._send, name='icecream-socket', daemon=True)
+                self._sender.start()
+
+    def _send(self) -> None:
+        failures = 0
+        while True:
+            with self._cond:
+                if not self._queue and not self._closing:
+                    self._cond.wait(self.flushInterval)
+                if not self._queue:
+                    if self._closing:
+                        return
+                    continue
+                batch = [
+                    self._queue.popleft()
+                    for _ in range(min(self.batchSize, len(self._queue)))]
+                self._inFlight = len(batch)
+
+            try:
+                if self._sock is None:
+                    self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                    self._sock.connect(self.path)
+                self._sock.sendall(b''.join(batch))
+                failures = 0
+            except OSError:
+                self._disconnect()
+                with self._cond:
+                    # Requeue the batch, unless newer records have since
+                    # filled the queue.
+                    for frame in reversed(batch):
+                        if len(self._queue) == self._queue.maxlen:
+                            self.dropped += 1
+                            continue
+                        self._queue.appendleft(frame)
+                    if self._closing:
+                        self.dropped += len(self._queue)
+                        self._queue.clear()
+                failures += 1
+                time.sleep(min(1.0, DEFAULT_RECONNECT_DELAY * 2 ** failures))
+            finally:
+                with self._cond:
+                    self._inFlight = 0
+                    self._cond.notify_all()
+
+    def _disconnect(self) -> None:
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+            self._sock = None
+
+    def flush(self, timeout: Optional[float] = DEFAULT_FLUSH_TIMEOUT) -> bool:
+        """
+        Wait for the queued records to be sent, for at most `timeout`
+        seconds, or indefinitely if it's None. Returns whether they were.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._queue or self._inFlight:
+                self._cond.notify_all()
+                remaining = (
+                    None if deadline is None else deadline - time.monotonic())
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(
+                    self.flushInterval if remaining is None
+                    else min(remaining, self.flushInterval))
+        return True
+
+    def close(self, timeout: Optional[float] = DEFAULT_FLUSH_TIMEOUT) -> None:
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        if self._sender is not None:
+            self._sender.join(timeout)
+        self._disconnect()
+
+
+class Collector:
+    """
+    Collects the records that SocketSinks, e.g. in every worker process
+    of a server, send to the Unix domain socket at `path` and passes them
+    to `output` in timestamp order.
+
+    Records are held back for `window` seconds after they arrive, so
+    records from different processes that arrive slightly out of order
+    are put back in order before being output. Malformed frames are
+    skipped and counted in `skipped`.
+    """
+    def __init__(
+        self,
+        path: str,
+        output: Callable[[Dict[str, Any]], None],
+        window: float = DEFAULT_COLLECT_WINDOW,
+    ):
+        self.path = path
+        self.output = output
+        self.window = window
+        self.skipped = 0
+
+        # (timestamp, arrival order, arrival time, record) heap.
+        self._pending: List[Tuple[float, int, float, Dict[str, Any]]] = []
+        self._order = count()
+        self._buffers: Dict[socket.socket, bytearray] = {}
+        self._selector = selectors.DefaultSelector()
+        self._stopped = threading.Event()
+
+        if os.path.exists(path):
+            os.remove(path)  # A stale socket from a previous collector.
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(path)
+        self._server.listen()
+        self._server.setblocking(False)
+        self._selector.register(self._server, selectors.EVENT_READ)
+
+    def serveForever(self) -> None:
+        try:
+            while not self._stopped.is_set():
+                for key, _ in self._selector.select(self.window / 2):
+                    sock = cast(socket.socket, key.fileobj)
+                    if sock is self._server:
+                        self._accept()
+                    else:
+                        self._read(sock)
+                self._outputPending(time.monotonic() - self.window)
+        finally:
+            for sock in list(self._buffers):
+                self._read(sock)
+                if sock in self._buffers:
+                    self._drop(sock)
+            self._outputPending(float('inf'))
+            self._selector.close()
+            self._server.close()
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def _accept(self) -> None:
+        try:
+            sock, _ = self._server.accept()
+        except BlockingIOError:
+            return
+        sock.setblocking(False)
+        self._buffers[sock] = bytearray()
+        self._selector.register(sock, selectors.EVENT_READ)
+
+    def _read(self, sock: socket.socket) -> None:
+        buf = self._buffers[sock]
+        while True:
+            try:
+                data = sock.recv(256 * 1024)
+            except BlockingIOError:
+                break
+            except OSError:
+                data = b''
+            if not data:  # Disconnected.
+                self._parse(buf)
+                self._drop(sock)
+                return
+            buf += data
+        self._parse(buf)
+
+    def _parse(self, buf: bytearray) -> None:
+        pos = 0
+        now = time.monotonic()
+        while len(buf) - pos >= FRAME_HEADER.size:
+            (length,) = FRAME_HEADER.unpack_from(buf, pos)
+            end = pos + FRAME_HEADER.size + length
+            if end > len(buf):
+                break
+            try:
+                record = json.loads(bytes(buf[pos + FRAME_HEADER.size:end]))
+                timestamp = float(record.get('timestamp', 0.0))
+            except (ValueError, TypeError, AttributeError):
+                self.skipped += 1
+            else:
+                heapq.heappush(
+                    self._pending, (timestamp, next(self._order), now, record))
+            pos = end
+        del buf[:pos]
+
+    def _drop(self, sock: socket.socket) -> None:
+        del self._buffers[sock]
+        self._selector.unregister(sock)
+        sock.close()
+
+    def _outputPending(self, arrivedBefore: float) -> None:
+        while self._pending and self._pending[0][2] <= arrivedBefore:
+            self.output(heapq.heappop(self._pending)[3])
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+
+#
+# IceCream - Never use print() to debug again
+#
+# Ansgar Grunseid
+# grunseid.com
+# grunseid@gmail.com
+#
+# License: MIT
+#
+
+"""
+Soak test for long-running processes. Generates thousands of modules that
+call ic(), runs them over and over in one process, and checks that memory,
+traced with tracemalloc, and ic()'s caches stop growing once every call
+site has been seen. Run it with `python -m icecream.soak`.
+"""
+
+import argparse
+import contextvars
+import gc
+import importlib
+import linecache
+import os
+import sys
+import tempfile
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from .icecream import IceCreamDebugger, Source, argumentToString, jsonDumps
+
+DEFAULT_MODULES = 1000
+DEFAULT_ROUNDS = 30
+# Rounds, to fill every cache, before measuring. Checkpoint histograms,
+# which get one time per pair of call sites per round, take the longest to
+# fill their MAX_CHECKPOINT_BUCKETS buckets.
+DEFAULT_WARMUP = 22
+DEFAULT_MAX_GROWTH = 64 * 1024  # Bytes per round.
+TOP_GROWTH = 10  # Allocation sites to list when memory grows.
+
+# Every module has its own class, so argumentToString() dispatches on
+# thousands of classes, and its own call sites.
+MODULE_TEMPLATE = '''\
+class Thing{n}:
+    pass
+
+
+def run(ic):
+    thing = Thing{n}()
+    ic()
+    ic({n}, 'module {n}')
+    ic(thing)
+    with ic.timer('module'):
+        ic({{'n': {n}, 'items': [1, 2, 3]}})
+    return ic.format(thing)
+'''
+
+
+def discard(s: str) -> None:
+    pass
+
+
+def writeModules(directory: str, count: int) -> List[str]:
+    names = []
+    for n in range(count):
+        name = 'icecream_soak_%i' % n
+        with open(os.path.join(directory, name + '.py'), 'w') as f:
+            f.write(MODULE_TEMPLATE.format(n=n))
+        names.append(name)
+    return names
+
+
+def cacheSizes(ic: IceCreamDebugger) -> Dict[str, int]:
+    """The sizes of the caches ic() fills as it sees new call sites."""
+    sizes = {
+        'linecache': len(linecache.cache),
+        'argumentToString': argumentToString.cacheSize(),  # type: ignore[attr-defined]
+        'sites': len(ic._siteStats or ()),
+        'samplingSites': len(ic._siteSampling),
+        'allowedSites': len(ic._allowedSites),
+        'checkpoints': len(ic._checkpoints),
+        'timers': len(ic._timers),
+    }
+    # executing's own caches, private to it, so only if they're there.
+    for name, cache in (
+            ('executing', '__executing_cache'),
+            ('executingSources', '__source_cache_with_lines')):
+        try:
+            sizes[name] = len(Source._class_local(cache, {}))
+        except (AttributeError, TypeError):
+            pass
+    return sizes
+
+
+def findGrowth(
+    samples: Sequence[Dict[str, Any]],
+    warmup: int,
+    maxGrowth: int,
+) -> List[str]:
+    """
+    Return how memory, or any cache, in <samples>, one per round, grew
+    after the first <warmup> rounds: memory by more than <maxGrowth> bytes
+    per round, on average, or a cache past its size after the warmup.
+    """
+    if len(samples) <= warmup:
+        return []
+
+    problems = []
+    baseline, last = samples[warmup - 1] if warmup else samples[0], samples[-1]
+    rounds = len(samples) - max(warmup, 1)
+    growth = (last['memory'] - baseline['memory']) / max(rounds, 1)
+    if growth > maxGrowth:
+        problems.append(
+            'memory grew %i bytes per round, from %i to %i bytes' % (
+                growth, baseline['memory'], last['memory']))
+    for name, size in last['caches'].items():
+        if size > baseline['caches'].get(name, size):
+            problems.append('cache %s grew from %i to %i entries' % (
+                name, baseline['caches'][name], size))
+    return problems
+
+
+def soak(
+    modules: int = DEFAULT_MODULES,
+    rounds: int = DEFAULT_ROUNDS,
+    warmup: int = DEFAULT_WARMUP,
+    maxGrowth: int = DEFAULT_MAX_GROWTH,
+    progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> Dict[str, Any]:
+    """
+    Generate <modules> modules, import them, and call each one's run(ic)
+    <rounds> times, with sampling, filters, site and stage stats,
+    checkpoints, and context all on, so every cache ic() has is in play.
+    Returns every round's traced memory and cache sizes, the allocation
+    sites that grew the most after the warmup, and the problems
+    findGrowth() found.
+
+    Every round runs in a new context, like a request would, so its
+    checkpoints start a new chain, and pair up the same call sites.
+    """
+    ic = IceCreamDebugger(outputFunction=discard)
+    ic.configureOutput(
+        includeContext=True, contextThread=True, siteStats=True,
+        stageStats=True, sampleEvery=1, checkpointMode=True)
+    ic.exclude(function='never')
+
+    samples: List[Dict[str, Any]] = []
+    wasTracing = tracemalloc.is_tracing()
+    with tempfile.TemporaryDirectory(prefix='icecream-soak-') as directory:
+        sys.path.insert(0, directory)
+        names = writeModules(directory, modules)
+        importlib.invalidate_caches()
+        if not wasTracing:
+            tracemalloc.start()
+        try:
+            runs = [importlib.import_module(name).run for name in names]
+            baseline = None
+            def runRound() -> None:
+                for run in runs:
+                    run(ic)
+
+            for i in range(rounds):
+                contextvars.Context().run(runRound)
+                gc.collect()
+                sample = {
+                    'round': i + 1,
+                    'memory': tracemalloc.get_traced_memory()[0],
+                    'caches': cacheSizes(ic),
+                }
+                samples.append(sample)
+                if progress is not None:
+                    progress(sample)
+                if i + 1 == max(warmup, 1):
+                    baseline = tracemalloc.take_snapshot()
+
+            top = []
+            if baseline is not None:
+                stats = tracemalloc.take_snapshot().compare_to(
+                    baseline, 'lineno')
+                top = [
+                    {'site': str(stat.traceback), 'bytes': stat.size_diff,
+                     'count': stat.count_diff}
+                    for stat in stats[:TOP_GROWTH] if stat.size_diff > 0]
+        finally:
+            if not wasTracing:
+                tracemalloc.stop()
+            sys.path.remove(directory)
+            for name in names:
+                sys.modules.pop(name, None)
+                linecache.cache.pop(
+                    os.path.join(directory, name + '.py'), None)
+
+    return {
+        'modules': modules,
+        'rounds': rounds,
+        'warmup': warmup,
+        'samples': samples,
+        'top_growth': top,
+        'problems': findGrowth(samples, warmup, maxGrowth),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='python -m icecream.soak',
+        description='Check that memory and ic() caches stop growing.')
+    parser.add_argument(
+        '--modules', type=int, default=DEFAULT_MODULES,
+        help='modules to generate')
+    parser.add_argument(
+        '--rounds', type=int, default=DEFAULT_ROUNDS,
+        help='times to run every module')
+    parser.add_argument(
+        '--warmup', type=int, default=DEFAULT_WARMUP,
+        help='rounds before growth is measured')
+    parser.add_argument(
+        '--max-growth', type=int, default=DEFAULT_MAX_GROWTH,
+        help='bytes memory may grow per round after the warmup')
+    parser.add_argument(
+        '--json', action='store_true', help='output the results as JSON')
+    args = parser.parse_args(argv)
+
+    def progress(sample: Dict[str, Any]) -> None:
+        print('round %3i: %12i bytes  %s' % (
+            sample['round'], sample['memory'], ' '.join(
+                '%s=%i' % item for item in sample['caches'].items())))
+
+    result = soak(
+        args.modules, args.rounds, args.warmup, args.max_growth,
+        None if args.json else progress)
+
+    if args.json:
+        print(jsonDumps(result))
+    else:
+        for stat in result['top_growth']:
+            print('%+10i bytes %+7i blocks  %s' % (
+                stat['bytes'], stat['count'], stat['site']))
+        for problem in result['problems']:
+            print('FAIL: %s' % problem)
+        if not result['problems']:
+            print('OK: memory and caches stopped growing after %i rounds' % (
+                args.warmup))
+    return 1 if result['problems'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
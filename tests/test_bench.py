@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+#
+# IceCream - Never use print() to debug again
+#
+# Ansgar Grunseid
+# grunseid.com
+# grunseid@gmail.com
+#
+# License: MIT
+#
+
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+from icecream import argumentToString
+from icecream.bench import (
+    SUITE, allocations, main as benchMain, suite, threadScaling)
+from icecream.icecream import colorizeState
+from tests.test_icecream import capture_standard_streams
+
+
+class TestThreadScaling(unittest.TestCase):
+    def test_results(self):
+        results = threadScaling([1, 2], calls=50)
+        self.assertEqual([r['threads'] for r in results], [1, 2])
+        self.assertEqual(results[0]['speedup'], 1.0)
+        self.assertTrue(all(r['calls_per_second'] > 0 for r in results))
+
+    def test_json_output(self):
+        with capture_standard_streams() as (out, err):
+            rc = benchMain(['threads', '--threads', '1', '--calls', '10', '--json'])
+        self.assertEqual(rc, 0)
+        output = json.loads(out.getvalue())
+        self.assertIn('gil_enabled', output)
+        self.assertEqual(len(output['results']), 1)
+
+
+class TestSuite(unittest.TestCase):
+    def test_results(self):
+        run = suite(['bare', 'cold'], calls=5, repeat=2, coldCalls=3)
+        self.assertEqual(list(run['results']), ['bare', 'cold'])
+        self.assertEqual(run['results']['bare']['repeat'], 2)
+        self.assertEqual(run['results']['cold']['calls'], 3)
+        self.assertTrue(all(
+            r['ns_per_call'] > 0 for r in run['results'].values()))
+        self.assertIn('python', run)
+
+    def test_every_benchmark_runs(self):
+        run = suite(list(SUITE), calls=1, repeat=1)
+        self.assertEqual(list(run['results']), list(SUITE))
+
+    def test_suite_is_the_default(self):
+        with capture_standard_streams() as (out, err):
+            rc = benchMain(['--only', 'int', '--calls', '5', '--json'])
+        self.assertEqual(rc, 0)
+        self.assertEqual(list(json.loads(out.getvalue())['results']), ['int'])
+
+    def test_compare(self):
+        with capture_standard_streams() as (out, err):
+            benchMain(['suite', '--only', 'int', '--calls', '5', '--json'])
+        fd, path = tempfile.mkstemp(suffix='.json')
+        with os.fdopen(fd, 'w') as f:
+            f.write(out.getvalue())
+        try:
+            with capture_standard_streams() as (out, err):
+                rc = benchMain([
+                    '--only', 'int', '--calls', '5', '--compare', path])
+        finally:
+            os.remove(path)
+        self.assertEqual(rc, 0)
+        self.assertIn('vs baseline', out.getvalue())
+        self.assertRegex(out.getvalue(), r'int .* \d+\.\d\dx')
+
+    def test_unknown_benchmark(self):
+        with capture_standard_streams() as (out, err):
+            rc = benchMain(['--only', 'nope'])
+        self.assertEqual(rc, 2)
+        self.assertIn('nope', err.getvalue())
+
+
+class TestAllocations(unittest.TestCase):
+    def test_results(self):
+        results = allocations(['bare', 'two_args'], calls=20)
+        self.assertEqual(list(results), ['bare', 'two_args'])
+        self.assertEqual(results['two_args']['calls'], 20)
+        self.assertGreater(results['two_args']['peak_bytes_per_call'], 0)
+
+    def test_two_args_allocate_little(self):
+        # Before arguments' source and literalness were cached per call
+        # site, ic(a, b) peaked at about 14KB.
+        results = allocations(['two_args'], calls=50)
+        self.assertLess(results['two_args']['peak_bytes_per_call'], 8192)
+
+    def test_json_output(self):
+        with capture_standard_streams() as (out, err):
+            rc = benchMain(['allocations', '--only', 'int', '--calls', '5', '--json'])
+        self.assertEqual(rc, 0)
+        self.assertEqual(list(json.loads(out.getvalue())['results']), ['int'])
+
+
+class TestPerThreadState(unittest.TestCase):
+    def inThread(self, fn):
+        result = []
+        thread = threading.Thread(target=lambda: result.append(fn()))
+        thread.start()
+        thread.join()
+        return result[0]
+
+    def test_each_thread_has_its_own_lexer(self):
+        lexer = colorizeState.lexer
+        self.assertIsNot(self.inThread(lambda: colorizeState.lexer), lexer)
+        self.assertIs(colorizeState.lexer, lexer)
+
+    def test_registering_invalidates_dispatch_caches(self):
+        class Thing:
+            pass
+
+        self.assertNotEqual(argumentToString(Thing()), 'thing')  # Cached.
+        argumentToString.register(Thing, lambda obj: 'thing')
+        try:
+            self.assertEqual(self.inThread(lambda: argumentToString(Thing())), 'thing')
+            self.assertEqual(argumentToString(Thing()), 'thing')
+        finally:
+            argumentToString.unregister(Thing)
+        self.assertNotEqual(argumentToString(Thing()), 'thing')
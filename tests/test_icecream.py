@@ -10,16 +10,31 @@
 # License: MIT
 #
 
+import asyncio
+import copy
+import functools
+import gc
+import inspect
+import json
+import logging
+import os
+import re
+import signal
+import subprocess
 import sys
+import threading
+import time
 import unittest
+import unittest.mock
 import warnings
 
+from datetime import datetime
 from io import StringIO
 from contextlib import contextmanager
 from os.path import basename, splitext, realpath
 
 import icecream
-from icecream import ic, argumentToString, stderr_print
+from icecream import ic, argumentToString, stderr_print, IceCreamDebugger
 from icecream import NO_SOURCE_AVAILABLE_WARNING_MESSAGE
 from icecream.icecream import has_non_ascii_chars
 
@@ -407,6 +422,43 @@ class TestIceCream(unittest.TestCase):
         assert tuple not in argumentToString.registry
         assert ic.format(x) == default_output
 
+    def test_singledispatch_keeps_functools_attributes(self):
+        dispatcher = functools.singledispatch(lambda obj: '')
+        for name in dispatcher.__dict__:
+            assert hasattr(argumentToString, name), name
+        assert argumentToString.__wrapped__.__name__ == 'argumentToString'
+
+        argumentToString((1, 2))
+        assert argumentToString.cacheSize() >= 1
+        argumentToString._clear_cache()  # Also drops this thread's cache.
+        argumentToString(1)
+        assert argumentToString.cacheSize() == 1
+
+    @unittest.skipIf(
+        sys.version_info < (3, 11), 'singledispatch takes unions from 3.11')
+    def test_singledispatch_union_decorator(self):
+        class A:
+            pass
+
+        class B:
+            pass
+
+        a = A()
+        decorate = argumentToString.register(A | B)
+        default = ic.format(a)  # Cached before the decorator's applied.
+
+        @decorate
+        def _(obj):
+            return 'A or B!'
+
+        try:
+            assert ic.format(a).endswith('A or B!')
+            assert ic.format(B()).endswith('A or B!')
+        finally:
+            argumentToString.unregister(A)
+            argumentToString.unregister(B)
+        assert ic.format(a) == default
+
     def test_single_argument_long_line_not_wrapped(self):
         # A single long line with one argument is not line wrapped.
         longStr = '*' * (ic.lineWrapWidth + 1)
@@ -631,6 +683,24 @@ ic| (a,
         with self.assertRaises(TypeError):
             ic.configureOutput()
 
+    def test_rejected_configure_output_changes_nothing(self):
+        outputs = []
+        ic = IceCreamDebugger(outputFunction=outputs.append)
+        before = dict(vars(ic))
+        valid = {
+            'prefix': '{pid}| ', 'includeContext': True, 'outputFormat': 'json',
+            'timestampFormat': 'epoch', 'sampleRate': 0.5}
+        invalid = [
+            {'sampleEvery': 0}, {'overheadBudget': 0},
+            {'outputFormat': 'xml'}, {'timestampFormat': 'never'},
+            {'overheadClock': 'sundial'}, {'prefix': '{thread_id:%H}| '}]
+        for options in invalid:
+            with self.assertRaises(ValueError):
+                ic.configureOutput(**dict(valid, **options))
+            self.assertEqual(vars(ic), before)
+        ic(a)
+        self.assertEqual(outputs, ['ic| a: 1'])
+
     def test_multiline_strings_output(self):
 
         test1 = "A\\veryvery\\long\\path\\to\\no\\even\\longer\\HelloWorld _01_Heritisfinallythe file.file"
@@ -798,3 +868,1188 @@ ic| (a,
         finally:
             ic.configureOutput(noColor=originalNoColor)
             ic.outputFunction = originalOutputFunction
+
+
+class TestRecorder(unittest.TestCase):
+    def setUp(self):
+        self.outputs = []
+        self.ic = IceCreamDebugger(outputFunction=self.outputs.append)
+
+    def tearDown(self):
+        self.ic.stopRecording()
+
+    def test_formatting_is_deferred_until_dump(self):
+        formatted = []
+
+        def toString(obj):
+            formatted.append(obj)
+            return repr(obj)
+
+        self.ic.configureOutput(argToStringFunction=toString)
+        self.ic.startRecording()
+        lst = [1]
+        assert self.ic(lst) is lst
+        self.ic()
+        lst.append(2)  # Recorded by reference.
+        assert self.outputs == [] and formatted == []
+
+        self.ic.dumpRecording()
+        assert self.outputs[0] == 'ic| lst: [1, 2]'
+        assert line_is_context_and_time(self.outputs[1])
+
+        self.ic.dumpRecording()  # Dumping empties the ring.
+        assert len(self.outputs) == 2
+
+    def test_snapshot(self):
+        self.ic.startRecording(snapshot=copy.copy)
+        lst = [1]
+        self.ic(lst)
+        lst.append(2)
+        self.ic.stopRecording(dump=True)
+        assert self.outputs == ['ic| lst: [1]']
+
+        self.ic(lst)  # No longer recording.
+        assert self.outputs[-1] == 'ic| lst: [1, 2]'
+
+    def test_ring_keeps_newest_calls(self):
+        self.ic.startRecording(maxRecords=3)
+        for i in range(10):
+            self.ic(i)
+        self.ic.dumpRecording()
+        assert self.outputs == ['ic| i: 7', 'ic| i: 8', 'ic| i: 9']
+
+    def test_dump_on_uncaught_exception(self):
+        hooked = []
+        originalExcepthook = sys.excepthook
+        sys.excepthook = hook = lambda *args: hooked.append(args)
+        try:
+            self.ic.startRecording()
+            self.ic(a)
+            error = ValueError()
+            sys.excepthook(ValueError, error, None)
+            self.ic.stopRecording()
+            assert sys.excepthook is hook  # Restored.
+        finally:
+            sys.excepthook = originalExcepthook
+
+        assert self.outputs == ['ic| a: 1']
+        assert hooked == [(ValueError, error, None)]
+
+    def test_thread_name_in_context(self):
+        self.ic.startRecording()
+        thread = threading.Thread(target=lambda: self.ic(a), name='worker')
+        thread.start()
+        thread.join()
+        self.ic.configureOutput(includeContext=True)
+        self.ic.dumpRecording()
+        assert '[thread=worker]- a: 1' in self.outputs[0]
+
+
+class TestJsonOutput(unittest.TestCase):
+    def setUp(self):
+        self.outputs = []
+        self.ic = IceCreamDebugger(
+            outputFunction=self.outputs.append, outputFormat='json')
+
+    def test_args(self):
+        multilineStr = 'line1\nline2'
+        self.ic(a, multilineStr, 3)
+
+        record = json.loads(self.outputs[0])
+        assert record['file'] == MY_FILENAME
+        assert record['function'] == 'test_args'
+        assert record['thread'] == threading.current_thread().name
+        assert record['pid'] == os.getpid()
+        assert isinstance(record['line'], int)
+        assert isinstance(record['timestamp'], float)
+        assert record['args'] == [
+            {'expr': 'a', 'value_repr': '1', 'type': 'int'},
+            {'expr': 'multilineStr', 'value_repr': "'''line1\nline2'''",
+             'type': 'str'},
+            {'expr': '3', 'value_repr': '3', 'type': 'int'},
+        ]
+
+    def test_without_args_and_format(self):
+        self.ic()
+        assert json.loads(self.outputs[0])['args'] == []
+        assert json.loads(self.ic.format(a))['args'][0]['expr'] == 'a'
+
+    def test_default_output_function_is_not_colored(self):
+        self.ic.configureOutput(outputFunction=icecream.DEFAULT_OUTPUT_FUNCTION)
+        with capture_standard_streams() as (out, err):
+            self.ic({1: 'str'})
+        assert not has_ansi_escape_codes(err.getvalue())
+        assert json.loads(err.getvalue())['args'][0]['type'] == 'dict'
+
+    def test_invalid_output_format(self):
+        with self.assertRaises(ValueError):
+            self.ic.configureOutput(outputFormat='xml')
+
+
+class TestLogging(unittest.TestCase):
+    def setUp(self):
+        self.records = []
+
+        class ListHandler(logging.Handler):
+            def emit(handler, record):
+                self.records.append(record)
+
+        # Not registered with logging.getLogger(), so no other handlers,
+        # like pytest's, format the records.
+        self.logger = logging.Logger('icecream.tests', logging.DEBUG)
+        self.logger.addHandler(ListHandler())
+        self.outputs = []
+        self.ic = IceCreamDebugger(
+            outputFunction=self.outputs.append, logger=self.logger)
+
+    def test_timers_respect_the_loggers_level(self):
+        self.logger.setLevel(logging.WARNING)
+        with self.ic.timer('t'):
+            pass
+        assert self.records == []
+        self.ic.configureOutput(level=logging.WARNING)
+        with self.ic.timer('t'):
+            pass
+        assert len(self.records) == 1
+
+    def test_records_go_to_the_logger(self):
+        self.ic(a); line = sys._getframe().f_lineno  # noqa
+
+        [record] = self.records
+        assert self.outputs == []
+        assert record.levelno == logging.DEBUG
+        assert record.name == 'icecream.tests'
+        assert record.pathname == __file__
+        assert record.lineno == line
+        assert record.funcName == 'test_records_go_to_the_logger'
+        assert record.getMessage() == 'ic| a: 1'
+
+    def test_message_is_formatted_lazily(self):
+        formatted = []
+
+        def toString(obj):
+            formatted.append(obj)
+            return repr(obj)
+
+        self.ic.configureOutput(argToStringFunction=toString, level=logging.INFO)
+        self.ic(a)
+        assert formatted == []
+        assert self.records[0].levelno == logging.INFO
+        assert self.records[0].getMessage() == 'ic| a: 1'
+        assert formatted == [1]
+
+    def test_level_and_channel(self):
+        self.ic.channel('db').warning(a)
+        [record] = self.records
+        assert record.levelno == logging.WARNING
+        assert record.channel == 'db'
+        assert record.getMessage() == 'ic| WARNING [db] a: 1'
+
+    def test_disabled_level_skips_frame_inspection(self):
+        self.logger.setLevel(logging.WARNING)
+        with unittest.mock.patch('inspect.currentframe') as currentframe:
+            assert self.ic(a) == 1
+        currentframe.assert_not_called()
+        assert self.records == [] and self.outputs == []
+
+    def test_unset_logger(self):
+        self.ic.configureOutput(logger=None)
+        self.ic(a)
+        assert self.records == [] and self.outputs == ['ic| a: 1']
+
+
+class TestSampling(unittest.TestCase):
+    def setUp(self):
+        self.outputs = []
+        self.ic = IceCreamDebugger(outputFunction=self.outputs.append)
+
+    def test_sample_every(self):
+        self.ic.configureOutput(sampleEvery=3)
+        for i in range(7):
+            self.ic(i)
+        assert self.outputs == [
+            'ic| i: 0', 'ic| (2 suppressed) i: 3', 'ic| (2 suppressed) i: 6']
+
+    def test_sampling_is_per_call_site(self):
+        self.ic.configureOutput(sampleEvery=2)
+        for i in range(2):
+            self.ic(i)
+            self.ic(i + 10)
+        assert self.outputs == ['ic| i: 0', 'ic| i + 10: 10']
+
+    def test_first_n(self):
+        self.ic.configureOutput(firstN=2)
+        for i in range(5):
+            self.ic(i)
+        assert self.outputs == ['ic| i: 0', 'ic| i: 1']
+
+        self.ic.configureOutput(firstN=None)  # Resets the call sites' state.
+        assert self.ic(5) == 5
+        assert self.outputs[-1] == 'ic| 5'
+
+    def test_sample_rate(self):
+        self.ic.configureOutput(sampleRate=0)
+        for i in range(10):
+            self.ic(i)
+        self.ic.configureOutput(sampleRate=1)
+        self.ic(a)
+        assert self.outputs == ['ic| a: 1']
+
+    def test_invalid_sampling(self):
+        invalid = [
+            {'sampleEvery': 0}, {'sampleEvery': 1.5}, {'firstN': -1},
+            {'sampleRate': -0.1}, {'sampleRate': 2}, {'maxPerSecond': 0},
+            {'maxPerSecond': -1}, {'sampleEvery': 2, 'firstN': -1}]
+        for options in invalid:
+            with self.assertRaises(ValueError):
+                self.ic.configureOutput(**options)
+        assert self.ic.sampleEvery is None  # Nothing's applied.
+        self.ic(a)
+        assert self.outputs == ['ic| a: 1']
+
+    def test_max_per_second(self):
+        self.ic.configureOutput(maxPerSecond=2)
+        times = [100.0] * 5 + [101.0]
+        with unittest.mock.patch('time.monotonic', side_effect=times):
+            for i in range(6):
+                self.ic(i)
+        assert self.outputs == [
+            'ic| i: 0', 'ic| i: 1', 'ic| (3 suppressed) i: 5']
+
+    def test_sampled_out_calls_are_not_inspected(self):
+        self.ic.configureOutput(sampleEvery=2)
+        with unittest.mock.patch.object(
+                icecream.icecream, 'RecordedCall',
+                wraps=icecream.icecream.RecordedCall) as recordedCall:
+            for i in range(4):
+                self.ic(i)
+        assert recordedCall.call_count == 2
+
+    def test_suppressed_in_structured_output(self):
+        self.ic.configureOutput(sampleEvery=2, outputFormat='json')
+        for i in range(3):
+            self.ic(i)
+        assert 'suppressed' not in json.loads(self.outputs[0])
+        assert json.loads(self.outputs[1])['suppressed'] == 1
+
+    def test_overhead_governor_throttles_and_recovers(self):
+        class FakeClock:
+            # Every reading advances 100ms, so every ic() call takes 100ms.
+            now = 0
+
+            def __call__(self):
+                self.now += 100 * 10**6
+                return self.now
+
+        clock = FakeClock()
+        with unittest.mock.patch('time.perf_counter_ns', clock):
+            self.ic.configureOutput(overheadBudget=0.01)
+            assert self.ic.throttleState()['sites'] == []
+
+            states = []
+            # ic() takes half of the first 1s window, over budget, and then
+            # next to nothing of the next ten, each 1000s long.
+            for i, idleNs in enumerate([0] * 5 + [1000 * 10**9] * 10):
+                clock.now += idleNs
+                self.ic(i)
+                states.append(self.ic.throttleState())
+
+        assert states[4]['overhead'] == 0.5
+        [site] = states[4]['sites']
+        assert site['function'] == 'test_overhead_governor_throttles_and_recovers'
+        assert site['interval'] == 50  # 0.5 is 50 times the budget.
+        # Intervals then halve, to 25, 12, 6, 3, and 1, every idle window.
+        assert [s['sites'][0]['interval'] for s in states[5:9]] == [25, 12, 6, 3]
+        assert states[-1]['overhead'] < 0.001
+        assert states[-1]['sites'] == []
+        assert self.outputs == (
+            ['ic| i: %i' % i for i in range(5)]
+            + ['ic| (4 suppressed) i: 9']
+            + ['ic| i: %i' % i for i in range(10, 15)])
+
+        self.ic.configureOutput(overheadBudget=None)
+        assert self.ic.throttleState() is None
+
+    def test_overhead_clock(self):
+        self.ic.configureOutput(overheadBudget=0.05, overheadClock='cpu')
+        assert self.ic.throttleState()['clock'] == 'cpu'
+        with self.assertRaises(ValueError):
+            self.ic.configureOutput(overheadClock='gpu')
+
+    def test_cpu_clock_measures_ic_in_cpu_time(self):
+        # An I/O bound process: 2s of wall clock time, 10ms of CPU time, 1ms
+        # of it in ic().
+        mock = unittest.mock.patch
+        with mock('time.perf_counter_ns', return_value=0):
+            with mock('time.process_time_ns', side_effect=[0, 10**7, 10**7]):
+                governor = icecream.icecream.OverheadGovernor(0.5, 'cpu')
+                site = icecream.icecream.SiteSampling(sys._getframe())
+                with mock('time.thread_time_ns', side_effect=[0, 10**6]):
+                    governor.account(site, governor.startCall(0), 2 * 10**9)
+        assert governor.overhead == 0.1
+        assert governor.throttled == []
+
+    def test_invalid_overhead_budget(self):
+        for budget in (0, -0.01):
+            with self.assertRaises(ValueError):
+                self.ic.configureOutput(overheadBudget=budget)
+        assert self.ic.throttleState() is None
+
+
+class TestFilters(unittest.TestCase):
+    def setUp(self):
+        self.outputs = []
+        self.ic = IceCreamDebugger(outputFunction=self.outputs.append)
+
+    def test_exclude_function(self):
+        def helper():
+            self.ic(a)
+
+        self.ic.exclude(function='*helper')
+        helper()
+        self.ic(b)
+        assert self.outputs == ['ic| b: 2']
+
+    def test_include_path(self):
+        self.ic.include(path='test_icecream.py')
+        self.ic(a)
+        self.ic.clearFilters()
+        self.ic.include(path='*/elsewhere/*.py')
+        self.ic(b)
+        assert self.outputs == ['ic| a: 1']
+
+    def test_lines(self):
+        line = inspect.currentframe().f_lineno
+        self.ic.include(lines=(line + 3, line + 4))
+        self.ic(a)
+        self.ic(b)
+        self.ic(a, b)
+        assert self.outputs == ['ic| b: 2', 'ic| a: 1, b: 2']
+
+    def test_exclude_beats_include(self):
+        self.ic.include(function='test_*')
+        self.ic.exclude(expr=r'^secret')
+        secretKey = 'hunter2'
+        self.ic(secretKey)
+        self.ic(a)
+        assert self.outputs == ['ic| a: 1']
+
+    def test_decision_is_cached_until_rules_change(self):
+        self.ic.exclude(expr='a')
+        with unittest.mock.patch.object(
+                icecream.icecream.CallSiteRule, 'matches',
+                autospec=True, return_value=True) as matches:
+            for _ in range(3):
+                self.ic(a)
+            assert matches.call_count == 1
+
+            self.ic.exclude(function='nothing')  # Invalidates the cache.
+            self.ic(a)
+            assert matches.call_count == 2
+        assert self.outputs == []
+
+    def test_rule_needs_a_criterion(self):
+        with self.assertRaises(TypeError):
+            self.ic.include()
+
+
+class TestLevelsAndChannels(unittest.TestCase):
+    def setUp(self):
+        self.outputs = []
+        self.ic = IceCreamDebugger(outputFunction=self.outputs.append)
+
+    def test_levels(self):
+        assert self.ic.info(a) == 1
+        self.ic.error(a, b)
+        assert self.outputs == ['ic| INFO a: 1', 'ic| ERROR a: 1, b: 2']
+
+    def test_threshold(self):
+        self.ic.configureOutput(threshold=logging.WARNING)
+        assert self.ic(a) == 1  # At level, DEBUG.
+        self.ic.info(a)
+        self.ic.warning(b)
+        assert self.outputs == ['ic| WARNING b: 2']
+
+    def test_channels(self):
+        db = self.ic.channel('db')
+        assert self.ic.channel('db') is db
+        db(a)
+        self.ic.channel('http').critical(b)
+        self.ic.configureOutput(channels=['http'])
+        db(a)
+        self.ic.channel('http')(b)
+        self.ic(c)  # Not in a channel.
+        self.ic.configureOutput(channels=None)
+        db(a)
+        assert self.outputs == [
+            'ic| [db] a: 1', 'ic| CRITICAL [http] b: 2', 'ic| [http] b: 2',
+            'ic| c: 3', 'ic| [db] a: 1']
+
+    def test_context_is_the_callers(self):
+        self.ic.configureOutput(includeContext=True)
+        self.ic.channel('db').info(a)
+        assert self.outputs[0].startswith(
+            'ic| INFO [db] %s:' % MY_FILENAME)
+        assert 'in test_context_is_the_callers()' in self.outputs[0]
+
+    def test_disabled_calls_are_not_inspected(self):
+        self.ic.configureOutput(threshold=logging.ERROR, channels=[])
+        with unittest.mock.patch('inspect.currentframe') as currentframe:
+            self.ic.info(a)
+            self.ic.channel('db').error(a)
+        assert currentframe.call_count == 0
+        assert self.outputs == []
+
+    def test_structured_output(self):
+        self.ic.configureOutput(outputFormat='json')
+        self.ic.channel('db').info(a)
+        self.ic(b)
+        record = json.loads(self.outputs[0])
+        assert (record['level'], record['channel']) == ('INFO', 'db')
+        assert self.ic.formatRecord(record).startswith('ic| INFO [db] ')
+        assert 'channel' not in json.loads(self.outputs[1])
+
+
+class TestScope(unittest.TestCase):
+    def setUp(self):
+        self.outputs = []
+        self.ic = IceCreamDebugger(outputFunction=self.outputs.append)
+
+    def test_plain_calls_skip_the_gate(self):
+        # Without scopes, a threshold, channels, or a logger, only
+        # ic.enabled decides, so the scope isn't even looked up.
+        scopeVar = self.ic._scope
+        self.ic._scope = unittest.mock.Mock(wraps=scopeVar)
+        self.ic.disable()
+        self.ic(a)
+        self.ic.enable()
+        self.ic(a)
+        assert not self.ic._scope.get.called
+        assert self.outputs == ['ic| a: 1']
+
+        for options in ({'threshold': logging.INFO}, {'channels': ['db']},
+                        {'logger': logging.Logger('icecream.tests')}):
+            self.ic.configureOutput(**options)
+            assert self.ic._gated
+            self.ic.configureOutput(
+                threshold=logging.NOTSET, channels=None, logger=None)
+            assert not self.ic._gated
+
+        self.ic._scope = scopeVar
+        with self.ic.scope():
+            assert self.ic._gated
+        assert not self.ic._gated
+
+    def test_scope_overrides_disable(self):
+        self.ic.disable()
+        self.ic(a)
+        with self.ic.scope(prefix='req| '):
+            self.ic(b)
+            with self.ic.scope(enabled=False):
+                self.ic(c)
+        self.ic(a)
+        assert self.outputs == ['req| b: 2']
+
+    def test_nested_scopes_inherit_prefix(self):
+        with self.ic.scope(prefix='req| '):
+            with self.ic.scope(id='inner'):
+                self.ic(a)
+                assert self.ic.format(b) == 'req| b: 2'
+        assert self.outputs == ['req| a: 1']
+
+    def test_scope_id_in_context(self):
+        self.ic.configureOutput(includeContext=True)
+        with self.ic.scope(id='req-42') as scope:
+            assert scope.id == 'req-42'
+            self.ic(a)
+        self.ic.configureOutput(outputFormat='json')
+        with self.ic.scope() as scope:
+            self.ic(b)
+        assert 'in test_scope_id_in_context() [scope=req-42]' in self.outputs[0]
+        assert json.loads(self.outputs[1])['scope'] == scope.id
+
+    def test_scope_follows_asyncio_tasks(self):
+        self.ic.disable()
+
+        async def handle(request):
+            await asyncio.sleep(0)
+            self.ic(request)
+
+        async def main():
+            async def debugged():
+                with self.ic.scope():
+                    await asyncio.gather(handle(1), handle(2))
+
+            await asyncio.gather(debugged(), handle(3), handle(4))
+
+        asyncio.run(main())
+        assert sorted(self.outputs) == ['ic| request: 1', 'ic| request: 2']
+
+    def test_disabled_calls_are_not_inspected(self):
+        self.ic.disable()
+        with unittest.mock.patch('inspect.currentframe') as currentframe:
+            self.ic(a)
+            with self.ic.scope(enabled=False):
+                self.ic(a)
+        assert currentframe.call_count == 0
+
+
+class TestThreadSafety(unittest.TestCase):
+    def test_concurrent_multiline_records_are_never_interleaved(self):
+        class YieldingStream(StringIO):
+            # Gives up the GIL on every write, so writes that make up one
+            # record would interleave with other threads' if there were
+            # more than one.
+            def write(self, s):
+                time.sleep(0)
+                return super().write(s)
+
+        ic = IceCreamDebugger(outputFunction=stderr_print)
+        ic.configureOutput(includeContext=True, contextThread=True)
+        threadCount, callCount = 64, 20
+        value = list(range(40))  # Wraps onto several lines.
+        barrier = threading.Barrier(threadCount)
+
+        def work():
+            barrier.wait()
+            for i in range(callCount):
+                ic(i, value)
+
+        lock = icecream.icecream.outputLock
+        acquisitions, contentions = lock.acquisitions, lock.contentions
+        stream = YieldingStream()
+        with unittest.mock.patch('sys.stderr', stream):
+            threads = [threading.Thread(target=work) for _ in range(threadCount)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        records = stream.getvalue().split('ic| ')[1:]
+        assert len(records) == threadCount * callCount
+        seen, layouts = set(), set()
+        for record in records:
+            threadId = re.search(r'thread_id=(\d+)', record).group(1)
+            i = re.search(r'i: (\d+)', record).group(1)
+            seen.add((threadId, i))
+            layouts.add(record.replace(threadId, 'ID').replace(
+                'i: %s\n' % i, 'i: N\n'))
+        assert len(seen) == threadCount * callCount
+        # Every record is whole: the same lines, once the thread and i
+        # are factored out.
+        assert len({re.sub(r'thread=.*? ', '', l) for l in layouts}) == 1
+
+        assert lock.acquisitions - acquisitions == threadCount * callCount
+        # Contention is measured, if not predictable.
+        assert 0 <= lock.contentions - contentions <= threadCount * callCount
+
+    def test_context_thread_and_pid(self):
+        outputs = []
+        ic = IceCreamDebugger(outputFunction=outputs.append)
+        ic.configureOutput(contextThread=True, contextPid=True)
+        ic()
+        thread = threading.current_thread()
+        assert '[pid=%i thread=%s thread_id=%i]' % (
+            os.getpid(), thread.name, thread.ident) in outputs[0]
+
+    def test_output_while_holding_the_output_lock(self):
+        # Like a signal handler that calls ic() while ic() is mid-write.
+        ic = IceCreamDebugger(outputFunction=stderr_print)
+        stream = StringIO()
+
+        def work():
+            with icecream.icecream.outputLock:
+                ic(a)
+
+        with unittest.mock.patch('sys.stderr', stream):
+            thread = threading.Thread(target=work, daemon=True)
+            thread.start()
+            thread.join(timeout=5)
+        assert not thread.is_alive()
+        assert stream.getvalue() == 'ic| a: 1\n'
+
+    def test_no_stream(self):
+        # E.g. under pythonw, sys.stderr and sys.stdout are None.
+        for outputFunction in (None, stderr_print, icecream.stdout_print):
+            ic = IceCreamDebugger() if outputFunction is None else (
+                IceCreamDebugger(outputFunction=outputFunction))
+            with unittest.mock.patch('sys.stderr', None):
+                with unittest.mock.patch('sys.stdout', None):
+                    assert ic(a) == 1
+
+
+class TestTimer(unittest.TestCase):
+    def setUp(self):
+        self.outputs = []
+        self.ic = IceCreamDebugger(outputFunction=self.outputs.append)
+
+    def test_context_manager(self):
+        with unittest.mock.patch('time.perf_counter_ns', side_effect=[0, 1500000]):
+            with self.ic.timer('load'):
+                pass
+        assert self.outputs == ['ic| load: 1.500ms']
+
+    def test_threshold(self):
+        self.ic.configureOutput(threshold=logging.WARNING)
+        with self.ic.timer('t'):
+            pass
+        self.ic.reportTimers()
+        assert self.outputs == []
+        assert self.ic.timings()['t']['count'] == 1  # Still aggregated.
+
+    def test_context_is_the_timed_block(self):
+        self.ic.configureOutput(includeContext=True)
+        with self.ic.timer():
+            line = sys._getframe().f_lineno
+        assert self.outputs[0].startswith(
+            'ic| %s:%i in test_context_is_the_timed_block()' % (
+                MY_FILENAME, line - 1))
+        assert 'elapsed: ' in self.outputs[0]
+
+    def test_decorator(self):
+        @self.ic.timer
+        def square(x):
+            return x * x
+
+        @self.ic.timer('cube')
+        def cube(x):
+            return x * x * x
+
+        self.ic.configureOutput(includeContext=True)
+        assert square(3) == 9
+        assert cube(2) == 8
+        assert 'in test_decorator()' in self.outputs[0]
+        assert 'TestTimer.test_decorator.<locals>.square: ' in self.outputs[0]
+        assert ' cube: ' in self.outputs[1]
+
+    def test_coroutine_decorator(self):
+        @self.ic.timer
+        async def nap():
+            await asyncio.sleep(0.01)
+            return 'rested'
+
+        assert asyncio.run(nap()) == 'rested'
+        assert len(self.outputs) == 1
+        assert self.ic.timings()['TestTimer.test_coroutine_decorator.<locals>.nap'][
+            'min'] >= 10**7
+
+    def test_aggregates(self):
+        durations = [5, 1, 3, 2, 4]
+        for ns in durations:
+            with unittest.mock.patch('time.perf_counter_ns', side_effect=[0, ns]):
+                with self.ic.timer('t'):
+                    pass
+        assert self.ic.timings() == {'t': {
+            'count': 5, 'total': 15, 'min': 1, 'p50': 3, 'p90': 5, 'p99': 5,
+            'max': 5}}
+        self.ic.timings(reset=True)
+        assert self.ic.timings() == {}
+
+    def test_summaries(self):
+        times = iter(range(0, 10**9, 10**6))
+        monotonic = iter([0.0, 0.5, 1.0, 1.2, 1.4, 2.0])
+        with unittest.mock.patch('time.perf_counter_ns', lambda: next(times)), \
+                unittest.mock.patch('time.monotonic', lambda: next(monotonic)), \
+                unittest.mock.patch('atexit.register') as register:
+            for _ in range(3):
+                with self.ic.timer('hot', summaryInterval=1):
+                    pass
+            assert self.outputs == [
+                'ic| hot: count=2 total=2.000ms min=1.000ms p50=1.000ms '
+                'p90=1.000ms p99=1.000ms max=1.000ms']
+            self.ic.reportTimers()  # At exit.
+        register.assert_called_once_with(self.ic.reportTimers)
+        assert self.outputs[1].startswith('ic| hot: count=3 ')
+        self.ic.reportTimers()  # Nothing new since.
+        assert len(self.outputs) == 2
+
+    def test_structured_output(self):
+        self.ic.configureOutput(outputFormat='json')
+        with unittest.mock.patch('time.perf_counter_ns', side_effect=[0, 2000]):
+            with self.ic.timer('io'):
+                pass
+        [arg] = json.loads(self.outputs[0])['args']
+        assert (arg['expr'], arg['value_repr']) == ('io', '2.000us')
+
+    def test_disabled(self):
+        self.ic.disable()
+        with self.ic.timer('t'):
+            pass
+        assert self.outputs == []
+        assert self.ic.timings()['t']['count'] == 1
+
+    def test_histogram_percentiles(self):
+        histogram = icecream.icecream.StreamingHistogram()
+        for value in range(1, 100001):
+            histogram.record(value)
+        for q in (50, 90, 99):
+            expected = 1000 * q
+            assert abs(histogram.percentile(q) - expected) <= expected / 64
+        assert (histogram.min, histogram.max) == (1, 100000)
+        assert len(histogram.buckets) < 1200
+
+    def test_histogram_max_buckets(self):
+        histogram = icecream.icecream.StreamingHistogram(maxBuckets=16)
+        for value in range(1000, 100001):
+            histogram.record(value)
+        assert len(histogram.buckets) <= 16
+        assert sum(histogram.buckets.values()) == histogram.count == 99001
+        for q in (50, 90, 99):  # Coarser, but still in the right bucket.
+            expected = 1000 * q
+            assert abs(histogram.percentile(q) - expected) <= expected / 2
+
+
+class TestCheckpoints(unittest.TestCase):
+    def setUp(self):
+        self.outputs = []
+        self.ic = IceCreamDebugger(outputFunction=self.outputs.append)
+        self.ic.configureOutput(checkpointMode=True)
+
+    def checkpoint(self, times):
+        with unittest.mock.patch('time.perf_counter_ns', side_effect=times):
+            for _ in times:
+                self.ic()
+
+    def test_elapsed(self):
+        self.checkpoint([0, 1500000, 4000000])
+        assert not self.outputs[0].endswith(')')
+        assert self.outputs[1].endswith(' (+1.500ms, 1.500ms since first)')
+        assert self.outputs[2].endswith(' (+2.500ms, 4.000ms since first)')
+
+    def test_calls_with_arguments_are_not_checkpoints(self):
+        self.checkpoint([0])
+        with unittest.mock.patch('time.perf_counter_ns', side_effect=[7]):
+            self.ic(1)
+            self.ic()
+        assert self.outputs[1] == 'ic| 1'
+        assert self.outputs[2].endswith(' (+7ns, 7ns since first)')
+
+    def test_off_by_default(self):
+        self.ic.configureOutput(checkpointMode=False)
+        self.ic()
+        self.ic()
+        assert self.ic.checkpoints() == {}
+        assert not self.outputs[1].endswith(')')
+
+    def test_aggregates(self):
+        for times in ([0, 10, 30], [100, 120, 150]):
+            with unittest.mock.patch('time.perf_counter_ns', side_effect=times):
+                self.ic()
+                line = sys._getframe().f_lineno
+                for _ in range(2):
+                    self.ic()
+        checkpoints = self.ic.checkpoints(reset=True)
+        first, loop = '%s:%i' % (MY_FILENAME, line - 1), '%s:%i' % (
+            MY_FILENAME, line + 2)
+        assert list(checkpoints) == [
+            '%s -> %s' % (first, loop), '%s -> %s' % (loop, loop),
+            '%s -> %s' % (loop, first)]
+        assert checkpoints['%s -> %s' % (first, loop)]['count'] == 2
+        assert checkpoints['%s -> %s' % (loop, loop)] == {
+            'count': 2, 'total': 50, 'min': 20, 'p50': 20, 'p90': 30,
+            'p99': 30, 'max': 30, 'mean': 25}
+        assert checkpoints['%s -> %s' % (loop, first)]['min'] == 70
+        assert self.ic.checkpoints() == {}
+
+    def test_pairs_are_capped(self):
+        times = [0, 10, 20, 30]
+        with unittest.mock.patch.object(
+                icecream.icecream, 'MAX_CHECKPOINT_PAIRS', 2):
+            with unittest.mock.patch('time.perf_counter_ns', side_effect=times):
+                self.ic()
+                self.ic()
+                self.ic()
+                self.ic()  # A third pair; not aggregated.
+        assert len(self.ic.checkpoints()) == 2
+        assert self.outputs[3].endswith(' (+10ns, 30ns since first)')
+
+    def test_reset_starts_over(self):
+        self.checkpoint([0, 10])
+        self.ic.checkpoints(reset=True)
+        self.checkpoint([20])
+        assert not self.outputs[2].endswith(')')
+
+    def test_per_thread(self):
+        self.checkpoint([0])
+
+        def work():
+            with unittest.mock.patch('time.perf_counter_ns', side_effect=[50]):
+                self.ic()
+
+        thread = threading.Thread(target=work)
+        thread.start()
+        thread.join()
+        assert not self.outputs[1].endswith(')')
+
+    def test_structured_output(self):
+        self.ic.configureOutput(outputFormat='json')
+        self.checkpoint([0, 2000])
+        record = json.loads(self.outputs[1])
+        assert (record['since_previous_ns'], record['since_first_ns']) == (
+            2000, 2000)
+        assert self.ic.formatRecord(record).endswith(
+            ' (+2.000us, 2.000us since first)')
+
+
+class TestTimestamps(unittest.TestCase):
+    timestamp = 1760870467.418
+
+    def test_formats(self):
+        TimestampFormatter = icecream.icecream.TimestampFormatter
+        local = datetime.fromtimestamp(self.timestamp)
+        assert TimestampFormatter('clock')(self.timestamp) == (
+            local.strftime('%H:%M:%S') + '.418')
+        assert TimestampFormatter('iso')(self.timestamp) == (
+            local.astimezone().isoformat(timespec='milliseconds'))
+        assert TimestampFormatter('epoch')(self.timestamp) == '1760870467.418'
+        assert TimestampFormatter('relative', start=self.timestamp - 3.5)(
+            self.timestamp) == '+3.500'
+
+        now = time.time()
+        monotonic = float(TimestampFormatter('monotonic')(now))
+        assert abs(monotonic - time.monotonic()) < 1
+
+    def test_rounding_carries_into_the_second(self):
+        formatter = icecream.icecream.TimestampFormatter('epoch')
+        assert formatter(1760870467.9996) == '1760870468.000'
+        formatter = icecream.icecream.TimestampFormatter('clock')
+        assert formatter(1760870467.9996) == (
+            datetime.fromtimestamp(1760870468).strftime('%H:%M:%S') + '.000')
+
+    def test_seconds_are_formatted_once(self):
+        formatter = icecream.icecream.TimestampFormatter('clock')
+        with unittest.mock.patch(
+                'icecream.icecream.datetime', wraps=datetime) as mock:
+            for ms in range(0, 1000, 100):
+                formatter(self.timestamp // 1 + ms / 1000)
+            assert mock.fromtimestamp.call_count == 1
+            formatter(self.timestamp + 1)
+            assert mock.fromtimestamp.call_count == 2
+
+    def test_bare_calls(self):
+        outputs = []
+        ic = IceCreamDebugger(outputFunction=outputs.append)
+        ic.configureOutput(timestampFormat='epoch')
+        with unittest.mock.patch('time.time', return_value=self.timestamp):
+            ic()
+            assert ic.timestamp() == '1760870467.418'
+        assert outputs[0].endswith(' at 1760870467.418')
+
+        record = {
+            'timestamp': self.timestamp, 'file': 'a.py', 'line': 1,
+            'function': 'f', 'args': []}
+        assert ic.formatRecord(record) == 'ic| a.py:1 in f() at 1760870467.418'
+
+    def test_invalid_format(self):
+        with self.assertRaises(ValueError):
+            IceCreamDebugger().configureOutput(timestampFormat='julian')
+
+
+class TestSiteStats(unittest.TestCase):
+    def setUp(self):
+        self.outputs = []
+        self.ic = IceCreamDebugger(outputFunction=self.outputs.append)
+        self.ic.configureOutput(siteStats=True)
+
+    def test_counters(self):
+        self.ic.configureOutput(sampleEvery=2)
+        for i in range(4):
+            self.ic(i)
+            line = sys._getframe().f_lineno - 1
+        self.ic.exclude(expr='skipped')
+        skipped = 1
+        self.ic(skipped)
+        [loop, excluded] = sorted(self.ic.sites(), key=lambda site: site['line'])
+        assert (loop['file'], loop['line'], loop['function']) == (
+            MY_FILENAME, line, 'test_counters')
+        assert (loop['hits'], loop['suppressed']) == (4, 2)
+        assert loop['bytes'] == len('ic| i: 0' + 'ic| (1 suppressed) i: 2')
+        assert loop['ns'] > 0
+        assert (excluded['hits'], excluded['suppressed'], excluded['bytes']) == (
+            1, 1, 0)
+
+    def test_costliest_first(self):
+        with unittest.mock.patch(
+                'time.perf_counter_ns', side_effect=[0, 5, 0, 100, 0, 20]):
+            self.ic(5)
+            self.ic(100)
+            self.ic(20)
+        assert [site['ns'] for site in self.ic.sites()] == [100, 20, 5]
+        assert len(self.ic.sites(reset=True)) == 3
+        assert self.ic.sites() == []
+
+    def test_off_by_default(self):
+        ic = IceCreamDebugger(outputFunction=self.outputs.append)
+        ic(1)
+        assert ic.sites() == []
+        self.ic.configureOutput(siteStats=False)
+        self.ic(1)
+        assert self.ic.sites() == []
+
+    def test_report(self):
+        with unittest.mock.patch('time.perf_counter_ns', side_effect=[0, 1500]):
+            self.ic(1)
+        line = sys._getframe().f_lineno - 1
+        del self.outputs[:]
+        self.ic.reportSites()
+        assert self.outputs == [
+            'ic() call sites, costliest first:\n'
+            '      time       hits suppressed      bytes  site\n'
+            '   1.500us          1          0          5  '
+            '%s:%i in test_report()' % (MY_FILENAME, line)]
+
+    @unittest.skipUnless(hasattr(signal, 'SIGUSR1'), 'Needs SIGUSR1.')
+    def test_report_on_exit_and_signal(self):
+        previous = signal.getsignal(signal.SIGUSR1)
+        try:
+            with unittest.mock.patch('atexit.register') as register:
+                ic = IceCreamDebugger(outputFunction=self.outputs.append)
+                ic.reportSitesOn(signalNumber=signal.SIGUSR1)
+                ic.reportSitesOn()
+            register.assert_called_once_with(ic.reportSites)
+            ic(1)
+            signal.raise_signal(signal.SIGUSR1)
+        finally:
+            signal.signal(signal.SIGUSR1, previous)
+        assert self.outputs[-1].startswith('ic() call sites, costliest first:')
+        assert ' in test_report_on_exit_and_signal()' in self.outputs[-1]
+
+    @unittest.skipUnless(hasattr(signal, 'SIGUSR1'), 'Needs SIGUSR1.')
+    def test_signal_during_output_does_not_deadlock(self):
+        # The handler interrupts ic() while it holds the outputLock.
+        script = '''
+import os, signal, threading, time
+from icecream import IceCreamDebugger
+ic = IceCreamDebugger()
+ic.reportSitesOn(atExit=False, signalNumber=signal.SIGUSR1)
+def kill():
+    for _ in range(50):
+        os.kill(os.getpid(), signal.SIGUSR1)
+        time.sleep(0.002)
+thread = threading.Thread(target=kill)
+thread.start()
+while thread.is_alive():
+    ic(1)
+'''
+        result = subprocess.run(
+            [sys.executable, '-c', script], capture_output=True, timeout=60)
+        assert result.returncode == 0
+        assert b'ic() call sites, costliest first:' in result.stderr
+
+
+class TestStageStats(unittest.TestCase):
+    def setUp(self):
+        self.outputs = []
+        self.ic = IceCreamDebugger(outputFunction=self.outputs.append)
+        self.ic.configureOutput(stageStats=True)
+
+    def test_stages(self):
+        a = 1
+        for _ in range(3):
+            self.ic(a)
+        stats = self.ic.stats()
+        assert list(stats) == list(icecream.icecream.STAGES)
+        for stage in ('frame', 'executing', 'source', 'argToString',
+                      'construct', 'output'):
+            assert stats[stage]['count'] == 3, stage
+            assert stats[stage]['mean'] == stats[stage]['total'] // 3
+        assert stats['colorize']['count'] == 0
+        assert self.outputs == ['ic| a: 1'] * 3
+
+    def test_colorize_is_timed_apart_from_the_write(self):
+        self.ic.configureOutput(outputFunction=icecream.icecream.colorizedStderrPrint)
+        with capture_standard_streams() as (out, err):
+            self.ic(1)
+        assert has_ansi_escape_codes(err.getvalue())
+        stats = self.ic.stats()
+        assert stats['colorize']['count'] == stats['output']['count'] == 1
+
+    def test_structured_output(self):
+        self.ic.configureOutput(outputFormat='json')
+        self.ic(1)
+        stats = self.ic.stats()
+        assert stats['argToString']['count'] == 1
+        assert stats['construct']['count'] == 0
+
+    def test_reset_and_off(self):
+        with unittest.mock.patch('time.perf_counter_ns', side_effect=range(100)):
+            self.ic(1)
+            assert self.ic.stats(reset=True)['frame'] == {
+                'count': 1, 'total': 1, 'mean': 1}
+        assert self.ic.stats()['frame']['count'] == 0
+        self.ic.configureOutput(stageStats=False)
+        self.ic(1)
+        assert self.ic.stats() == {}
+
+
+class TestFormattingFastPaths(unittest.TestCase):
+    def setUp(self):
+        self.outputs = []
+        self.ic = IceCreamDebugger(outputFunction=self.outputs.append)
+
+    def test_argument_source_is_read_once_per_call_site(self):
+        source = icecream.icecream.Source
+        with unittest.mock.patch.object(
+                source, 'get_text_with_indentation', autospec=True,
+                side_effect=source.get_text_with_indentation) as getText:
+            for i in range(3):
+                self.ic(a, i)
+        assert getText.call_count == 2
+        assert self.outputs == ['ic| a: 1, i: %i' % i for i in range(3)]
+
+    def test_line_boundaries_match_splitlines(self):
+        for value in ('x\r\n', 'x\n', 'x\r', 'x '):  # One line.
+            self.ic.configureOutput(argToStringFunction=lambda obj: value)
+            self.ic(a)
+            assert self.outputs.pop() == 'ic| a: ' + value
+        for value in ('x\r\ny', 'x\ny', 'x\ry', 'x y', 'x\r\n\n'):
+            self.ic.configureOutput(argToStringFunction=lambda obj: value)
+            self.ic(a)
+            assert self.outputs.pop() != 'ic| a: ' + value
+            assert len(value.splitlines()) > 1
+
+    def test_calls_leave_no_garbage(self):
+        def calls():
+            self.ic(a)
+            self.ic()
+            self.ic.format(a)
+            with self.ic.timer('t'):
+                pass
+
+        calls()
+        gc.collect()
+        gc.disable()
+        try:
+            for _ in range(10):
+                calls()
+            assert gc.collect() == 0  # No frame cycles.
+        finally:
+            gc.enable()
+
+    def test_first_line_too_long(self):
+        self.ic.configureOutput(prefix='p\n' + 'x' * 80 + ' ')
+        self.ic(a)  # The first line, 'p', is short.
+        assert self.outputs.pop() == 'p\n' + 'x' * 80 + ' a: 1'
+        self.ic.configureOutput(prefix='x' * 70 + '\n')
+        self.ic(a, b)  # The first line is exactly lineWrapWidth characters.
+        assert self.outputs.pop() == 'x' * 70 + '\na: 1, b: 2'
+        self.ic.configureOutput(prefix='x' * 71 + '\n')
+        self.ic(a, b)
+        assert ', b: 2' not in self.outputs.pop()
+
+
+class TestPrefixTemplate(unittest.TestCase):
+    timestamp = 1760870467.418
+
+    def setUp(self):
+        self.outputs = []
+        self.ic = IceCreamDebugger(outputFunction=self.outputs.append)
+
+    def tearDown(self):
+        self.ic.stopRecording()
+
+    def test_fields(self):
+        self.ic.configureOutput(
+            prefix='{time:%H:%M:%S} {pid} {thread} {thread_id}| ')
+        with unittest.mock.patch('time.time', return_value=self.timestamp):
+            self.ic(a)
+        assert self.outputs.pop() == '%s %i %s %i| a: 1' % (
+            datetime.fromtimestamp(self.timestamp).strftime('%H:%M:%S'),
+            os.getpid(), threading.current_thread().name,
+            threading.get_ident())
+
+        self.ic.configureOutput(prefix='{time} {elapsed}| ')
+        start = self.ic._timestamps.start
+        with unittest.mock.patch('time.time', return_value=start + 3.5):
+            self.ic(a)
+        assert self.outputs.pop() == '%s +3.500| a: 1' % (
+            self.ic.timestamp(start + 3.5))
+
+    def test_time_follows_timestamp_format(self):
+        self.ic.configureOutput(prefix='{time}| ')
+        self.ic.configureOutput(timestampFormat='epoch')
+        with unittest.mock.patch('time.time', return_value=self.timestamp):
+            self.ic(a)
+        assert self.outputs.pop() == '1760870467.418| a: 1'
+
+    def test_format_specs(self):
+        self.ic.configureOutput(prefix='[{thread:>12}] {time:%S.%f}| ')
+        with unittest.mock.patch('time.time', return_value=self.timestamp):
+            self.ic(a)
+        assert self.outputs.pop() == '[  MainThread] %s| a: 1' % (
+            datetime.fromtimestamp(self.timestamp).strftime('%S.%f'))
+
+    def test_specs_format_values(self):
+        self.ic.configureOutput(
+            prefix='{pid:08d} {thread_id:x} {elapsed:.1f}| ')
+        start = self.ic._timestamps.start
+        with unittest.mock.patch('time.time', return_value=start + 3.25):
+            self.ic(a)
+        assert self.outputs.pop() == '%08d %x 3.2| a: 1' % (
+            os.getpid(), threading.get_ident())
+
+    def test_seconds_are_formatted_once(self):
+        template = icecream.icecream.PrefixTemplate(
+            '{time:%H:%M:%S}', self.ic._timestamps)
+        with unittest.mock.patch(
+                'icecream.icecream.datetime', wraps=datetime) as mock:
+            for ms in range(0, 1000, 100):
+                template(self.timestamp // 1 + ms / 1000)
+            assert mock.fromtimestamp.call_count == 1
+            template(self.timestamp + 1)
+            assert mock.fromtimestamp.call_count == 2
+
+    def test_pid_is_refreshed_after_fork(self):
+        template = icecream.icecream.PrefixTemplate(
+            '{pid}', self.ic._timestamps)
+        assert template() == str(os.getpid())
+        with unittest.mock.patch('os.getpid', return_value=1):
+            assert template() != '1'
+            template.afterForkInChild()
+            assert template() == '1'
+
+    def test_thread_names_are_per_thread(self):
+        self.ic.configureOutput(prefix='{thread}| ')
+        thread = threading.Thread(target=lambda: self.ic(a), name='worker')
+        thread.start()
+        thread.join()
+        self.ic(a)
+        assert self.outputs == ['worker| a: 1', 'MainThread| a: 1']
+
+    def test_recorded_calls_keep_their_time_and_thread(self):
+        self.ic.configureOutput(prefix='{time:%H:%M:%S} {thread}| ')
+        self.ic.startRecording()
+        thread = threading.Thread(target=lambda: self.ic(a), name='worker')
+        with unittest.mock.patch('time.time', return_value=self.timestamp):
+            thread.start()
+            thread.join()
+        self.ic.dumpRecording()
+        assert self.outputs == ['%s worker| a: 1' % (
+            datetime.fromtimestamp(self.timestamp).strftime('%H:%M:%S'))]
+
+    def test_records(self):
+        self.ic.configureOutput(prefix='{pid} {thread}| ')
+        record = {
+            'timestamp': self.timestamp, 'file': 'a.py', 'line': 1,
+            'function': 'f', 'args': [{'expr': 'a', 'value_repr': '1'}],
+            'pid': 42, 'thread': 'worker'}
+        assert self.ic.formatRecord(record).startswith('42 worker| ')
+
+    def test_other_prefixes_are_left_alone(self):
+        for prefix in ('{}| ', '{x}| ', '{time| ', 'a{{pid}}| '):
+            self.ic.configureOutput(prefix=prefix)
+            self.ic(a)
+            assert self.outputs.pop() == prefix + 'a: 1'
+
+    def test_invalid_templates(self):
+        PrefixTemplate = icecream.icecream.PrefixTemplate
+        for template in ('{pid!r}', '{pid} {x}', '{pid:s}', '{thread:d}'):
+            with self.assertRaises(ValueError):
+                PrefixTemplate(template, self.ic._timestamps)
+        with self.assertRaises(ValueError):  # Not on the first ic() call.
+            self.ic.configureOutput(prefix='{thread_id:%H}| ')
+
+    def test_scope(self):
+        with self.ic.scope(prefix='{thread}| '):
+            self.ic(a)
+        assert self.outputs.pop() == 'MainThread| a: 1'
@@ -0,0 +1,569 @@
+# -*- coding: utf-8 -*-
+
+#
+# IceCream - Never use print() to debug again
+#
+# Ansgar Grunseid
+# grunseid.com
+# grunseid@gmail.com
+#
+# License: MIT
+#
+
+import asyncio
+import gzip
+import json
+import lzma
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import unittest.mock
+import warnings
+from io import StringIO
+from os.path import join as pjoin
+
+import icecream
+from icecream import (
+    IceCreamDebugger, RecordSink, AsyncioSink, RotatingFileSink,
+    FlightRecorderSink, BinaryTraceSink, SocketSink, Collector,
+    readFlightRecording, readBinaryTrace)
+from icecream.__main__ import main as icecreamMain
+from icecream.sinks import FRAME_HEADER
+from tests.test_icecream import capture_standard_streams
+
+a = 1
+b = 2
+
+
+class TestAsyncioSink(unittest.TestCase):
+    def test_writes_in_order_after_flush(self):
+        stream = StringIO()
+        sink = AsyncioSink(stream=stream, batchSize=2)
+        ic = IceCreamDebugger(outputFunction=sink)
+
+        async def main():
+            for i in range(5):
+                ic(i)
+            assert stream.getvalue() == ''  # Nothing written synchronously.
+            await ic.flush()
+
+        asyncio.run(main())
+        self.assertEqual(
+            stream.getvalue().splitlines(), ['ic| i: %i' % i for i in range(5)])
+
+    def test_stream_writer(self):
+        received = []
+
+        class FakeWriter:
+            def write(self, data):
+                received.append(data)
+
+            async def drain(self):
+                pass
+
+            def close(self):
+                pass
+
+        ic = IceCreamDebugger(outputFunction=AsyncioSink(writer=FakeWriter()))
+
+        async def main():
+            ic(a, b)
+            await ic.flush()
+
+        asyncio.run(main())
+        self.assertEqual(b''.join(received), b'ic| a: 1, b: 2\n')
+
+    def test_writes_synchronously_without_event_loop(self):
+        stream = StringIO()
+        ic = IceCreamDebugger(outputFunction=AsyncioSink(stream=stream))
+        ic(a)
+        self.assertEqual(stream.getvalue(), 'ic| a: 1\n')
+
+    def test_task_name_in_context(self):
+        stream = StringIO()
+        ic = IceCreamDebugger(
+            outputFunction=AsyncioSink(stream=stream), includeContext=True)
+
+        async def work():
+            ic(a)
+            await ic.flush()
+
+        async def main():
+            await asyncio.create_task(work(), name='worker-7')
+
+        asyncio.run(main())
+        self.assertIn('[task=worker-7]- a: 1', stream.getvalue())
+
+
+class TestRotatingFileSink(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = pjoin(self.tmpdir.name, 'ic.log')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_buffers_until_flush(self):
+        sink = RotatingFileSink(self.path)
+        ic = IceCreamDebugger(outputFunction=sink)
+        ic(a)
+        self.assertEqual(os.path.getsize(self.path), 0)
+        ic.flush()
+        with open(self.path) as f:
+            self.assertEqual(f.read(), 'ic| a: 1\n')
+        sink.close()
+
+    def test_size_rotation_compression_and_retention(self):
+        sink = RotatingFileSink(self.path, maxBytes=30, backupCount=2)
+        ic = IceCreamDebugger(outputFunction=sink)
+        for i in range(10):
+            ic(i)
+        sink.close()
+
+        segments = sink.rotatedSegments()
+        self.assertEqual(len(segments), 2)
+        self.assertTrue(all(path.endswith('.gz') for path in segments))
+
+        lines = []
+        for path in segments:
+            with gzip.open(path, 'rt') as f:
+                lines += f.read().splitlines()
+        with open(self.path) as f:
+            lines += f.read().splitlines()
+        self.assertEqual(lines, ['ic| i: %i' % i for i in range(3, 10)])
+
+    def test_time_rotation_lzma(self):
+        sink = RotatingFileSink(
+            self.path, maxBytes=None, interval=0, compression='lzma')
+        sink('first')
+        sink('second')
+        sink.close()
+
+        [segment] = sink.rotatedSegments()
+        with lzma.open(segment, 'rt') as f:
+            self.assertEqual(f.read(), 'first\n')
+
+    def test_unknown_compression(self):
+        with self.assertRaises(ValueError):
+            RotatingFileSink(self.path, compression='zip')
+
+    def test_pending_segments_are_not_pruned(self):
+        sink = RotatingFileSink(self.path, maxBytes=10, backupCount=0)
+        compress, compressing = sink._compress, threading.Event()
+
+        def slowCompress(path):
+            compressing.wait(10)
+            compress(path)
+
+        errors = []
+        with unittest.mock.patch.object(sink, '_compress', slowCompress), \
+                unittest.mock.patch('threading.excepthook', errors.append):
+            for i in range(3):
+                sink('line %i' % i)  # Each rotates the line before it.
+            compressing.set()
+            sink.close()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(sink.rotatedSegments(), [])
+        with open(self.path) as f:
+            self.assertEqual(f.read(), 'line 2\n')
+
+
+class TestFlightRecorderSink(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = pjoin(self.tmpdir.name, 'ic.ring')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_records_survive_without_close(self):
+        sink = FlightRecorderSink(self.path, size=4096)
+        ic = IceCreamDebugger(outputFunction=sink)
+        ic(a)
+        ic(b)
+        # Read while the sink is still open and unflushed, like after a
+        # crash.
+        self.assertEqual(
+            readFlightRecording(self.path), [(0, 'ic| a: 1'), (1, 'ic| b: 2')])
+        sink.close()
+
+    def test_wraparound_keeps_newest_records(self):
+        sink = FlightRecorderSink(self.path, size=200)
+        for i in range(100):
+            sink('record %i' % i)
+        sink.close()
+
+        records = readFlightRecording(self.path)
+        self.assertEqual(records[-1], (99, 'record 99'))
+        self.assertGreater(len(records), 3)
+        self.assertEqual(
+            records, [(i, 'record %i' % i) for i in range(100 - len(records), 100)])
+
+    def test_reopen_appends(self):
+        sink = FlightRecorderSink(self.path, size=4096)
+        sink('before')
+        sink.close()
+        sink = FlightRecorderSink(self.path, size=4096)
+        sink('after')
+        sink.close()
+        self.assertEqual(
+            readFlightRecording(self.path), [(0, 'before'), (1, 'after')])
+
+    def test_dump_command(self):
+        sink = FlightRecorderSink(self.path, size=4096)
+        sink('ic| a: 1')
+        with capture_standard_streams() as (out, err):
+            rc = icecreamMain(['dump', '--seq', self.path])
+        sink.close()
+        self.assertEqual(rc, 0)
+        self.assertEqual(out.getvalue(), '#0 ic| a: 1\n')
+
+
+class TestBinaryTraceSink(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = pjoin(self.tmpdir.name, 'ic.trace')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_round_trip(self):
+        sink = BinaryTraceSink(self.path)
+        ic = IceCreamDebugger(outputFunction=sink)
+        for i in range(3):
+            ic(i, 'sup')
+        ic()
+        sink.close()
+
+        records = list(readBinaryTrace(self.path))
+        self.assertEqual(len(records), 4)
+        self.assertEqual(
+            [r['args'][0]['value_repr'] for r in records[:3]], ['0', '1', '2'])
+        self.assertEqual(records[0]['args'][1], {
+            'expr': "'sup'", 'value_repr': "'sup'", 'type': 'str'})
+        self.assertEqual(records[3]['args'], [])
+        self.assertEqual(records[0]['pid'], os.getpid())
+        self.assertEqual(records[0]['function'], 'test_round_trip')
+        self.assertLessEqual(records[0]['timestamp'], records[3]['timestamp'])
+
+    def test_records_keep_their_calls_time(self):
+        sink = BinaryTraceSink(self.path)
+        ic = IceCreamDebugger(outputFunction=sink)
+        ic.startRecording(dumpOnException=False)
+        timestamp = time.time() + 0.25
+        with unittest.mock.patch('time.time', return_value=timestamp):
+            ic(a)
+        ic.stopRecording(dump=True)
+        sink.close()
+        [record] = readBinaryTrace(self.path)
+        self.assertEqual(record['timestamp'], timestamp)
+
+    def test_timestamps_round_trip_exactly(self):
+        sink = BinaryTraceSink(self.path)
+        start = time.time()
+        timestamps = [start + i * 1.234567e-7 for i in range(1000)]
+        for timestamp in timestamps:
+            sink.writeRecord({
+                'timestamp': timestamp, 'file': 'f.py', 'line': 1,
+                'function': 'f', 'thread': 'MainThread', 'thread_id': 1,
+                'args': []})
+        sink.close()
+        self.assertEqual(
+            [record['timestamp'] for record in readBinaryTrace(self.path)],
+            timestamps)
+
+    def test_call_sites_are_interned(self):
+        sink = BinaryTraceSink(self.path)
+        ic = IceCreamDebugger(outputFunction=sink)
+        ic(a)
+        sink.flush()
+        firstCallSize = os.path.getsize(self.path)
+        ic(a)
+        sink.close()
+        secondCallSize = os.path.getsize(self.path) - firstCallSize
+        self.assertLess(secondCallSize, firstCallSize / 2)
+
+    def test_decode_command(self):
+        sink = BinaryTraceSink(self.path)
+        ic = IceCreamDebugger(outputFunction=sink)
+        ic(a)
+        sink.close()
+
+        with capture_standard_streams() as (out, err):
+            icecreamMain(['decode', self.path])
+        self.assertRegex(
+            out.getvalue(), r'^ic\| test_sinks.py:\d+ in test_decode_command\(\)- a: 1\n$')
+
+        with capture_standard_streams() as (out, err):
+            icecreamMain(['decode', '--format', 'json', self.path])
+        self.assertEqual(json.loads(out.getvalue())['args'][0]['expr'], 'a')
+
+
+class TestLazyImport(unittest.TestCase):
+    def test_sinks_are_imported_on_first_use(self):
+        script = (
+            'import sys, icecream\n'
+            'assert "icecream.sinks" not in sys.modules\n'
+            'assert "asyncio" not in sys.modules\n'
+            'assert icecream.SocketSink is icecream.sinks.SocketSink\n')
+        subprocess.run([sys.executable, '-c', script], check=True)
+
+    def test_unknown_attribute(self):
+        with self.assertRaises(AttributeError):
+            icecream.NoSuchSink
+
+
+class TestRecordSink(unittest.TestCase):
+    def test_record_sinks_take_records(self):
+        class ListSink(RecordSink):
+            def __init__(self):
+                self.records = []
+
+            def writeRecord(self, record):
+                self.records.append(record)
+
+        sink = ListSink()
+        ic = IceCreamDebugger(outputFunction=sink)
+        ic(a)
+        self.assertEqual(sink.records[0]['args'][0]['expr'], 'a')
+        with self.assertRaises(TypeError):
+            sink('ic| a: 1')
+
+    def test_other_output_functions_take_text(self):
+        mock = unittest.mock.Mock()
+        ic = IceCreamDebugger(outputFunction=mock)
+        ic(a)
+        mock.assert_called_once_with('ic| a: 1')
+        mock.writeRecord.assert_not_called()
+
+
+class TestSocketSink(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = pjoin(self.tmpdir.name, 'ic.sock')
+        self.collected = []
+        self.collector = None
+
+    def tearDown(self):
+        self.stopCollector()
+        self.tmpdir.cleanup()
+
+    def startCollector(self):
+        self.collector = Collector(self.path, self.collected.append, window=0.2)
+        self.thread = threading.Thread(target=self.collector.serveForever)
+        self.thread.start()
+
+    def stopCollector(self):
+        if self.collector is not None:
+            self.collector.stop()
+            self.thread.join()
+            self.collector = None
+
+    def test_records_are_merged_in_timestamp_order(self):
+        self.startCollector()
+        sink1 = SocketSink(self.path)
+        sink2 = SocketSink(self.path)
+        for timestamp, sink in [(3.0, sink1), (1.0, sink2), (2.0, sink1)]:
+            sink.writeRecord({'timestamp': timestamp, 'pid': 1, 'args': []})
+        sink1.close()
+        sink2.close()
+        self.stopCollector()
+
+        self.assertEqual(
+            [record['timestamp'] for record in self.collected], [1.0, 2.0, 3.0])
+
+    def test_reconnects_once_collector_is_up(self):
+        sink = SocketSink(self.path)
+        ic = IceCreamDebugger(outputFunction=sink)
+        ic(a)  # No collector yet; queued.
+        self.startCollector()
+        ic(b)
+        sink.flush(timeout=10)
+        sink.close()
+        self.stopCollector()
+
+        self.assertEqual(
+            [record['args'][0]['expr'] for record in self.collected], ['a', 'b'])
+        self.assertEqual(self.collected[0]['pid'], os.getpid())
+        self.assertIn(
+            '[pid=%i]' % os.getpid(),
+            IceCreamDebugger().formatRecord(self.collected[0], includePid=True))
+
+    def test_flush_gives_up_without_collector(self):
+        sink = SocketSink(self.path)
+        sink.writeRecord({'timestamp': 1.0, 'pid': 1, 'args': []})
+        start = time.monotonic()
+        self.assertFalse(sink.flush(timeout=0.2))
+        sink.close(timeout=0.2)
+        self.assertLess(time.monotonic() - start, 5)
+
+    def test_flush_reports_sent_records(self):
+        self.startCollector()
+        sink = SocketSink(self.path)
+        sink.writeRecord({'timestamp': 1.0, 'pid': 1, 'args': []})
+        self.assertTrue(sink.flush(timeout=10))
+        sink.close()
+
+    def test_write_after_close_raises(self):
+        sink = SocketSink(self.path)
+        sink.close()
+        with self.assertRaises(ValueError):
+            sink.writeRecord({'timestamp': 1.0, 'pid': 1, 'args': []})
+
+    def test_collector_skips_malformed_frames(self):
+        self.startCollector()
+        collector = self.collector
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(self.path)
+            for data in [b'{"timestamp": 1', b'[1, 2]', b'{"timestamp": 2.0}']:
+                sock.sendall(FRAME_HEADER.pack(len(data)) + data)
+        sink = SocketSink(self.path)
+        sink.writeRecord({'timestamp': 3.0})
+        sink.close()
+        self.stopCollector()
+
+        self.assertEqual(
+            self.collected, [{'timestamp': 2.0}, {'timestamp': 3.0}])
+        self.assertEqual(collector.skipped, 2)
+
+
+@unittest.skipUnless(hasattr(os, 'fork'), 'requires os.fork()')
+class TestForkSafety(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def fork(self, child):
+        """Run child() in a forked child process and return its pid."""
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                child()
+                status = 0
+            finally:
+                os._exit(status)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(status, 0)
+        return pid
+
+    def test_child_does_not_duplicate_parents_buffer(self):
+        path = pjoin(self.tmpdir.name, 'ic.log')
+        sink = RotatingFileSink(path)
+        ic = IceCreamDebugger(outputFunction=sink)
+        ic(a)  # Buffered when the child's forked.
+
+        def child():
+            ic(b)
+            sink.close()
+
+        pid = self.fork(child)
+        sink.close()
+        with open(path) as f:
+            self.assertEqual(f.read().splitlines(), ['ic| a: 1'])
+        with open('%s.%i' % (path, pid)) as f:
+            self.assertEqual(f.read().splitlines(), ['ic| b: 2'])
+
+    def test_child_rotates_its_own_file(self):
+        path = pjoin(self.tmpdir.name, 'ic.log')
+        sink = RotatingFileSink(path, maxBytes=64, backupCount=1)
+        ic = IceCreamDebugger(outputFunction=sink)
+        ic(a)
+
+        def child():
+            for i in range(20):  # Rotates, compresses, and prunes.
+                ic(i)
+            sink.close()
+
+        pid = self.fork(child)
+        for i in range(5):
+            ic(b)
+        sink.close()
+        with open(path) as f:
+            lines = f.read().splitlines()
+        for segment in sink.rotatedSegments():
+            with gzip.open(segment, 'rt') as f:
+                lines.extend(f.read().splitlines())
+        self.assertEqual(sorted(lines), ['ic| a: 1'] + ['ic| b: 2'] * 5)
+        childPath = '%s.%i' % (path, pid)
+        with open(childPath) as f:
+            self.assertIn('ic| i: 19', f.read())
+        # The parent's file, and the child's and its one backup.
+        self.assertEqual(len(os.listdir(self.tmpdir.name)), 3)
+
+    def test_child_traces_to_its_own_file(self):
+        path = pjoin(self.tmpdir.name, 'ic.trace')
+        sink = BinaryTraceSink(path)
+        ic = IceCreamDebugger(outputFunction=sink)
+        ic(a)
+
+        def child():
+            ic(b)
+            sink.close()
+
+        pid = self.fork(child)
+        ic(a)
+        sink.close()
+
+        parentArgs = [r['args'][0]['expr'] for r in readBinaryTrace(path)]
+        childRecords = list(readBinaryTrace('%s.%i' % (path, pid)))
+        self.assertEqual(parentArgs, ['a', 'a'])
+        self.assertEqual([r['args'][0]['expr'] for r in childRecords], ['b'])
+        self.assertEqual(childRecords[0]['pid'], pid)
+
+    def test_child_records_to_its_own_ring(self):
+        path = pjoin(self.tmpdir.name, 'ic.ring')
+        sink = FlightRecorderSink(path, size=4096)
+        sink('parent')
+        pid = self.fork(lambda: sink('child'))
+        sink.close()
+        self.assertEqual(readFlightRecording(path), [(0, 'parent')])
+        self.assertEqual(
+            readFlightRecording('%s.%i' % (path, pid)), [(0, 'child')])
+
+    def test_child_drops_parents_recording(self):
+        outputs = []
+        ic = IceCreamDebugger(outputFunction=outputs.append)
+        ic.startRecording(maxRecords=10, dumpOnException=False)
+        ic(a)
+        childOutput = pjoin(self.tmpdir.name, 'child')
+
+        def child():
+            ic(b)
+            ic.dumpRecording()
+            with open(childOutput, 'w') as f:
+                f.write('\n'.join(outputs))
+
+        self.fork(child)
+        ic.stopRecording(dump=True)
+        self.assertEqual(outputs, ['ic| a: 1'])
+        with open(childOutput) as f:
+            self.assertEqual(f.read(), 'ic| b: 2')
+
+    def test_output_lock_is_usable_in_child(self):
+        lock = icecream.icecream.outputLock
+        held = threading.Event()
+        release = threading.Event()
+
+        def holdLock():
+            with lock:
+                held.set()
+                release.wait()
+
+        thread = threading.Thread(target=holdLock)
+        thread.start()
+        held.wait()
+        # fork() waits for the lock, so the child never inherits it held.
+        threading.Timer(0.1, release.set).start()
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', DeprecationWarning)  # Threads.
+            self.fork(lambda: icecream.icecream.stderr_print('in child'))
+        thread.join()
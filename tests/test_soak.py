@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+#
+# IceCream - Never use print() to debug again
+#
+# Ansgar Grunseid
+# grunseid.com
+# grunseid@gmail.com
+#
+# License: MIT
+#
+
+import json
+import sys
+import unittest
+
+from icecream.soak import findGrowth, main as soakMain, soak
+from tests.test_icecream import capture_standard_streams
+
+
+def sample(memory, **caches):
+    return {'memory': memory, 'caches': caches}
+
+
+class TestFindGrowth(unittest.TestCase):
+    def test_steady(self):
+        samples = [sample(100, sites=3), sample(200, sites=4)] + [
+            sample(200 + i, sites=4) for i in range(5)]
+        self.assertEqual(findGrowth(samples, warmup=2, maxGrowth=10), [])
+
+    def test_memory_growth(self):
+        samples = [sample(100 * i, sites=4) for i in range(1, 8)]
+        [problem] = findGrowth(samples, warmup=2, maxGrowth=10)
+        self.assertIn('memory grew 100 bytes per round', problem)
+
+    def test_cache_growth(self):
+        samples = [sample(100, sites=i) for i in range(1, 8)]
+        [problem] = findGrowth(samples, warmup=2, maxGrowth=10)
+        self.assertEqual(problem, 'cache sites grew from 2 to 7 entries')
+
+    def test_too_few_rounds(self):
+        self.assertEqual(findGrowth([sample(1), sample(2)], 2, 0), [])
+
+
+class TestSoak(unittest.TestCase):
+    def test_soak(self):
+        result = soak(modules=20, rounds=3, warmup=1, maxGrowth=2**20)
+        self.assertEqual(result['problems'], [])
+        self.assertEqual([s['round'] for s in result['samples']], [1, 2, 3])
+        caches = result['samples'][-1]['caches']
+        self.assertEqual(caches['sites'], 20 * 4)
+        self.assertNotIn('icecream_soak_0', sys.modules)
+
+    def test_json_output(self):
+        with capture_standard_streams() as (out, err):
+            rc = soakMain([
+                '--modules', '5', '--rounds', '2', '--warmup', '1', '--json'])
+        self.assertEqual(rc, 0)
+        self.assertEqual(len(json.loads(out.getvalue())['samples']), 2)